@@ -8,8 +8,11 @@ Many of these functions are being replaced with assertions:
 User.assert_can...
 """
 import datetime
+from django.contrib.auth.models import User
+from django.db import models
 from django.db import transaction
-from askbot.models import Repute
+from askbot import const
+from askbot.models import Post, Repute, Thread
 #from askbot.models import Answer
 from askbot.models import signals
 from askbot.conf import settings as askbot_settings
@@ -255,39 +258,139 @@ def onAnswerAcceptCanceled(answer, user, timestamp=None):
                reputation=user.reputation)
     reputation.save()
 
+def _get_question_id(post):
+    """returns id of the question post of the thread,
+    without loading the question"""
+    if post.post_type == 'question':
+        return post.id
+    thread = post.thread
+    return thread.question_post_id or thread._question_post().id
+
+def _change_vote_counts(post, score = 0, vote_up_count = 0, vote_down_count = 0):
+    """changes vote counts of the post with one atomic update,
+    the question score is denormalized on the thread as well;
+    the post object is updated to the new values;
+    vote counts are never decremented below zero"""
+    updates = {'score': models.F('score') + score}
+    post_filter = {'id': post.id}
+    post.score = int(post.score) + score
+    if vote_up_count:
+        updates['vote_up_count'] = models.F('vote_up_count') + vote_up_count
+        post.vote_up_count = max(int(post.vote_up_count) + vote_up_count, 0)
+        if vote_up_count < 0:
+            post_filter['vote_up_count__gt'] = 0
+    if vote_down_count:
+        updates['vote_down_count'] = models.F('vote_down_count') + vote_down_count
+        post.vote_down_count = max(int(post.vote_down_count) + vote_down_count, 0)
+        if vote_down_count < 0:
+            post_filter['vote_down_count__gt'] = 0
+    updated_count = Post.objects.filter(**post_filter).update(**updates)
+    if updated_count == 0 and len(post_filter) > 1:
+        #the vote count was already zero - change the score only
+        Post.objects.filter(id = post.id).update(score = updates['score'])
+
+    if post.post_type == 'question':
+        Thread.objects.filter(
+                    id = post.thread_id
+                ).update(
+                    score = models.F('score') + score
+                )
+        thread = getattr(post, '_thread_cache', None)
+        if thread is not None:
+            thread.score = post.score
+
+def _get_reputation_by_upvoted_today(user):
+    """returns reputation gained by the user today
+    through the upvotes, taken from the daily counter"""
+    counter_date = user.upvoted_reputation_date
+    if counter_date == datetime.date.today():
+        return user.upvoted_reputation_today
+    elif counter_date is None:
+        #counter was never used - count from the reputation history
+        return Repute.objects.get_reputation_by_upvoted_today(user)
+    return 0
+
+def _get_upvoted_reputation_updates(user, points, todays_rep_gain = None):
+    """returns user field updates that add ``points`` to the
+    daily counter of reputation gained by the upvotes,
+    the counter is restarted on a new day"""
+    today = datetime.date.today()
+    if user.upvoted_reputation_date == today:
+        user.upvoted_reputation_today += points
+        return {
+            'upvoted_reputation_today': \
+                models.F('upvoted_reputation_today') + points
+        }
+    if todays_rep_gain is None:
+        todays_rep_gain = _get_reputation_by_upvoted_today(user)
+    user.upvoted_reputation_today = todays_rep_gain + points
+    user.upvoted_reputation_date = today
+    return {
+        'upvoted_reputation_today': user.upvoted_reputation_today,
+        'upvoted_reputation_date': today
+    }
+
+def _change_reputation(
+                user, question_id = None, timestamp = None,
+                reputation_type = None, positive = 0, negative = 0,
+                extra_updates = None
+            ):
+    """changes reputation of the user with an atomic update,
+    like ``User.receive_reputation()`` never lets it
+    fall below the minimum, and records the change
+    in the reputation history"""
+    points = positive + negative
+    user.receive_reputation(points)
+
+    updates = {'reputation': models.F('reputation') + points}
+    updates.update(extra_updates or {})
+    users = User.objects.filter(id = user.id)
+    users.update(**updates)
+    if points < 0:
+        users.filter(
+            reputation__lt = const.MIN_REPUTATION
+        ).update(
+            reputation = const.MIN_REPUTATION
+        )
+
+    Repute.objects.create(
+                user = user,
+                positive = positive,
+                negative = negative,
+                question_id = question_id,
+                reputed_at = timestamp,
+                reputation_type = reputation_type,
+                reputation = user.reputation
+            )
+
 @transaction.commit_on_success
 def onUpVoted(vote, post, user, timestamp=None):
     if timestamp is None:
         timestamp = datetime.datetime.now()
     vote.save()
 
-    if post.post_type != 'comment':
-        post.vote_up_count = int(post.vote_up_count) + 1
-    post.score = int(post.score) + 1
-    post.save()
-
     if post.post_type == 'comment':
         #reputation is not affected by the comment votes
+        _change_vote_counts(post, score = 1)
         return
 
+    _change_vote_counts(post, score = 1, vote_up_count = 1)
+
     if not (post.wiki or post.is_anonymous):
         author = post.author
-        todays_rep_gain = Repute.objects.get_reputation_by_upvoted_today(author)
+        todays_rep_gain = _get_reputation_by_upvoted_today(author)
         if todays_rep_gain <  askbot_settings.MAX_REP_GAIN_PER_USER_PER_DAY:
-            author.receive_reputation(
-                askbot_settings.REP_GAIN_FOR_RECEIVING_UPVOTE
+            points = askbot_settings.REP_GAIN_FOR_RECEIVING_UPVOTE
+            _change_reputation(
+                author,
+                question_id = _get_question_id(post),
+                timestamp = timestamp,
+                reputation_type = 1,
+                positive = points,
+                extra_updates = _get_upvoted_reputation_updates(
+                                            author, points, todays_rep_gain
+                                        )
             )
-            author.save()
-
-            question = post.thread._question_post() # TODO: this is suboptimal if post is already a question
-
-            reputation = Repute(user=author,
-                       positive=askbot_settings.REP_GAIN_FOR_RECEIVING_UPVOTE,
-                       question=question,
-                       reputed_at=timestamp,
-                       reputation_type=1,
-                       reputation=author.reputation)
-            reputation.save()
 
 @transaction.commit_on_success
 def onUpVotedCanceled(vote, post, user, timestamp=None):
@@ -295,36 +398,24 @@ def onUpVotedCanceled(vote, post, user, timestamp=None):
         timestamp = datetime.datetime.now()
     vote.delete()
 
-    if post.post_type != 'comment':
-        post.vote_up_count = int(post.vote_up_count) - 1
-        if post.vote_up_count < 0:
-            post.vote_up_count  = 0
-
-    post.score = int(post.score) - 1
-    post.save()
-
     if post.post_type == 'comment':
         #comment votes do not affect reputation
+        _change_vote_counts(post, score = -1)
         return
 
+    _change_vote_counts(post, score = -1, vote_up_count = -1)
+
     if not (post.wiki or post.is_anonymous):
         author = post.author
-        author.receive_reputation(
-            askbot_settings.REP_LOSS_FOR_RECEIVING_UPVOTE_CANCELATION
+        points = askbot_settings.REP_LOSS_FOR_RECEIVING_UPVOTE_CANCELATION
+        _change_reputation(
+            author,
+            question_id = _get_question_id(post),
+            timestamp = timestamp,
+            reputation_type = -8,
+            negative = points,
+            extra_updates = _get_upvoted_reputation_updates(author, points)
         )
-        author.save()
-
-        question = post.thread._question_post() # TODO: this is suboptimal if post is already a question
-
-        reputation = Repute(
-            user=author,
-            negative=askbot_settings.REP_LOSS_FOR_RECEIVING_UPVOTE_CANCELATION,
-            question=question,
-            reputed_at=timestamp,
-            reputation_type=-8,
-            reputation=author.reputation
-        )
-        reputation.save()
 
 @transaction.commit_on_success
 def onDownVoted(vote, post, user, timestamp=None):
@@ -332,39 +423,24 @@ def onDownVoted(vote, post, user, timestamp=None):
         timestamp = datetime.datetime.now()
     vote.save()
 
-    post.vote_down_count = int(post.vote_down_count) + 1
-    post.score = int(post.score) - 1
-    post.save()
+    _change_vote_counts(post, score = -1, vote_down_count = 1)
 
     if not (post.wiki or post.is_anonymous):
-        author = post.author
-        author.receive_reputation(
-            askbot_settings.REP_LOSS_FOR_RECEIVING_DOWNVOTE
+        question_id = _get_question_id(post)
+        _change_reputation(
+            post.author,
+            question_id = question_id,
+            timestamp = timestamp,
+            reputation_type = -3,
+            negative = askbot_settings.REP_LOSS_FOR_RECEIVING_DOWNVOTE
         )
-        author.save()
-
-        question = post.thread._question_post() # TODO: this is suboptimal if post is already a question
-
-        reputation = Repute(user=author,
-                   negative=askbot_settings.REP_LOSS_FOR_RECEIVING_DOWNVOTE,
-                   question=question,
-                   reputed_at=timestamp,
-                   reputation_type=-3,
-                   reputation=author.reputation)
-        reputation.save()
-
-        user.receive_reputation(
-            askbot_settings.REP_LOSS_FOR_DOWNVOTING,
+        _change_reputation(
+            user,
+            question_id = question_id,
+            timestamp = timestamp,
+            reputation_type = -5,
+            negative = askbot_settings.REP_LOSS_FOR_DOWNVOTING
         )
-        user.save()
-
-        reputation = Repute(user=user,
-                   negative=askbot_settings.REP_LOSS_FOR_DOWNVOTING,
-                   question=question,
-                   reputed_at=timestamp,
-                   reputation_type=-5,
-                   reputation=user.reputation)
-        reputation.save()
 
 @transaction.commit_on_success
 def onDownVotedCanceled(vote, post, user, timestamp=None):
@@ -372,38 +448,22 @@ def onDownVotedCanceled(vote, post, user, timestamp=None):
         timestamp = datetime.datetime.now()
     vote.delete()
 
-    post.vote_down_count = int(post.vote_down_count) - 1
-    if post.vote_down_count < 0:
-        post.vote_down_count  = 0
-    post.score = post.score + 1
-    post.save()
+    _change_vote_counts(post, score = 1, vote_down_count = -1)
 
     if not (post.wiki or post.is_anonymous):
-        author = post.author
-        author.receive_reputation(
-            askbot_settings.REP_GAIN_FOR_RECEIVING_DOWNVOTE_CANCELATION
+        question_id = _get_question_id(post)
+        _change_reputation(
+            post.author,
+            question_id = question_id,
+            timestamp = timestamp,
+            reputation_type = 4,
+            positive = \
+                askbot_settings.REP_GAIN_FOR_RECEIVING_DOWNVOTE_CANCELATION
+        )
+        _change_reputation(
+            user,
+            question_id = question_id,
+            timestamp = timestamp,
+            reputation_type = 5,
+            positive = askbot_settings.REP_GAIN_FOR_CANCELING_DOWNVOTE
         )
-        author.save()
-
-        question = post.thread._question_post() # TODO: this is suboptimal if post is already a question
-
-        reputation = Repute(user=author,
-                positive=\
-                    askbot_settings.REP_GAIN_FOR_RECEIVING_DOWNVOTE_CANCELATION,
-                question=question,
-                reputed_at=timestamp,
-                reputation_type=4,
-                reputation=author.reputation
-            )
-        reputation.save()
-
-        user.receive_reputation(askbot_settings.REP_GAIN_FOR_CANCELING_DOWNVOTE)
-        user.save()
-
-        reputation = Repute(user=user,
-                   positive=askbot_settings.REP_GAIN_FOR_CANCELING_DOWNVOTE,
-                   question=question,
-                   reputed_at=timestamp,
-                   reputation_type=5,
-                   reputation=user.reputation)
-        reputation.save()
@@ -36,4 +36,7 @@ def should_show_sort_by_relevance():
     """True if configuration support sorting
     questions by search relevance
     """
-    return ('postgresql_psycopg2' in askbot.get_database_engine_name())
+    if 'postgresql_psycopg2' in askbot.get_database_engine_name():
+        return True
+    from askbot.search import inverted_index
+    return inverted_index.is_enabled()
@@ -324,6 +324,19 @@ settings.register(
     )
 )
 
+settings.register(
+    livesettings.IntegerValue(
+        EMAIL,
+        'REPLY_BY_EMAIL_ADDRESS_LIFETIME',
+        default = 30,
+        description = _('Days during which the reply addresses are valid'),
+        help_text = _(
+            'Replies to the older addresses are rejected, '
+            'command delete_expired_reply_addresses deletes them'
+        )
+    )
+)
+
 settings.register(
     livesettings.IntegerValue(
         EMAIL,
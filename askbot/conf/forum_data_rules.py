@@ -139,6 +139,43 @@ settings.register(
     )
 )
 
+settings.register(
+    livesettings.IntegerValue(
+        FORUM_DATA_RULES,
+        'VIEW_COUNT_UPDATE_DELAY',
+        default=60,
+        description=_(
+            'Delay of saving question view counts (number of seconds)'
+        ),
+        help_text=_(
+            'Question views are counted in the cache and saved to the '
+            'database by a background celery task, at most once in '
+            'this many seconds. Enter 0 to save every view immediately. '
+            'The views are also saved immediately, if the cache is not '
+            'shared with the celery workers, e.g. the local memory cache.'
+        )
+    )
+)
+
+settings.register(
+    livesettings.IntegerValue(
+        FORUM_DATA_RULES,
+        'SUMMARY_HTML_UPDATE_DELAY',
+        default=30,
+        description=_(
+            'Delay of question summary updates in the question list '
+            '(number of seconds)'
+        ),
+        help_text=_(
+            'Summaries of the questions in the list are re-rendered by '
+            'a background celery task, at most once in this many '
+            'seconds, no matter how many times the question is viewed '
+            'or voted in the meantime. Enter 0 to update the '
+            'summaries immediately.'
+        )
+    )
+)
+
 settings.register(
     livesettings.StringValue(
         FORUM_DATA_RULES,
@@ -335,6 +372,37 @@ settings.register(
     )
 )
 
+settings.register(
+    livesettings.BooleanValue(
+        FORUM_DATA_RULES,
+        'QUESTIONS_LIST_KEYSET_PAGINATION',
+        default=False,
+        description=_('Use fast pagination in the question list'),
+        help_text=_(
+            'Check to select pages of the question list by position '
+            'instead of the page offset. Deep pages load as fast as the '
+            'first one, only "previous" and "next" links are shown and '
+            'the total number of questions is approximate. '
+            'Sorting by relevance always uses the regular pagination.'
+        )
+    )
+)
+
+settings.register(
+    livesettings.IntegerValue(
+        FORUM_DATA_RULES,
+        'SEARCH_RESULT_CACHE_PAGES',
+        default=5,
+        description=_('Number of pages of the question list kept in cache'),
+        help_text=_(
+            'Order of the questions on the first pages of the frequent '
+            'searches and tag selections is kept in cache, '
+            'until the next change of the questions or tags. '
+            'Enter 0 to disable the cache.'
+        )
+    )
+)
+
 settings.register(
     livesettings.StringValue(
         FORUM_DATA_RULES,
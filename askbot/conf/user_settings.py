@@ -127,3 +127,23 @@ settings.register(
         description = _('Name for the Anonymous user')
     )
 )
+
+settings.register(
+    livesettings.IntegerValue(
+        USER_SETTINGS,
+        'LAST_SEEN_UPDATE_DELAY',
+        default = 300,
+        description = _(
+            'Delay of saving the last visit time of the users '
+            '(number of seconds)'
+        ),
+        help_text = _(
+            'Last visit time is kept in the cache and the visits of all '
+            'users are saved by a background celery task at most once in '
+            'this many seconds. The first visit of the day is always saved '
+            'immediately. Enter 0 to save every visit. The visits are also '
+            'saved immediately, if the cache is not shared with the celery '
+            'workers, e.g. the local memory cache.'
+        )
+    )
+)
@@ -1,8 +1,8 @@
 """functions that send email in askbot
 these automatically catch email-related exceptions
 """
+import itertools
 import os
-import smtplib
 import logging
 from django.core import mail
 from django.conf import settings as django_settings
@@ -18,6 +18,10 @@ from askbot.utils import url_utils
 from askbot.utils.file_utils import store_file
 #todo: maybe send_mail functions belong to models
 #or the future API
+
+#number of messages sent over one connection by send_mail_batch()
+EMAIL_BATCH_SIZE = 100
+
 def prefix_the_subject_line(subject):
     """prefixes the subject line with the
     EMAIL_SUBJECT_LINE_PREFIX either from
@@ -89,7 +93,8 @@ def send_mail(
         ):
     """
     todo: remove parameters not relevant to the function
-    sends email message
+    adds email message to the outgoing queue, the messages
+    are sent by the ``send_queued_email`` management command
     logs email sending activity
     and any errors are reported as critical
     in the main log file
@@ -98,20 +103,21 @@ def send_mail(
     are. related_object (if given, will be saved in
     the activity record)
 
-    if raise_on_failure is True, exceptions.EmailNotSent is raised
+    if raise_on_failure is True, the message is sent immediately
+    and exceptions.EmailNotSent is raised on failure.
+    Messages are also sent immediately when the
+    ``ASKBOT_EMAIL_QUEUE_ALWAYS_EAGER`` setting is True
     """
     try:
         assert(subject_line is not None)
-        subject_line = prefix_the_subject_line(subject_line)
-        msg = mail.EmailMessage(
-                        subject_line, 
-                        body_text, 
-                        from_email,
-                        recipient_list,
+        msg = make_message(
+                        subject_line = subject_line,
+                        body_text = body_text,
+                        from_email = from_email,
+                        recipient_list = recipient_list,
                         headers = headers
                     )
-        msg.content_subtype = 'html'
-        msg.send()
+        deliver_message(msg, send_now = raise_on_failure)
         if related_object is not None:
             assert(activity_type is not None)
     except Exception, error:
@@ -119,6 +125,105 @@ def send_mail(
         if raise_on_failure == True:
             raise exceptions.EmailNotSent(unicode(error))
 
+def deliver_message(message, send_now = False):
+    """adds the message to the outgoing queue, or sends
+    it immediately, if ``send_now`` is True or setting
+    ``ASKBOT_EMAIL_QUEUE_ALWAYS_EAGER`` is True"""
+    from askbot.mail import queue
+    if send_now or queue.is_eager():
+        message.send()
+    else:
+        queue.QueuedEmail.objects.enqueue(message)
+
+def make_message(
+            subject_line = None,
+            body_text = None,
+            from_email = django_settings.DEFAULT_FROM_EMAIL,
+            recipient_list = None,
+            headers = None
+        ):
+    """returns html email message with the prefixed subject line"""
+    msg = mail.EmailMessage(
+                    prefix_the_subject_line(subject_line),
+                    body_text,
+                    from_email,
+                    recipient_list,
+                    headers = headers
+                )
+    msg.content_subtype = 'html'
+    return msg
+
+def send_mail_batch(
+            messages = None,
+            batch_size = None,
+            description = 'email'
+        ):
+    """sends email messages in batches, each batch
+    over a single connection, returns numbers of
+    the sent and the failed messages
+
+    ``messages`` can be any iterable, e.g. a generator,
+    then only one batch of messages is held in memory.
+
+    failures of single messages do not stop the sending,
+    the progress and the failures are logged per batch
+    """
+    batch_size = batch_size or EMAIL_BATCH_SIZE
+    sent_count = 0
+    failed_count = 0
+    messages = iter(messages)
+    for batch_no in itertools.count(1):
+        batch = list(itertools.islice(messages, batch_size))
+        if len(batch) == 0:
+            break
+
+        batch_failed_count = 0
+        connection = mail.get_connection()
+        try:
+            connection.open()
+        except Exception, error:
+            logging.critical(
+                '%s batch %d: could not connect: %s' % (
+                    description, batch_no, unicode(error)
+                )
+            )
+            failed_count += len(batch)
+            continue
+
+        try:
+            for message in batch:
+                try:
+                    connection.send_messages([message])
+                except Exception, error:
+                    batch_failed_count += 1
+                    logging.critical(
+                        '%s to %s not sent: %s' % (
+                            description,
+                            ', '.join(message.recipients()),
+                            unicode(error)
+                        )
+                    )
+                    #the connection may be broken, start a new one
+                    connection.close()
+                    try:
+                        connection.open()
+                    except Exception:
+                        pass
+        finally:
+            connection.close()
+
+        sent_count += len(batch) - batch_failed_count
+        failed_count += batch_failed_count
+        logging.info(
+            '%s batch %d: %d sent, %d failed' % (
+                description,
+                batch_no,
+                len(batch) - batch_failed_count,
+                batch_failed_count
+            )
+        )
+    return sent_count, failed_count
+
 def mail_moderators(
             subject_line = '',
             body_text = '',
@@ -139,8 +244,14 @@ def mail_moderators(
         from_email = django_settings.DEFAULT_FROM_EMAIL
 
     try:
-        mail.send_mail(subject_line, body_text, from_email, recipient_list)
-    except smtplib.SMTPException, error:
+        message = mail.EmailMessage(
+                            subject_line,
+                            body_text,
+                            from_email,
+                            list(recipient_list)
+                        )
+        deliver_message(message, send_now = raise_on_failure)
+    except Exception, error:
         logging.critical(unicode(error))
         if raise_on_failure == True:
             raise exceptions.EmailNotSent(unicode(error))
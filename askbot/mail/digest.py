@@ -0,0 +1,631 @@
+"""digest engine for the delayed email alerts,
+sent by the ``send_email_alerts`` management command
+
+the questions with unseen updates are loaded once for all users,
+their revisions, answers and comments - once per chunk of users,
+then the questions are distributed to the users in memory through
+their subscriptions: followed, asked, answered, tag-filtered
+questions and the comments and mentions addressed to the users
+"""
+import datetime
+from django.contrib.contenttypes.models import ContentType
+from django.utils.datastructures import SortedDict
+from askbot import const
+from askbot.conf import settings as askbot_settings
+from askbot.models import Activity, ActivityAuditStatus, EmailFeedSetting
+from askbot.models import MarkedTag, Post, PostRevision, QuestionView, Thread
+from askbot.models.tag import get_email_tag_filter
+from askbot.utils.lists import batch_size
+
+#maximum number of parameters in the "IN" lookups
+MAX_IN_LOOKUP_SIZE = 500
+
+#time of the email activity for the questions never emailed about
+NEVER_EMAILED = datetime.datetime(1970, 1, 1)
+
+#todo: refactor this as class
+def extend_question_list(
+                    src, dst, cutoff_time = None,
+                    limit=False, add_mention=False,
+                    add_comment = False
+                ):
+    """src is a list of question ids
+    or None
+    dst - is an ordered dictionary
+    update reporting cutoff time for each question
+    to the latest value to be more permissive about updates
+    """
+    if src is None:
+        return #will not do anything if subscription of this type is not used
+    if limit and len(dst.keys()) >= askbot_settings.MAX_ALERTS_PER_EMAIL:
+        return
+    if cutoff_time is None:
+        raise ValueError('cutoff_time is a mandatory parameter')
+
+    for q in src:
+        if q in dst:
+            meta_data = dst[q]
+        else:
+            meta_data = {'cutoff_time': cutoff_time}
+            dst[q] = meta_data
+
+        if cutoff_time > meta_data['cutoff_time']:
+            #the latest cutoff time wins for a given question
+            #if the question falls into several subscription groups
+            #this makes mailer more eager in sending email
+            meta_data['cutoff_time'] = cutoff_time
+        if add_mention:
+            if 'mentions' in meta_data:
+                meta_data['mentions'] += 1
+            else:
+                meta_data['mentions'] = 1
+        if add_comment:
+            if 'comments' in meta_data:
+                meta_data['comments'] += 1
+            else:
+                meta_data['comments'] = 1
+
+def filter_in(query_set, field_name, values):
+    """yields results of the query set filtered by
+    ``field_name__in = values`` running one query
+    per chunk of the values"""
+    values = list(values)
+    for chunk in batch_size(values, MAX_IN_LOOKUP_SIZE):
+        for item in query_set.filter(**{field_name + '__in': chunk}):
+            yield item
+
+def group_by_first(rows):
+    """dictionary of lists of the rows,
+    without the first value, by the first value"""
+    groups = dict()
+    for row in rows:
+        groups.setdefault(row[0], list()).append(row[1:])
+    return groups
+
+
+class DigestEngine(object):
+    """finds updated questions to report to the users
+    in the email digests
+
+    call :meth:`load_questions` once, then :meth:`get_digests`
+    for the chunks of users
+    """
+
+    def __init__(self, save_changes = True):
+        """if ``save_changes`` is False, the digests are
+        calculated, but the feeds are not marked as reported,
+        missing subscriptions are not added and the
+        email activity is not recorded"""
+        self.save_changes = save_changes
+        self.post_content_type = ContentType.objects.get_for_model(Post)
+        self.questions = list()
+        self.question_data = dict()
+        self.question_ids_by_thread = dict()
+        self.question_ids_by_author = dict()
+        self.question_ids_by_tag = dict()
+
+    def load_questions(self, since):
+        """loads questions updated after ``since``, which
+        are not deleted, not closed and approved, if content
+        is moderated, ordered by the time of the latest activity"""
+        questions = Post.objects.get_questions().exclude(
+                                deleted = True
+                            ).exclude(
+                                thread__closed = True
+                            ).filter(
+                                thread__last_activity_at__gte = since
+                            )
+        if askbot_settings.ENABLE_CONTENT_MODERATION:
+            questions = questions.filter(approved = True)
+
+        question_data = questions.order_by(
+                                '-thread__last_activity_at'
+                            ).values_list(
+                                'id',
+                                'thread',
+                                'author',
+                                'added_at',
+                                'thread__last_activity_at',
+                                'thread__last_activity_by',
+                                'thread__tagnames'
+                            )
+        for position, row in enumerate(question_data):
+            question = self.add_question_data(row)
+            question['position'] = position
+            self.questions.append(question)
+            self.question_ids_by_thread[question['thread_id']] = question['id']
+            self.question_ids_by_author.setdefault(
+                                    question['author_id'], list()
+                                ).append(question['id'])
+            for tag_name in question['tag_names']:
+                self.question_ids_by_tag.setdefault(
+                                    tag_name, list()
+                                ).append(question['id'])
+
+    def add_question_data(self, row):
+        (question_id, thread_id, author_id, added_at,
+            last_activity_at, last_activity_by_id, tagnames) = row
+        question = {
+            'id': question_id,
+            'thread_id': thread_id,
+            'author_id': author_id,
+            'added_at': added_at,
+            'last_activity_at': last_activity_at,
+            'last_activity_by_id': last_activity_by_id,
+            'tag_names': set(tagnames.split()),
+            'position': None
+        }
+        self.question_data[question_id] = question
+        return question
+
+    def load_extra_questions(self, thread_ids):
+        """loads data of the questions not loaded by
+        :meth:`load_questions`, e.g. the closed questions
+        """
+        thread_ids = set(thread_ids) - set(self.question_ids_by_thread)
+        thread_ids.discard(None)
+        questions = Post.objects.get_questions().values_list(
+                                'id',
+                                'thread',
+                                'author',
+                                'added_at',
+                                'thread__last_activity_at',
+                                'thread__last_activity_by',
+                                'thread__tagnames'
+                            )
+        for row in filter_in(questions, 'thread', thread_ids):
+            question = self.add_question_data(row)
+            self.question_ids_by_thread[question['thread_id']] = question['id']
+
+    def get_ordered(self, question_ids):
+        """sorts ids of the loaded questions by the latest
+        activity, skips questions that were not loaded"""
+        questions = [
+            self.question_data[question_id]
+            for question_id in set(question_ids)
+            if question_id in self.question_data
+            and self.question_data[question_id]['position'] is not None
+        ]
+        questions.sort(key = lambda question: question['position'])
+        return questions
+
+    def load_feeds(self, users):
+        """returns ripe feeds, other than instant, by user id,
+        only users with some feed to be reported now are included
+        """
+        need_feed_types = set(EmailFeedSetting.FEED_TYPES)
+        feeds_by_user = dict()
+        for feed in filter_in(EmailFeedSetting.objects.all(), 'subscriber', [u.id for u in users]):
+            feeds_by_user.setdefault(feed.subscriber_id, list()).append(feed)
+
+        if self.save_changes:
+            for user in users:
+                feeds = feeds_by_user.get(user.id, list())
+                have_feed_types = set([feed.feed_type for feed in feeds])
+                if need_feed_types - have_feed_types:
+                    user.add_missing_askbot_subscriptions()
+                    feeds_by_user[user.id] = list(
+                        EmailFeedSetting.objects.filter(subscriber = user)
+                    )
+
+        ripe_feeds_by_user = dict()
+        for user_id, feeds in feeds_by_user.items():
+            feeds = [feed for feed in feeds if feed.frequency not in ('n', 'i')]
+            for feed in feeds:
+                if feed.should_send_now():
+                    ripe_feeds_by_user[user_id] = feeds
+                    break
+        return ripe_feeds_by_user
+
+    def load_user_data(self, user_ids, m_and_c_user_ids):
+        """loads data about the users relations to the questions,
+        returns a dictionary of dictionaries by user id"""
+        data = dict()
+
+        views = QuestionView.objects.values_list('who', 'question', 'when')
+        views_by_user = dict()
+        for user_id, question_id, when in filter_in(views, 'who', user_ids):
+            user_views = views_by_user.setdefault(user_id, dict())
+            user_views.setdefault(question_id, list()).append(when)
+        data['views'] = views_by_user
+
+        follows = Thread.followed_by.through.objects.values_list('user', 'thread')
+        data['followed'] = group_by_first(filter_in(follows, 'user', user_ids))
+
+        answers = Post.objects.get_answers().values_list('author', 'thread')
+        data['answered'] = group_by_first(filter_in(answers, 'author', user_ids))
+
+        marks = MarkedTag.objects.values_list('user', 'reason', 'tag__name')
+        data['marked_tags'] = group_by_first(filter_in(marks, 'user', user_ids))
+
+        emails = Activity.objects.filter(
+                                content_type = self.post_content_type,
+                                activity_type = const.TYPE_ACTIVITY_EMAIL_UPDATE_SENT
+                            ).values_list('user', 'object_id', 'id', 'active_at')
+        emails_by_user = dict()
+        for user_id, question_id, activity_id, active_at in \
+                                    filter_in(emails, 'user', user_ids):
+            emails_by_user.setdefault(user_id, dict())[question_id] = \
+                                                    (activity_id, active_at)
+        data['emails'] = emails_by_user
+
+        #comments and mentions, they are needed for the
+        #users with the comments and mentions feed only
+        mentions = ActivityAuditStatus.objects.filter(
+                                activity__activity_type = const.TYPE_ACTIVITY_MENTION,
+                                activity__is_auditted = False,
+                            ).values_list(
+                                'user', 'activity__active_at', 'activity__object_id'
+                            )
+        mentions = list(filter_in(mentions, 'user', m_and_c_user_ids))
+        #mentioned posts to threads of their questions
+        mentioned_post_ids = set([mention[2] for mention in mentions])
+        mentioned_posts = Post.objects.values_list('id', 'thread')
+        post_threads = dict(filter_in(mentioned_posts, 'id', mentioned_post_ids))
+        data['mentions'] = group_by_first([
+            (user_id, active_at, post_threads.get(post_id))
+            for user_id, active_at, post_id in mentions
+        ])
+
+        comments = Post.objects.get_comments().order_by('id').values_list(
+                                'parent__author', 'author', 'added_at', 'thread'
+                            )
+        comments = [
+            comment for comment in filter_in(comments, 'parent__author', m_and_c_user_ids)
+            if comment[0] != comment[1]
+        ]
+        data['comments'] = group_by_first(comments)
+        self.load_extra_questions([comment[3] for comment in comments])
+
+        return data
+
+    def split_by_views(self, questions, user, views):
+        """returns two lists of ids of the questions updated
+        not by the user after they joined - those the user
+        has not seen and those seen before the last change"""
+        not_seen = list()
+        seen_before_last_change = list()
+        for question in questions:
+            if question['last_activity_by_id'] == user.id:
+                continue
+            if question['last_activity_at'] < user.date_joined:
+                continue
+            if question['id'] not in views:
+                not_seen.append(question['id'])
+            else:
+                last_activity_at = question['last_activity_at']
+                for when in views[question['id']]:
+                    if when < last_activity_at:
+                        seen_before_last_change.append(question['id'])
+                        break
+        return not_seen, seen_before_last_change
+
+    def get_tag_filtered_questions(self, user, marked_tags, views):
+        """equivalent of ``User.get_tag_filtered_questions()``,
+        returns lists of ids of the not seen questions and of the
+        seen before the last change"""
+        limit = askbot_settings.MAX_ALERTS_PER_EMAIL
+        strategy = user.email_tag_filter_strategy
+        if strategy == const.INCLUDE_INTERESTING:
+            if askbot_settings.SUBSCRIBED_TAG_SELECTOR_ENABLED:
+                reason = 'subscribed'
+                wildcards = user.subscribed_tags.strip().split()
+            else:
+                reason = 'good'
+                wildcards = user.interesting_tags.strip().split()
+            tag_names = set([
+                tag_name for tag_reason, tag_name in marked_tags
+                if tag_reason == reason
+            ])
+            if wildcards:
+                prefixes = tuple([wildcard[:-1] for wildcard in wildcards])
+                for tag_name in self.question_ids_by_tag:
+                    if tag_name.startswith(prefixes):
+                        tag_names.add(tag_name)
+            question_ids = list()
+            for tag_name in tag_names:
+                question_ids.extend(self.question_ids_by_tag.get(tag_name, ()))
+            questions = self.get_ordered(question_ids)
+            not_seen, seen = self.split_by_views(questions, user, views)
+            return not_seen[:limit], seen[:limit]
+        elif strategy == const.EXCLUDE_IGNORED:
+            tag_filter = get_email_tag_filter(user, marked_tags)
+            not_seen = list()
+            seen = list()
+            for question in self.questions:
+                if len(not_seen) >= limit and len(seen) >= limit:
+                    break
+                if question['last_activity_at'] < user.date_joined:
+                    break#questions are ordered by the last activity
+                if tag_filter(question['tag_names']) == False:
+                    continue
+                question_not_seen, question_seen = \
+                        self.split_by_views([question], user, views)
+                not_seen.extend(question_not_seen)
+                seen.extend(question_seen)
+            return not_seen[:limit], seen[:limit]
+        else:
+            return None, None
+
+    def get_question_list(self, user, feeds, data):
+        """returns ordered dictionary of the questions
+        to report to the user - question id to meta data
+        and the list of the reported feeds
+        """
+        views = data['views'].get(user.id, dict())
+        limit = askbot_settings.MAX_ALERTS_PER_EMAIL
+
+        def split(question_ids):
+            return self.split_by_views(self.get_ordered(question_ids), user, views)
+
+        #ids of the questions by feed type, not seen and seen before last change
+        q_sel = q_ask = q_ans = q_all = (None, None)
+        reported_feeds = list()
+        for feed in feeds:
+            if feed.feed_type == 'm_and_c':
+                #alerts on mentions and comments are processed separately
+                #because comments to questions do not trigger change of last_updated
+                continue
+            if feed.should_send_now() == False:
+                continue
+            reported_feeds.append(feed)
+            feed.cutoff_time = feed.get_previous_report_cutoff_time()
+
+            if feed.feed_type == 'q_sel':
+                followed = data['followed'].get(user.id, ())
+                q_sel = split([
+                    self.question_ids_by_thread.get(thread_id)
+                    for (thread_id,) in followed
+                ])
+            elif feed.feed_type == 'q_ask':
+                q_ask = split(self.question_ids_by_author.get(user.id, ()))
+            elif feed.feed_type == 'q_ans':
+                answered = data['answered'].get(user.id, ())
+                not_seen, seen = split([
+                    self.question_ids_by_thread.get(thread_id)
+                    for (thread_id,) in answered
+                ])
+                q_ans = (not_seen[:limit], seen[:limit])
+            elif feed.feed_type == 'q_all':
+                marked_tags = data['marked_tags'].get(user.id, ())
+                q_all = self.get_tag_filtered_questions(user, marked_tags, views)
+
+        cutoff_times = dict([
+            (feed.feed_type, feed.cutoff_time) for feed in reported_feeds
+        ])
+
+        #build ordered list questions for the email report
+        q_list = SortedDict()
+
+        for question_ids in q_sel:
+            extend_question_list(
+                question_ids, q_list, cutoff_time = cutoff_times.get('q_sel')
+            )
+
+        #comments and mentions are collected separately,
+        #because posts are not marked as changed when people add comments
+        for feed in feeds:
+            if feed.feed_type == 'm_and_c' and feed.should_send_now():
+                cutoff_time = feed.get_previous_report_cutoff_time()
+                q_commented = [
+                    self.question_ids_by_thread[thread_id]
+                    for author_id, added_at, thread_id
+                    in data['comments'].get(user.id, ())
+                    if added_at < cutoff_time
+                    and thread_id in self.question_ids_by_thread
+                ]
+                extend_question_list(
+                                q_commented,
+                                q_list,
+                                cutoff_time = cutoff_time,
+                                add_comment = True
+                            )
+                mentioned_question_ids = [
+                    self.question_ids_by_thread.get(thread_id)
+                    for mentioned_at, thread_id
+                    in data['mentions'].get(user.id, ())
+                    if mentioned_at < cutoff_time
+                ]
+                for question_ids in split(mentioned_question_ids):
+                    extend_question_list(
+                                question_ids,
+                                q_list,
+                                cutoff_time = cutoff_time,
+                                add_mention = True
+                            )
+
+        if user.email_tag_filter_strategy == const.INCLUDE_INTERESTING:
+            for question_ids in q_all:
+                extend_question_list(
+                    question_ids, q_list, cutoff_time = cutoff_times.get('q_all')
+                )
+
+        for feed_type, question_lists in (('q_ask', q_ask), ('q_ans', q_ans)):
+            for question_ids in question_lists:
+                extend_question_list(
+                    question_ids,
+                    q_list,
+                    cutoff_time = cutoff_times.get(feed_type),
+                    limit = True
+                )
+
+        if user.email_tag_filter_strategy == const.EXCLUDE_IGNORED:
+            for question_ids in q_all:
+                extend_question_list(
+                    question_ids,
+                    q_list,
+                    cutoff_time = cutoff_times.get('q_all'),
+                    limit = True
+                )
+
+        return q_list, reported_feeds
+
+    def load_news(self, question_ids):
+        """loads revisions and answers of the questions,
+        returns a dictionary of dictionaries by question id"""
+        question_ids = list(question_ids)
+        thread_to_question = dict([
+            (self.question_data[question_id]['thread_id'], question_id)
+            for question_id in question_ids
+        ])
+        news = dict([
+            (
+                question_id,
+                {'q_rev': list(), 'new_ans': list(), 'ans_rev': list()}
+            )
+            for question_id in question_ids
+        ])
+
+        question_revisions = PostRevision.objects.question_revisions(
+                                ).order_by(
+                                    '-revision'
+                                ).values_list('post', 'author', 'revised_at')
+        for question_id, author_id, revised_at in \
+                        filter_in(question_revisions, 'post', question_ids):
+            news[question_id]['q_rev'].append((author_id, revised_at))
+
+        answers = Post.objects.get_answers().filter(
+                                deleted = False
+                            ).values_list('thread', 'author', 'added_at')
+        for thread_id, author_id, added_at in \
+                        filter_in(answers, 'thread', thread_to_question):
+            question_id = thread_to_question[thread_id]
+            news[question_id]['new_ans'].append((author_id, added_at))
+
+        answer_revisions = PostRevision.objects.answer_revisions().filter(
+                                post__deleted = False
+                            ).values_list('post__thread', 'author', 'revised_at')
+        for thread_id, author_id, revised_at in \
+                        filter_in(answer_revisions, 'post__thread', thread_to_question):
+            question_id = thread_to_question[thread_id]
+            news[question_id]['ans_rev'].append((author_id, revised_at))
+
+        return news
+
+    def get_digests(self, users):
+        """returns list of pairs of users and ordered dictionaries
+        of the question posts with updates to report to them - to the
+        meta data with counts of the updates,
+        the feeds are marked as reported
+        and the email activity is recorded
+        """
+        feeds_by_user = self.load_feeds(users)
+        users = [user for user in users if user.id in feeds_by_user]
+        if len(users) == 0:
+            return list()
+
+        m_and_c_user_ids = list()
+        for user in users:
+            for feed in feeds_by_user[user.id]:
+                if feed.feed_type == 'm_and_c' and feed.should_send_now():
+                    m_and_c_user_ids.append(user.id)
+        data = self.load_user_data([user.id for user in users], m_and_c_user_ids)
+
+        question_lists = list()
+        reported_feed_ids = list()
+        news_question_ids = set()
+        for user in users:
+            q_list, reported_feeds = self.get_question_list(
+                                            user, feeds_by_user[user.id], data
+                                        )
+            reported_feed_ids.extend([feed.id for feed in reported_feeds])
+
+            #skip questions if we need to wait longer because
+            #the delay before the next email has not yet elapsed
+            #or if last email was sent after the most recent modification
+            emails = data['emails'].get(user.id, dict())
+            for question_id, meta_data in q_list.items():
+                activity_id, emailed_at = emails.get(
+                                        question_id, (None, NEVER_EMAILED)
+                                    )
+                meta_data['emailed_at'] = emailed_at
+                meta_data['email_activity_id'] = activity_id
+                question = self.question_data[question_id]
+                if emailed_at > meta_data['cutoff_time'] \
+                    or emailed_at > question['last_activity_at']:
+                    meta_data['skip'] = True
+                else:
+                    meta_data['skip'] = False
+                    news_question_ids.add(question_id)
+            question_lists.append((user, q_list))
+
+        if self.save_changes and reported_feed_ids:
+            now = datetime.datetime.now()
+            for feed_ids in batch_size(reported_feed_ids, MAX_IN_LOOKUP_SIZE):
+                EmailFeedSetting.objects.filter(
+                                    id__in = feed_ids
+                                ).update(reported_at = now)
+
+        news = self.load_news(news_question_ids)
+
+        #collect info on all sorts of news that happened after
+        #the most recent emailing to the user about the question
+        now = datetime.datetime.now()
+        updated_activity_ids = list()
+        reported_question_ids = set()
+        for user, q_list in question_lists:
+            for question_id, meta_data in q_list.items():
+                if meta_data['skip']:
+                    continue
+                emailed_at = meta_data['emailed_at']
+                question_news = news[question_id]
+
+                q_rev = [
+                    revised_at for author_id, revised_at in question_news['q_rev']
+                    if revised_at > emailed_at and author_id != user.id
+                ]
+                meta_data['q_rev'] = len(q_rev)
+                added_at = self.question_data[question_id]['added_at']
+                if len(q_rev) > 0 and added_at == q_rev[0]:
+                    meta_data['q_rev'] = 0
+                    meta_data['new_q'] = True
+                else:
+                    meta_data['new_q'] = False
+
+                meta_data['new_ans'] = len([
+                    added_at for author_id, added_at in question_news['new_ans']
+                    if added_at > emailed_at and author_id != user.id
+                ])
+                meta_data['ans_rev'] = len([
+                    revised_at for author_id, revised_at in question_news['ans_rev']
+                    if revised_at > emailed_at and author_id != user.id
+                ])
+
+                #finally skip question if there are no news indeed
+                if len(q_rev) + meta_data['new_ans'] + meta_data['ans_rev'] \
+                    + meta_data.get('comments', 0) + meta_data.get('mentions', 0) == 0:
+                    meta_data['skip'] = True
+                    continue
+
+                reported_question_ids.add(question_id)
+                if self.save_changes:
+                    #keep a record of latest email activity per question per user
+                    if meta_data['email_activity_id']:
+                        updated_activity_ids.append(meta_data['email_activity_id'])
+                    else:
+                        Activity(
+                            user = user,
+                            content_type = self.post_content_type,
+                            object_id = question_id,
+                            activity_type = const.TYPE_ACTIVITY_EMAIL_UPDATE_SENT,
+                            active_at = now
+                        ).save()
+
+        for activity_ids in batch_size(updated_activity_ids, MAX_IN_LOOKUP_SIZE):
+            Activity.objects.filter(id__in = activity_ids).update(active_at = now)
+
+        questions = Post.objects.select_related('thread')
+        questions = dict([
+            (question.id, question)
+            for question in filter_in(questions, 'id', reported_question_ids)
+        ])
+
+        digests = list()
+        for user, q_list in question_lists:
+            question_posts = SortedDict()
+            for question_id, meta_data in q_list.items():
+                if meta_data['skip'] == False:
+                    question_posts[questions[question_id]] = meta_data
+            if len(question_posts) > 0:
+                digests.append((user, question_posts))
+        return digests
@@ -0,0 +1,359 @@
+"""streaming reader of the inbound email messages
+
+the message is read line by line from a file, the MIME parts
+are decoded as they are read, the attachments are written to the
+temporary files and the size limits are checked before anything
+is buffered, so memory use does not depend on the message size
+
+:func:`read_message` returns :class:`InboundMessage`, which can be
+passed to the lamson handlers in place of the lamson message,
+the parts have the same format as returned by
+:func:`askbot.mail.lamson_handlers.get_parts`
+"""
+import binascii
+import email.errors
+import email.header
+import email.parser
+import email.utils
+import logging
+import tempfile
+from django.conf import settings as django_settings
+from django.core.files import File
+
+#longer lines are read in pieces
+MAX_LINE_LENGTH = 64*1024
+
+#attachments up to this size are spooled in memory
+SPOOL_MEMORY_SIZE = 64*1024
+
+def get_max_message_size():
+    return getattr(
+        django_settings, 'ASKBOT_MAX_INBOUND_EMAIL_SIZE', 10*1024*1024
+    )
+
+def get_max_attachment_size():
+    return getattr(django_settings, 'ASKBOT_MAX_UPLOAD_FILE_SIZE', 1024*1024)
+
+def get_spool_maildir():
+    """path to the Maildir where lamson puts the received messages
+    for the ``process_inbound_email`` command, if None - the messages
+    are processed by lamson right away"""
+    return getattr(django_settings, 'ASKBOT_INBOUND_EMAIL_MAILDIR', None)
+
+
+class MessageTooLarge(ValueError):
+    """raised when the message exceeds the size limit"""
+    pass
+
+
+class LineReader(object):
+    """reads lines of the message, counts the read bytes
+    and allows to return the last line back"""
+    def __init__(self, fp, max_size):
+        self.fp = fp
+        self.max_size = max_size
+        self.size = 0
+        self.pushed_line = None
+
+    def readline(self):
+        if self.pushed_line is not None:
+            line = self.pushed_line
+            self.pushed_line = None
+            return line
+        line = self.fp.readline(MAX_LINE_LENGTH)
+        self.size += len(line)
+        if self.size > self.max_size:
+            raise MessageTooLarge(
+                'message is larger than %d bytes' % self.max_size
+            )
+        return line
+
+    def push_back(self, line):
+        self.pushed_line = line
+
+
+def split_line_end(line):
+    """returns line content and True if the line ends with newline"""
+    if line.endswith('\r\n'):
+        return line[:-2], True
+    elif line.endswith('\n'):
+        return line[:-1], True
+    return line, False
+
+
+class Base64Decoder(object):
+    def __init__(self):
+        self.remainder = ''
+
+    def decode(self, content):
+        data = self.remainder + ''.join(content.split())
+        complete_length = len(data) - len(data) % 4
+        self.remainder = data[complete_length:]
+        try:
+            return binascii.a2b_base64(data[:complete_length]), False
+        except binascii.Error:
+            return '', False
+
+
+class QuotedPrintableDecoder(object):
+    def decode(self, content):
+        #soft line break - the line continues
+        if content.endswith('='):
+            return binascii.a2b_qp(content[:-1]), False
+        return binascii.a2b_qp(content), True
+
+
+class PlainDecoder(object):
+    def decode(self, content):
+        return content, True
+
+
+def get_decoder(encoding):
+    encoding = (encoding or '').strip().lower()
+    if encoding == 'base64':
+        return Base64Decoder()
+    elif encoding == 'quoted-printable':
+        return QuotedPrintableDecoder()
+    return PlainDecoder()
+
+
+class TextSink(object):
+    """collects decoded text of the message body"""
+    def __init__(self, charset):
+        self.charset = charset or 'utf-8'
+        self.chunks = list()
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    def get_content(self):
+        data = ''.join(self.chunks)
+        try:
+            return data.decode(self.charset, 'replace')
+        except LookupError:
+            return data.decode('utf-8', 'replace')
+
+
+class FileSink(object):
+    """writes the attachment to a temporary file,
+    stops writing when the size limit is exceeded"""
+    def __init__(self, name, content_type, max_size):
+        self.name = name
+        self.content_type = content_type
+        self.max_size = max_size
+        self.size = 0
+        self.too_large = False
+        self.file = tempfile.SpooledTemporaryFile(SPOOL_MEMORY_SIZE)
+
+    def write(self, data):
+        if self.too_large:
+            return
+        self.size += len(data)
+        if self.size > self.max_size:
+            self.too_large = True
+            self.file.close()
+            return
+        self.file.write(data)
+
+    def get_content(self):
+        if self.too_large:
+            logging.info(
+                'attachment %s of inbound email is larger than %d bytes '
+                'and is not saved' % (self.name, self.max_size)
+            )
+            return None
+        self.file.seek(0)
+        attachment = File(self.file, name = self.name)
+        attachment.size = self.size
+        attachment.content_type = self.content_type
+        return attachment
+
+
+class NullSink(object):
+    """discards the parts, which are not used"""
+    def write(self, data):
+        pass
+
+    def get_content(self):
+        return None
+
+
+def decode_header_value(value):
+    """returns unicode value of the RFC 2047 encoded header"""
+    if value is None:
+        return None
+    try:
+        return unicode(email.header.make_header(email.header.decode_header(value)))
+    except (email.errors.HeaderParseError, LookupError, UnicodeError):
+        return value.decode('utf-8', 'replace')
+
+
+def get_part_type(headers):
+    """same classification as in the lamson handlers -
+    'body', 'attachment', 'inline' or None"""
+    disposition = (headers.get('Content-Disposition') or '').split(';')[0]
+    disposition = disposition.strip().lower()
+    content_type = headers.get_content_type()
+    if content_type == 'text/plain' and disposition != 'attachment':
+        return 'body'
+    elif disposition in ('attachment', 'inline'):
+        return disposition
+    return None
+
+
+class InboundMessage(object):
+    """message read by :func:`read_message`, with the attributes used by
+    the lamson handlers: ``From``, ``base`` and the header values by key,
+    the parts are in the ``parts`` list"""
+
+    def __init__(self, headers, parts):
+        self.headers = headers
+        self.parts = parts
+        self.From = email.utils.parseaddr(headers.get('From', ''))[1]
+        self.base = {
+            'to': headers.get('To', ''),
+            'from': headers.get('From', '')
+        }
+
+    def __getitem__(self, key):
+        return decode_header_value(self.headers.get(key))
+
+    def get_recipients(self):
+        """envelope recipient, if known, or addresses
+        in the To and Cc headers; the topmost ``X-Original-To``
+        is the one added when the message was spooled, the
+        ``Delivered-To`` may be left from a forwarding on the way"""
+        for header in ('X-Original-To', 'Delivered-To'):
+            if header in self.headers:
+                return [email.utils.parseaddr(self.headers[header])[1]]
+        values = self.headers.get_all('To', []) + self.headers.get_all('Cc', [])
+        return [address for name, address in email.utils.getaddresses(values)]
+
+    def close(self):
+        """removes the temporary files of the attachments"""
+        for part_type, content in self.parts:
+            if isinstance(content, File):
+                content.close()
+
+
+class MessageReader(object):
+    def __init__(self, fp, max_size, max_attachment_size):
+        self.lines = LineReader(fp, max_size)
+        self.max_attachment_size = max_attachment_size
+        self.parts = list()
+
+    def read_headers(self):
+        header_lines = list()
+        while True:
+            line = self.lines.readline()
+            if line == '' or line in ('\n', '\r\n'):
+                break
+            header_lines.append(line)
+        return email.parser.HeaderParser().parsestr(''.join(header_lines))
+
+    def is_boundary(self, line, boundaries):
+        if not line.startswith('--'):
+            return False
+        line = line.rstrip()
+        for boundary in boundaries:
+            if line == '--' + boundary or line == '--' + boundary + '--':
+                return True
+        return False
+
+    def read_entity(self, headers, boundaries):
+        """reads the entity body, stops before the line with
+        any of the enclosing ``boundaries``"""
+        if headers.get_content_maintype() == 'multipart':
+            boundary = headers.get_boundary()
+            if boundary:
+                self.read_multipart(boundary, boundaries)
+                return
+
+        part_type = get_part_type(headers)
+        if part_type == 'body':
+            sink = TextSink(headers.get_content_charset())
+        elif part_type in ('attachment', 'inline'):
+            name = decode_header_value(headers.get_filename()) or 'attachment'
+            sink = FileSink(
+                        name,
+                        headers.get_content_type(),
+                        self.max_attachment_size
+                    )
+        else:
+            sink = NullSink()
+
+        decoder = get_decoder(headers.get('Content-Transfer-Encoding'))
+        pending_newline = False
+        while True:
+            line = self.lines.readline()
+            if line == '':
+                break
+            if self.is_boundary(line, boundaries):
+                self.lines.push_back(line)
+                break
+            content, has_newline = split_line_end(line)
+            data, keeps_newline = decoder.decode(content)
+            if pending_newline:
+                sink.write('\n')
+            sink.write(data)
+            pending_newline = has_newline and keeps_newline
+
+        content = sink.get_content()
+        if content is not None:
+            self.parts.append((part_type, content))
+
+    def read_multipart(self, boundary, boundaries):
+        inner_boundaries = boundaries + (boundary,)
+        #skip the preamble
+        while True:
+            line = self.lines.readline()
+            if line == '':
+                return
+            if self.is_boundary(line, inner_boundaries):
+                break
+
+        while True:
+            if line.rstrip() == '--' + boundary + '--':
+                break
+            if line.rstrip() != '--' + boundary:
+                #boundary of an enclosing entity - it reads the line again
+                self.lines.push_back(line)
+                return
+            headers = self.read_headers()
+            self.read_entity(headers, inner_boundaries)
+            line = self.lines.readline()
+            if line == '':
+                return
+
+        #skip the epilogue
+        while True:
+            line = self.lines.readline()
+            if line == '':
+                return
+            if self.is_boundary(line, boundaries):
+                self.lines.push_back(line)
+                return
+
+    def read(self):
+        headers = self.read_headers()
+        self.read_entity(headers, ())
+        return InboundMessage(headers, self.parts)
+
+
+def read_message(fp, max_size = None, max_attachment_size = None):
+    """reads message from the file object ``fp``,
+    raises :class:`MessageTooLarge` if the message is larger
+    than ``max_size``, attachments larger than ``max_attachment_size``
+    are left out"""
+    if max_size is None:
+        max_size = get_max_message_size()
+    if max_attachment_size is None:
+        max_attachment_size = get_max_attachment_size()
+    reader = MessageReader(fp, max_size, max_attachment_size)
+    try:
+        return reader.read()
+    except:
+        for part_type, content in reader.parts:
+            if isinstance(content, File):
+                content.close()
+        raise
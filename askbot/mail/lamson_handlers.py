@@ -1,13 +1,17 @@
 import re
 import functools
+import logging
+import mailbox
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.conf import settings as django_settings
 from django.template import Context
+from django.utils.encoding import smart_str
 from django.utils.translation import ugettext as _
 from lamson.routing import route, stateless
 from lamson.server import Relay
 from askbot.models import ReplyAddress, Tag
 from askbot import mail
+from askbot.mail import inbound
 from askbot.conf import settings as askbot_settings
 from askbot.skins.loaders import get_template
 
@@ -101,7 +105,12 @@ def get_parts(message):
     usually the body is split when there are inline attachments present.
     """
 
+    if isinstance(message, inbound.InboundMessage):
+        #parts are read and spooled already
+        return message.parts
+
     parts = list()
+    max_attachment_size = inbound.get_max_attachment_size()
 
     simple_body = ''
     if message.body():
@@ -115,18 +124,66 @@ def get_parts(message):
             if part_content == simple_body:
                 continue#avoid duplication
         elif part_type in ('attachment', 'inline'):
+            if len(part.body) > max_attachment_size:
+                logging.info(
+                    'attachment of inbound email is larger than %d bytes '
+                    'and is not saved' % max_attachment_size
+                )
+                continue
             part_content = format_attachment(part)
         else:
             continue
         parts.append((part_type, part_content))
     return parts
 
+def is_spooled(message):
+    """True if the lamson message is to be put to the
+    spool Maildir, instead of being processed now"""
+    return inbound.get_spool_maildir() is not None \
+        and not isinstance(message, inbound.InboundMessage)
+
+def spool_message(message):
+    """puts the message to the spool Maildir
+    for the ``process_inbound_email`` command
+
+    lamson calls the handlers once per envelope recipient,
+    the recipient is not in the message text, so it is added
+    in the ``X-Original-To`` header, which :func:`deliver`
+    then routes to"""
+    maildir = mailbox.Maildir(inbound.get_spool_maildir(), factory = None)
+    envelope_header = 'X-Original-To: %s\n' % smart_str(message.To.strip())
+    maildir.add(envelope_header + message.original)
+
+def deliver(message):
+    """passes the :class:`~askbot.mail.inbound.InboundMessage`
+    to the handlers matching its recipients, same as the
+    lamson routes below - the spooled messages are passed
+    to the handler of their envelope recipient only"""
+    hostname = askbot_settings.REPLY_BY_EMAIL_HOSTNAME
+    for recipient in message.get_recipients():
+        if '@' not in recipient:
+            continue
+        addr, host = recipient.rsplit('@', 1)
+        if hostname and host.lower() != hostname.lower():
+            continue
+        if addr.startswith('reply-'):
+            PROCESS(message, host = host, address = addr[len('reply-'):])
+        elif addr.startswith('welcome-'):
+            VALIDATE_EMAIL(
+                message, host = host, address = addr[len('welcome-'):]
+            )
+        else:
+            ASK(message, host = host, addr = addr)
+
 def process_reply(func):
     @functools.wraps(func)
     def wrapped(message, host = None, address = None):
         """processes forwarding rules, and run the handler
         in the case of error, send a bounce email
         """
+        if is_spooled(message):
+            return#the ASK handler spools all messages
+
         try:
             for rule in django_settings.LAMSON_FORWARD:
                 if re.match(rule['pattern'], message.base['to']):
@@ -139,7 +196,7 @@ def process_reply(func):
 
         error = None
         try:
-            reply_address = ReplyAddress.objects.get(
+            reply_address = ReplyAddress.objects.get_valid(
                                             address = address,
                                             allowed_from_email = message.From
                                         )
@@ -179,6 +236,10 @@ def ASK(message, host = None, addr = None):
     """lamson handler for asking by email,
     to the forum in general and to a specific group"""
 
+    if is_spooled(message):
+        spool_message(message)
+        return
+
     #we need to exclude some other emails by prefix
     if addr.startswith('reply-'):
         return
@@ -0,0 +1,208 @@
+"""sending of the messages from the outgoing email queue,
+used by the ``send_queued_email`` management command
+
+the messages are taken by any number of workers - threads
+or processes, each message is claimed by a single worker
+with a lease, failed messages are retried with exponentially
+growing delays and kept as dead letters when the attempts run out
+"""
+import collections
+import datetime
+import logging
+import threading
+import time
+from django.conf import settings as django_settings
+from django.core import mail
+from django.db import connection
+from askbot.models import QueuedEmail
+
+#number of messages claimed by the worker at a time
+CLAIM_BATCH_SIZE = 20
+
+#time for sending the claimed message, after that
+#the message can be taken by another worker
+LEASE_SECONDS = 300
+
+def is_eager():
+    """True if messages are to be sent immediately,
+    without the queue, e.g. in the tests"""
+    return getattr(django_settings, 'ASKBOT_EMAIL_QUEUE_ALWAYS_EAGER', False)
+
+def get_retry_delay(attempt_count, base_delay, max_delay):
+    """seconds before the next attempt, the delay is doubled
+    with each failed attempt"""
+    return min(base_delay * 2 ** (attempt_count - 1), max_delay)
+
+
+class DomainRateLimiter(object):
+    """allows up to ``rate`` messages per minute to each
+    recipient domain, rates of the individual domains can be
+    given in the ``domain_rates`` dictionary, zero rate means no limit
+
+    the limiter is shared by the threads of one worker process
+    """
+    def __init__(self, rate = 0, domain_rates = None):
+        self.rate = rate
+        self.domain_rates = domain_rates or dict()
+        self.sent_times = collections.defaultdict(collections.deque)
+        self.lock = threading.Lock()
+
+    def get_rate(self, domain):
+        return self.domain_rates.get(domain, self.rate)
+
+    def reserve(self, domain, now = None):
+        """records the message to the domain and returns 0 if
+        the message can be sent now, otherwise returns number
+        of seconds until it can be sent"""
+        rate = self.get_rate(domain)
+        if rate <= 0:
+            return 0
+        now = now or time.time()
+        self.lock.acquire()
+        try:
+            sent_times = self.sent_times[domain]
+            while sent_times and sent_times[0] <= now - 60:
+                sent_times.popleft()
+            if len(sent_times) >= rate:
+                return sent_times[0] + 60 - now
+            sent_times.append(now)
+            return 0
+        finally:
+            self.lock.release()
+
+
+class QueueWorker(object):
+    """sends the due messages from the queue,
+    one instance per thread"""
+
+    def __init__(
+                self,
+                rate_limiter = None,
+                max_attempts = 5,
+                retry_delay = 60,
+                max_retry_delay = 60*60*6
+            ):
+        self.rate_limiter = rate_limiter or DomainRateLimiter()
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.stats = collections.defaultdict(int)
+        self.connection = None
+
+    def claim_messages(self):
+        lease_until = datetime.datetime.now() + \
+                            datetime.timedelta(seconds = LEASE_SECONDS)
+        return [
+            item for item in QueuedEmail.objects.get_due(CLAIM_BATCH_SIZE)
+            if QueuedEmail.objects.claim(item, lease_until)
+        ]
+
+    def postpone(self, item, seconds):
+        """returns the message to the queue without
+        counting an attempt"""
+        QueuedEmail.objects.filter(id = item.id).update(
+            next_attempt_at = datetime.datetime.now() + \
+                                datetime.timedelta(seconds = seconds)
+        )
+        self.stats['postponed'] += 1
+
+    def record_failure(self, item, error):
+        item.attempt_count += 1
+        item.last_error = unicode(error)
+        if item.attempt_count >= self.max_attempts:
+            item.status = QueuedEmail.STATUS_DEAD
+            self.stats['dead'] += 1
+            logging.critical(
+                'email %d to %s is not delivered after %d attempts: %s' % (
+                    item.id,
+                    item.recipient_domain,
+                    item.attempt_count,
+                    item.last_error
+                )
+            )
+        else:
+            delay = get_retry_delay(
+                                item.attempt_count,
+                                self.retry_delay,
+                                self.max_retry_delay
+                            )
+            item.next_attempt_at = datetime.datetime.now() + \
+                                    datetime.timedelta(seconds = delay)
+            self.stats['retried'] += 1
+            logging.info(
+                'email %d to %s failed, retry in %d s: %s' % (
+                    item.id, item.recipient_domain, delay, item.last_error
+                )
+            )
+        item.save()
+
+    def send(self, item):
+        try:
+            message = item.get_message()
+            if self.connection is None:
+                self.connection = mail.get_connection()
+                self.connection.open()
+            self.connection.send_messages([message])
+        except Exception, error:
+            self.close_connection()
+            self.record_failure(item, error)
+        else:
+            item.delete()
+            self.stats['sent'] += 1
+
+    def close_connection(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+    def run(self):
+        """sends the messages until there are none due,
+        returns counts of the sent, retried, dead and postponed messages"""
+        try:
+            while True:
+                items = self.claim_messages()
+                if len(items) == 0:
+                    break
+                for item in items:
+                    wait = self.rate_limiter.reserve(item.recipient_domain)
+                    if wait > 0:
+                        self.postpone(item, wait)
+                    else:
+                        self.send(item)
+        finally:
+            self.close_connection()
+        return dict(self.stats)
+
+    def run_in_thread(self):
+        try:
+            self.run()
+        finally:
+            connection.close()
+
+
+def send_queued_messages(workers = 1, **kwargs):
+    """sends the due messages in ``workers`` threads,
+    returns the summed counts of the workers,
+    ``kwargs`` are passed to the :class:`QueueWorker`
+    """
+    if workers <= 1:
+        return QueueWorker(**kwargs).run()
+
+    queue_workers = [QueueWorker(**kwargs) for number in range(workers)]
+    threads = [
+        threading.Thread(target = worker.run_in_thread)
+        for worker in queue_workers
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    totals = collections.defaultdict(int)
+    for worker in queue_workers:
+        for key, value in worker.stats.items():
+            totals[key] += value
+    return dict(totals)
@@ -0,0 +1,153 @@
+"""selection of the questions for the email reminders,
+sent by the ``send_unanswered_question_reminders`` and
+``send_accept_answer_reminders`` management commands
+
+the eligible questions are loaded once, the users are read in
+chunks ordered by id together with their previous reminders and
+tag selections, and the questions are matched to the users in memory
+"""
+import datetime
+from askbot.models import Activity, MarkedTag, User
+from askbot.models.base import insert_objects
+from askbot.models.tag import get_email_tag_filter
+from askbot.utils.lists import batch_size
+
+#number of users processed together
+USER_CHUNK_SIZE = 500
+
+#number of question ids per "IN" lookup, combined with a chunk of users
+QUESTION_CHUNK_SIZE = 400
+
+class ReminderPlanner(object):
+    """finds the questions to remind the users about and
+    records the reminder activity, so that reminders about the
+    same question come not more often than ``recurrence_delay``
+
+    if ``own_questions`` is True, users are reminded
+    about their own questions, otherwise - about the questions
+    of the other users, which pass their email tag filter
+    """
+
+    def __init__(
+                self,
+                questions = None,
+                activity_type = None,
+                recurrence_delay = None,
+                own_questions = False
+            ):
+        self.questions = list(questions.select_related('thread'))
+        self.activity_type = activity_type
+        self.recurrence_delay = recurrence_delay
+        self.own_questions = own_questions
+        self.tag_names = dict([
+            (question.id, set(question.thread.get_tag_names()))
+            for question in self.questions
+        ])
+
+    def get_user_chunks(self):
+        """yields lists of not blocked users, ordered by id"""
+        users = User.objects.exclude(status = 'b').order_by('id')
+        if self.own_questions:
+            author_ids = sorted(set([
+                question.author_id for question in self.questions
+            ]))
+            for chunk in batch_size(author_ids, USER_CHUNK_SIZE):
+                yield list(users.filter(id__in = chunk))
+        else:
+            last_id = 0
+            while True:
+                chunk = list(users.filter(id__gt = last_id)[:USER_CHUNK_SIZE])
+                if len(chunk) == 0:
+                    break
+                yield chunk
+                last_id = chunk[-1].id
+
+    def get_previous_reminders(self, user_ids):
+        """returns dictionary (user id, question id) ->
+        (activity id, time of the reminder)"""
+        reminders = dict()
+        question_ids = [question.id for question in self.questions]
+        for question_chunk in batch_size(question_ids, QUESTION_CHUNK_SIZE):
+            activities = Activity.objects.filter(
+                                activity_type = self.activity_type,
+                                user__in = user_ids,
+                                question__in = question_chunk
+                            ).values_list('user', 'question', 'id', 'active_at')
+            for user_id, question_id, activity_id, active_at in activities:
+                reminders[(user_id, question_id)] = (activity_id, active_at)
+        return reminders
+
+    def get_tag_filters(self, users):
+        """returns email tag filters of the users by user id"""
+        marked_tags = dict()
+        selections = MarkedTag.objects.filter(
+                                user__in = [user.id for user in users]
+                            ).values_list('user', 'reason', 'tag__name')
+        for user_id, reason, tag_name in selections:
+            marked_tags.setdefault(user_id, list()).append((reason, tag_name))
+        return dict([
+            (user.id, get_email_tag_filter(user, marked_tags.get(user.id, ())))
+            for user in users
+        ])
+
+    def get_reminders(self):
+        """yields pairs of user and the list of questions
+        to remind them about, the reminders are recorded
+        for each chunk of users"""
+        if len(self.questions) == 0:
+            return
+        for users in self.get_user_chunks():
+            for reminder in self.plan_reminders(users):
+                yield reminder
+
+    def plan_reminders(self, users):
+        user_ids = [user.id for user in users]
+        previous_reminders = self.get_previous_reminders(user_ids)
+        if self.own_questions == False:
+            tag_filters = self.get_tag_filters(users)
+
+        now = datetime.datetime.now()
+        reminders = list()
+        repeated_reminder_ids = list()
+        new_reminders = list()
+        for user in users:
+            if self.own_questions:
+                questions = [
+                    question for question in self.questions
+                    if question.author_id == user.id
+                ]
+            else:
+                tag_filter = tag_filters[user.id]
+                questions = [
+                    question for question in self.questions
+                    if question.author_id != user.id
+                    and tag_filter(self.tag_names[question.id])
+                ]
+
+            question_list = list()
+            for question in questions:
+                previous = previous_reminders.get((user.id, question.id))
+                if previous:
+                    activity_id, reminded_at = previous
+                    if now < reminded_at + self.recurrence_delay:
+                        continue
+                    repeated_reminder_ids.append(activity_id)
+                else:
+                    new_reminders.append(
+                        Activity(
+                            user = user,
+                            question = question,
+                            activity_type = self.activity_type,
+                            content_object = question,
+                            active_at = now
+                        )
+                    )
+                question_list.append(question)
+
+            if question_list:
+                reminders.append((user, question_list))
+
+        for activity_ids in batch_size(repeated_reminder_ids, USER_CHUNK_SIZE):
+            Activity.objects.filter(id__in = activity_ids).update(active_at = now)
+        insert_objects(new_reminders)
+        return reminders
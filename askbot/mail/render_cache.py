@@ -0,0 +1,78 @@
+"""render-once cache of the html fragments with the post
+and thread content, included into the email messages
+
+the cache keys contain ids and last edit timestamps of the
+rendered posts, so the edited posts are rendered again and
+the cached fragments never need to be invalidated
+"""
+from django.core import cache # import cache, not from cache import cache, to be able to monkey-patch cache.cache in test cases
+from django.utils.hashcompat import md5_constructor
+from django.utils.translation import get_language
+from askbot import const
+
+class RenderStats(object):
+    """counts of the fragments found in the cache
+    and rendered in this process, the counts of one sending
+    are given by the difference of :meth:`copy` made before
+    the sending and the stats after it, see :meth:`since`"""
+    def __init__(self, hits = 0, misses = 0):
+        self.hits = hits
+        self.misses = misses
+
+    def reset(self):
+        self.hits = 0
+        self.misses = 0
+
+    def copy(self):
+        return RenderStats(self.hits, self.misses)
+
+    def since(self, earlier):
+        """returns counts added after the ``earlier`` copy
+        of these stats, e.g. by one sending of the emails"""
+        return RenderStats(
+                    self.hits - earlier.hits,
+                    self.misses - earlier.misses
+                )
+
+    def get_hit_rate(self):
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return float(self.hits) / total
+
+    def __unicode__(self):
+        return u'%d hits, %d misses, %.0f%% hit rate' % (
+                    self.hits, self.misses, self.get_hit_rate() * 100
+                )
+
+    __str__ = __unicode__
+
+STATS = RenderStats()
+
+def get_post_stamp(post):
+    """id and time of the last edit of the post"""
+    return (post.id, post.last_edited_at or post.added_at)
+
+def get_subthread_stamp(post):
+    """stamps of the post and its cached comments"""
+    comments = post.get_cached_comments()
+    return (get_post_stamp(post), tuple(map(get_post_stamp, comments)))
+
+def get_cache_key(kind, stamp):
+    """the stamp may be longer than allowed for the cache key,
+    so it is hashed"""
+    key_data = repr((kind, get_language(), stamp))
+    return 'mail-render-%s-%s' % (kind, md5_constructor(key_data).hexdigest())
+
+def render_once(kind, stamp, render_func):
+    """returns the cached fragment, or the result
+    of ``render_func()``, which is then cached"""
+    key = get_cache_key(kind, stamp)
+    html = cache.cache.get(key)
+    if html is None:
+        STATS.misses += 1
+        html = render_func()
+        cache.cache.set(key, html, const.LONG_TIME)
+    else:
+        STATS.hits += 1
+    return html
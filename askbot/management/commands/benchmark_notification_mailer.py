@@ -0,0 +1,103 @@
+"""compares sending of the instant notifications with
+a new SMTP connection per message, as done by ``mail.send_mail()``,
+with the batches sent by ``mail.send_mail_batch()``
+
+messages are delivered to a local SMTP stub server
+started by the command, which discards them
+
+python manage.py benchmark_notification_mailer --messages=1000
+"""
+import asyncore
+import smtpd
+import threading
+import time
+from optparse import make_option
+from django.conf import settings as django_settings
+from django.core.management.base import NoArgsCommand
+from askbot import mail
+
+class StubSMTPServer(smtpd.SMTPServer):
+    """counts and discards the received messages"""
+    received_count = 0
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.received_count += 1
+
+def start_stub_server(port):
+    server = StubSMTPServer(('127.0.0.1', port), None)
+    thread = threading.Thread(
+                    target = asyncore.loop,
+                    kwargs = {'timeout': 0.1}
+                )
+    thread.daemon = True
+    thread.start()
+    return server
+
+def make_messages(count, body_size):
+    body_text = '<p>%s</p>' % ('x' * body_size)
+    for number in xrange(count):
+        yield mail.make_message(
+                    subject_line = 'benchmark notification',
+                    body_text = body_text,
+                    recipient_list = ['user%d@example.com' % number]
+                )
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--messages',
+            action = 'store',
+            type = 'int',
+            dest = 'messages',
+            default = 1000,
+            help = 'number of messages to send'
+        ),
+        make_option('--port',
+            action = 'store',
+            type = 'int',
+            dest = 'port',
+            default = 8025,
+            help = 'port of the local SMTP stub'
+        ),
+        make_option('--body-size',
+            action = 'store',
+            type = 'int',
+            dest = 'body_size',
+            default = 5000,
+            help = 'length of the message body'
+        ),
+    )
+
+    def handle_noargs(self, **options):
+        server = start_stub_server(options['port'])
+        django_settings.EMAIL_BACKEND = \
+                    'django.core.mail.backends.smtp.EmailBackend'
+        django_settings.EMAIL_HOST = '127.0.0.1'
+        django_settings.EMAIL_PORT = options['port']
+        django_settings.EMAIL_HOST_USER = ''
+        django_settings.EMAIL_HOST_PASSWORD = ''
+        django_settings.EMAIL_USE_TLS = False
+
+        count = options['messages']
+        body_size = options['body_size']
+
+        start = time.time()
+        for message in make_messages(count, body_size):
+            message.send()
+        elapsed = time.time() - start
+        print '%-24s %6d messages %8.2f s %8.1f messages/s' % (
+                        'connection per message', count,
+                        elapsed, count / elapsed
+                    )
+
+        start = time.time()
+        sent, failed = mail.send_mail_batch(make_messages(count, body_size))
+        elapsed = time.time() - start
+        print '%-24s %6d messages %8.2f s %8.1f messages/s, %d failed' % (
+                        'batches of %d' % mail.EMAIL_BATCH_SIZE, sent,
+                        elapsed, sent / elapsed, failed
+                    )
+
+        #give the stub a moment to process the last message
+        time.sleep(0.5)
+        print 'stub server received %d messages' % server.received_count
+        server.close()
@@ -0,0 +1,125 @@
+"""compares the lookup of the global instant notification
+subscribers who do not filter emails by tags, as done in
+``Post.get_global_instant_notification_subscribers()``,
+with the replaced query over the whole user table
+
+a synthetic population of users and their email feed settings
+is inserted in a transaction, which is rolled back at the end
+
+python manage.py benchmark_notification_subscribers --users=100000
+"""
+import random
+import time
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+from django.db.models import Max
+from askbot import const
+from askbot import models
+from askbot.models.base import insert_objects
+
+#probabilities of the frequencies of the entire forum subscription
+Q_ALL_FREQUENCIES = (('i', 0.05), ('d', 0.15), ('w', 0.1), ('n', 0.7))
+
+def get_random_frequency():
+    point = random.random()
+    for frequency, probability in Q_ALL_FREQUENCIES:
+        if point < probability:
+            return frequency
+        point -= probability
+    return 'n'
+
+def get_global_subscribers_old():
+    """the replaced lookup"""
+    return set(models.User.objects.filter(
+        email_tag_filter_strategy = const.INCLUDE_ALL
+    ))
+
+def get_global_subscribers():
+    """same as in ``Post.get_global_instant_notification_subscribers()``"""
+    subscriber_ids = models.EmailFeedSetting.objects.get_subscriber_ids(
+        feed_type = 'q_all',
+        frequency = 'i',
+        tag_filter_strategy = const.INCLUDE_ALL
+    )
+    return set(models.User.objects.filter(id__in = subscriber_ids))
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--users',
+            action = 'store',
+            type = 'int',
+            dest = 'users',
+            default = 100000,
+            help = 'number of users to create'
+        ),
+        make_option('--repeat',
+            action = 'store',
+            type = 'int',
+            dest = 'repeat',
+            default = 5,
+            help = 'number of lookups to time'
+        ),
+    )
+
+    def create_population(self, user_count):
+        user_id = (models.User.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+        feed_id = (
+            models.EmailFeedSetting.objects.aggregate(Max('id'))['id__max'] or 0
+        ) + 1
+        strategies = [choice[0] for choice in const.TAG_EMAIL_FILTER_STRATEGY_CHOICES]
+
+        batch_size = 10000
+        for batch_start in xrange(0, user_count, batch_size):
+            users = list()
+            feeds = list()
+            for user_no in xrange(batch_start, min(batch_start + batch_size, user_count)):
+                user = models.User(
+                            id = user_id,
+                            username = 'subscriber_benchmark_%d' % user_no,
+                            email = 'subscriber_benchmark_%d@example.com' % user_no,
+                            password = '!',
+                            email_tag_filter_strategy = random.choice(strategies)
+                        )
+                users.append(user)
+                for feed_type in models.EmailFeedSetting.FEED_TYPES:
+                    if feed_type == 'q_all':
+                        frequency = get_random_frequency()
+                    else:
+                        frequency = 'n'
+                    feeds.append(
+                        models.EmailFeedSetting(
+                            id = feed_id,
+                            subscriber_id = user_id,
+                            feed_type = feed_type,
+                            frequency = frequency,
+                            tag_filter_strategy = user.email_tag_filter_strategy
+                        )
+                    )
+                    feed_id += 1
+                user_id += 1
+            insert_objects(users)
+            insert_objects(feeds)
+
+    @transaction.commit_manually
+    def handle_noargs(self, **options):
+        random.seed(1)
+        try:
+            start = time.time()
+            self.create_population(options['users'])
+            print 'created %d users in %.1f s' % (
+                                options['users'], time.time() - start
+                            )
+            for name, function in (
+                ('whole user table', get_global_subscribers_old),
+                ('subscription index', get_global_subscribers)
+            ):
+                start = time.time()
+                for attempt in xrange(options['repeat']):
+                    subscribers = function()
+                elapsed = (time.time() - start) / options['repeat']
+                print '%-20s %6d users loaded %10.1f ms per lookup' % (
+                                name, len(subscribers), 1000 * elapsed
+                            )
+        finally:
+            transaction.rollback()
@@ -0,0 +1,96 @@
+"""compares the time of the thread search with the built-in
+search index and with the substring match (icontains), which
+was used on the databases without full text search before
+
+the query words are taken from the titles of random threads,
+the search index must be built with ``rebuild_search_index``
+
+python manage.py benchmark_search --queries=50 --words=2
+"""
+import random
+import time
+from optparse import make_option
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import models as db_models
+from askbot import models
+from askbot.search import inverted_index
+
+PAGE_SIZE = 30
+
+def search_by_substring(query_set, query_text):
+    return query_set.filter(
+        db_models.Q(title__icontains = query_text) |
+        db_models.Q(tagnames__icontains = query_text) |
+        db_models.Q(posts__deleted = False, posts__text__icontains = query_text)
+    ).distinct().order_by('-last_activity_at')
+
+def search_by_index(query_set, query_text):
+    return inverted_index.run_full_text_search(
+                                query_set, query_text
+                            ).extra(order_by = ['-relevance'])
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--queries',
+            action = 'store',
+            type = 'int',
+            dest = 'queries',
+            default = 50,
+            help = 'number of the search queries'
+        ),
+        make_option('--words',
+            action = 'store',
+            type = 'int',
+            dest = 'words',
+            default = 1,
+            help = 'number of words in the query'
+        ),
+    )
+
+    def get_queries(self, count, words):
+        thread_ids = list(models.Thread.objects.values_list('id', flat = True))
+        queries = list()
+        for thread_id in random.sample(thread_ids, min(count, len(thread_ids))):
+            title = models.Thread.objects.get(id = thread_id).title
+            terms = inverted_index.tokenize(title)
+            if len(terms) >= words:
+                start = random.randint(0, len(terms) - words)
+                queries.append(' '.join(terms[start:start + words]))
+        return queries
+
+    def run_searches(self, search_function, queries):
+        """returns average time in ms to count the matching
+        threads and to load the first page, and the total
+        number of matches"""
+        query_set = models.Thread.objects.filter(question_deleted = False)
+        total_matches = 0
+        start = time.time()
+        for query in queries:
+            threads = search_function(query_set, query)
+            total_matches += threads.count()
+            list(threads[:PAGE_SIZE])
+        elapsed = time.time() - start
+        return 1000 * elapsed / len(queries), total_matches
+
+    def handle_noargs(self, **options):
+        if models.SearchPosting.objects.count() == 0:
+            raise CommandError(
+                'the search index is empty, run rebuild_search_index first'
+            )
+        queries = self.get_queries(options['queries'], options['words'])
+        if len(queries) == 0:
+            raise CommandError('no threads with long enough titles')
+
+        print '%d threads, %d postings, %d queries' % (
+                                models.Thread.objects.count(),
+                                models.SearchPosting.objects.count(),
+                                len(queries)
+                            )
+        for name, search_function in (
+            ('icontains', search_by_substring),
+            ('search index', search_by_index),
+        ):
+            average, matches = self.run_searches(search_function, queries)
+            print '%-14s %8.1f ms per query, %d matches' % (
+                                                name, average, matches
+                                            )
@@ -0,0 +1,102 @@
+"""compares the speed of substitution of tag urls
+into the cached thread summaries, as done in
+``Thread.get_summary_html()``, with the replaced
+search-and-replace loop
+
+python manage.py benchmark_summary_tag_urls --threads=50 --tags=5
+"""
+import re
+import timeit
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from askbot import const
+from askbot.models.question import SUMMARY_TAG_MARKER_RE
+from askbot.search.state_manager import SearchState
+
+def substitute_tag_urls_loop(html, search_state):
+    """the old implementation - regex is compiled on each call,
+    html is searched from the start for every marker and
+    each url is built on a fresh copy of the search state
+    """
+    regex = re.compile(
+        r'<<<(%s)>>>' % const.TAG_REGEX_BARE,
+        re.UNICODE
+    )
+    while True:
+        match = regex.search(html)
+        if not match:
+            break
+        seq = match.group(0)
+        tag = match.group(1)
+        full_url = search_state.add_tag(tag).full_url()
+        html = html.replace(seq, full_url)
+    return html
+
+def substitute_tag_urls(html, search_state):
+    """same as in ``Thread.get_summary_html()``"""
+    return SUMMARY_TAG_MARKER_RE.sub(
+        lambda match: search_state.add_tag_url(match.group(1)),
+        html
+    )
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--threads',
+            action = 'store',
+            type = 'int',
+            dest = 'threads',
+            default = 50,
+            help = 'number of thread summaries on the page'
+        ),
+        make_option('--tags',
+            action = 'store',
+            type = 'int',
+            dest = 'tags',
+            default = 5,
+            help = 'number of tags per thread'
+        ),
+        make_option('--repeat',
+            action = 'store',
+            type = 'int',
+            dest = 'repeat',
+            default = 20,
+            help = 'number of rendered pages to time'
+        ),
+    )
+
+    def handle_noargs(self, **options):
+        summaries = list()
+        for thread_no in xrange(options['threads']):
+            links = ''.join([
+                '<a href="<<<tag%d>>>">tag%d</a>' % (tag_no, tag_no)
+                for tag_no in xrange(thread_no, thread_no + options['tags'])
+            ])
+            summaries.append('<div class="tags">%s</div>' % links)
+
+        def render_page(substitute):
+            #one search state per page, like in the questions view
+            search_state = SearchState.get_empty()
+            for html in summaries:
+                substitute(html, search_state)
+
+        search_state = SearchState.get_empty()
+        for html in summaries:
+            assert(
+                substitute_tag_urls_loop(html, search_state) == \
+                substitute_tag_urls(html, search_state)
+            )
+
+        print '%d threads with %d tags, %d pages' % (
+                    options['threads'], options['tags'], options['repeat']
+                )
+        for name, function in (
+            ('search-and-replace loop', substitute_tag_urls_loop),
+            ('single pass', substitute_tag_urls)
+        ):
+            elapsed = timeit.timeit(
+                            lambda: render_page(function),
+                            number = options['repeat']
+                        )
+            print '%-25s %8.2f ms per page' % (
+                        name, 1000 * elapsed / options['repeat']
+                    )
@@ -0,0 +1,85 @@
+"""counts database queries made to apply votes
+on questions and answers
+
+the test users and posts are deleted at the end,
+still it is best to run the command on a copy of the database
+
+python manage.py benchmark_vote_queries --votes=20
+"""
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from django.db import connection
+from askbot import models
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--votes',
+            action = 'store',
+            type = 'int',
+            dest = 'votes',
+            default = 20,
+            help = 'number of times each kind of vote is applied'
+        ),
+    )
+
+    def count_queries(self, function, *args, **kwargs):
+        """runs the function and returns number of queries it made"""
+        start = len(connection.queries)
+        function(*args, **kwargs)
+        return len(connection.queries) - start
+
+    def create_user(self, username):
+        user = models.User.objects.create_user(username, username + '@example.com')
+        user.reputation = 10000
+        user.save()
+        return user
+
+    def run_votes(self, voters, post):
+        """applies each kind of vote by all voters and
+        returns the numbers of queries per vote"""
+        counts = {}
+        for name, method, cancel in (
+            ('upvote', 'upvote', False),
+            ('cancel upvote', 'upvote', True),
+            ('downvote', 'downvote', False),
+            ('cancel downvote', 'downvote', True),
+        ):
+            total = 0
+            for voter in voters:
+                total += self.count_queries(
+                                getattr(voter, method), post, cancel = cancel
+                            )
+            counts[name] = float(total) / len(voters)
+        return counts
+
+    def handle_noargs(self, **options):
+        connection.use_debug_cursor = True
+        author = self.create_user('vote_benchmark_author')
+        voters = [
+            self.create_user('vote_benchmark_voter_%d' % voter_no)
+            for voter_no in xrange(options['votes'])
+        ]
+        try:
+            question = author.post_question(
+                                title = 'vote benchmark question',
+                                body_text = 'vote benchmark question body',
+                                tags = 'benchmark'
+                            )
+            answer = author.post_answer(
+                                question = question,
+                                body_text = 'vote benchmark answer body'
+                            )
+            for post in (question, answer):
+                post = models.Post.objects.get(id = post.id)
+                counts = self.run_votes(voters, post)
+                print 'queries per vote on the %s:' % post.post_type
+                for name in sorted(counts.keys()):
+                    print '  %-16s %6.1f' % (name, counts[name])
+        finally:
+            connection.use_debug_cursor = None
+            models.Thread.objects.filter(
+                            posts__author = author
+                        ).delete()
+            author.delete()
+            for voter in voters:
+                voter.delete()
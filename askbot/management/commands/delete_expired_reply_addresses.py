@@ -0,0 +1,25 @@
+"""deletes the reply by email addresses older than
+the REPLY_BY_EMAIL_ADDRESS_LIFETIME live setting,
+replies to them are rejected anyway
+"""
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+from askbot import models
+
+#number of addresses deleted in one transaction
+DELETE_BATCH_SIZE = 1000
+
+class Command(NoArgsCommand):
+    @transaction.commit_manually
+    def handle_noargs(self, **options):
+        expired = models.ReplyAddress.objects.get_expired()
+        count = 0
+        while True:
+            ids = list(expired.values_list('id', flat = True)[:DELETE_BATCH_SIZE])
+            if len(ids) == 0:
+                break
+            models.ReplyAddress.objects.filter(id__in = ids).delete()
+            transaction.commit()
+            count += len(ids)
+        transaction.commit()
+        print 'Deleted %d expired reply addresses' % count
@@ -0,0 +1,54 @@
+"""fills in the denormalized question post id
+and question deleted status on the threads
+
+python manage.py fix_thread_question_posts
+"""
+from askbot.management import NoArgsJob
+from askbot import models
+
+def fix_thread_question_post(thread):
+    """a unit of job - returns True if change was made
+    and False otherwise
+    """
+    try:
+        question = models.Post.objects.get(
+                                    post_type='question',
+                                    thread=thread
+                                )
+    except models.Post.DoesNotExist:
+        #thread without the question is hidden from the question list
+        if thread.question_post_id is None and thread.question_deleted:
+            return False
+        models.Thread.objects.filter(
+                            id=thread.id
+                        ).update(
+                            question_post=None,
+                            question_deleted=True
+                        )
+        return True
+
+    if thread.question_post_id == question.id \
+        and thread.question_deleted == question.deleted:
+        return False
+
+    models.Thread.objects.filter(
+                        id=thread.id
+                    ).update(
+                        question_post=question.id,
+                        question_deleted=question.deleted
+                    )
+    return True
+
+class Command(NoArgsJob):
+    """definition of the job that copies question post
+    data to the threads
+    """
+    def __init__(self, *args, **kwargs):
+        self.batches = ({
+            'title': 'Checking question posts of all threads: ',
+            'query_set': models.Thread.objects.all(),
+            'function': fix_thread_question_post,
+            'changed_count_message': 'Corrected records for %d threads',
+            'nothing_changed_message': 'No problems found'
+        },)
+        super(Command, self).__init__(*args, **kwargs)
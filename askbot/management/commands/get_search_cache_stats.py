@@ -0,0 +1,28 @@
+"""prints numbers of hits and misses of the search result cache
+of the question list, with option --reset the numbers are
+started from zero
+
+python manage.py get_search_cache_stats [--reset]
+"""
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from askbot.search import result_cache
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--reset',
+            action = 'store_true',
+            dest = 'reset',
+            default = False,
+            help = 'reset the numbers after printing them'
+        ),
+    )
+
+    def handle_noargs(self, **options):
+        stats = result_cache.get_stats()
+        print 'hits: %d' % stats['hits']
+        print 'misses: %d' % stats['misses']
+        if stats['hit_ratio'] is not None:
+            print 'hit ratio: %.1f%%' % (100 * stats['hit_ratio'])
+        if options['reset']:
+            result_cache.reset_stats()
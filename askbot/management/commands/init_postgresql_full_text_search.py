@@ -1,16 +1,17 @@
+"""sets up the incremental maintenance of the PostgreSQL
+search vectors and builds the vectors in batches,
+the command can be run again, e.g. after an interrupted run
+"""
+from django.core.management import call_command
 from django.core.management.base import NoArgsCommand
 from django.db import transaction
-import os.path
-import askbot
-from askbot.search.postgresql import setup_full_text_search
+from askbot.search import postgresql
 
 class Command(NoArgsCommand):
-    @transaction.commit_on_success
     def handle_noargs(self, **options):
-        script_path = os.path.join(
-                            askbot.get_install_directory(),
-                            'search',
-                            'postgresql',
-                            'thread_and_post_models_01162012.plsql'
-                        )
-        setup_full_text_search(script_path)
+        script_path = postgresql.get_script_path(
+                                postgresql.THREAD_AND_POST_SCRIPT
+                            )
+        postgresql.setup_full_text_search(script_path)
+        transaction.commit_unless_managed()
+        call_command('rebuild_search_index')
@@ -0,0 +1,132 @@
+"""processes the email messages spooled to a Maildir by lamson,
+when the ``ASKBOT_INBOUND_EMAIL_MAILDIR`` setting is given
+
+python manage.py process_inbound_email [--maildir=path] [--workers=4]
+
+new messages are moved to the "cur" directory of the Maildir
+when they are taken, the processed messages are deleted,
+the failed ones are left in the "cur" directory
+"""
+import logging
+import multiprocessing
+import os
+from optparse import make_option
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import connection
+from askbot.mail import inbound
+from askbot.mail import lamson_handlers
+
+def claim_message(maildir_path, name):
+    """moves the message from "new" to "cur", returns path of
+    the moved message or None, if it was taken by another worker"""
+    new_path = os.path.join(maildir_path, 'new', name)
+    cur_path = os.path.join(maildir_path, 'cur', name + ':2,S')
+    try:
+        os.rename(new_path, cur_path)
+    except OSError:
+        return None
+    return cur_path
+
+def process_message(maildir_path, name):
+    """returns 'processed', 'too_large', 'failed' or 'skipped'"""
+    path = claim_message(maildir_path, name)
+    if path is None:
+        return 'skipped'
+    try:
+        message_file = open(path, 'rb')
+        try:
+            message = inbound.read_message(message_file)
+        finally:
+            message_file.close()
+    except inbound.MessageTooLarge, error:
+        logging.critical('inbound email %s: %s' % (name, unicode(error)))
+        os.remove(path)
+        return 'too_large'
+
+    try:
+        lamson_handlers.deliver(message)
+    except Exception, error:
+        logging.critical(
+            'inbound email %s is not processed: %s' % (name, unicode(error))
+        )
+        return 'failed'
+    finally:
+        message.close()
+    os.remove(path)
+    return 'processed'
+
+def process_messages(maildir_path, names):
+    """processes a list of messages, returns the counts of the results"""
+    stats = dict()
+    for name in names:
+        result = process_message(maildir_path, name)
+        stats[result] = stats.get(result, 0) + 1
+    return stats
+
+def process_messages_in_worker(args):
+    """same as :func:`process_messages`, run in the worker processes"""
+    try:
+        return process_messages(*args)
+    finally:
+        connection.close()
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--maildir',
+            action = 'store',
+            type = 'str',
+            dest = 'maildir',
+            default = None,
+            help = 'path to the Maildir, by default - '
+                'the ASKBOT_INBOUND_EMAIL_MAILDIR setting'
+        ),
+        make_option('--workers',
+            action = 'store',
+            type = 'int',
+            dest = 'workers',
+            default = 1,
+            help = 'number of processes handling the messages'
+        ),
+    )
+
+    def handle_noargs(self, **options):
+        maildir_path = options['maildir'] or inbound.get_spool_maildir()
+        if maildir_path is None:
+            raise CommandError(
+                'give the --maildir option or '
+                'the ASKBOT_INBOUND_EMAIL_MAILDIR setting'
+            )
+        new_dir = os.path.join(maildir_path, 'new')
+        if not os.path.isdir(new_dir):
+            raise CommandError('%s is not a Maildir' % maildir_path)
+
+        names = sorted(
+            name for name in os.listdir(new_dir) if not name.startswith('.')
+        )
+        workers = options['workers']
+        if workers > 1:
+            chunks = [
+                (maildir_path, names[number::workers])
+                for number in range(workers)
+            ]
+            #the worker processes must open their own connections
+            connection.close()
+            pool = multiprocessing.Pool(workers)
+            try:
+                results = pool.map(process_messages_in_worker, chunks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [process_messages(maildir_path, names)]
+
+        totals = dict()
+        for stats in results:
+            for key, value in stats.items():
+                totals[key] = totals.get(key, 0) + value
+        print '%d processed, %d too large, %d failed' % (
+                                        totals.get('processed', 0),
+                                        totals.get('too_large', 0),
+                                        totals.get('failed', 0)
+                                    )
@@ -0,0 +1,108 @@
+"""rebuilds the search index
+
+on PostgreSQL recalculates the text search vectors of the posts
+and threads in batches of rows with consecutive ids, each batch
+is committed separately, so the command can run on a live site,
+the interrupted rebuild is continued with the --resume-from option,
+e.g. --resume-from=askbot_post:120000, where the value is taken
+from the last printed progress line. Option --reindex rebuilds the gin index
+of the thread vectors without locking the table
+
+on sqlite and MySQL with InnoDB tables rebuilds the built-in
+search index
+
+python manage.py rebuild_search_index [--batch-size=N]
+                                      [--resume-from=table:id] [--reindex]
+"""
+from optparse import make_option
+from django.core.management.base import NoArgsCommand, CommandError
+import askbot
+from askbot.models import Thread, SearchPosting
+from askbot.search import inverted_index
+from askbot.search import postgresql
+from askbot.utils.console import print_progress
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size',
+            action = 'store',
+            type = 'int',
+            dest = 'batch_size',
+            default = None,
+            help = 'number of rows (PostgreSQL, default 1000) '
+                'or threads (built-in index, default 200) '
+                'indexed at a time'
+        ),
+        make_option('--resume-from',
+            action = 'store',
+            type = 'str',
+            dest = 'resume_from',
+            default = None,
+            help = 'PostgreSQL only: table and id to continue '
+                'the rebuild from, e.g. askbot_post:120000'
+        ),
+        make_option('--reindex',
+            action = 'store_true',
+            dest = 'reindex',
+            default = False,
+            help = 'PostgreSQL only: rebuild the gin index '
+                'of the thread search vectors'
+        ),
+    )
+
+    def handle_noargs(self, **options):
+        if 'postgresql_psycopg2' in askbot.get_database_engine_name():
+            self.rebuild_postgresql_vectors(options)
+        elif inverted_index.is_enabled():
+            self.rebuild_inverted_index(options)
+        else:
+            raise CommandError(
+                'the full text index of MySQL is maintained by the database'
+            )
+
+    def parse_resume_from(self, value):
+        table_names = [
+            table_name for table_name, sql in postgresql.REBUILD_VECTORS_SQL
+        ]
+        try:
+            table_name, start_id = value.split(':')
+            start_id = int(start_id)
+        except ValueError:
+            table_name = None
+        if table_name not in table_names:
+            raise CommandError(
+                '--resume-from must be <table>:<id>, '
+                'where the table is one of: ' + ', '.join(table_names)
+            )
+        return table_name, start_id
+
+    def rebuild_postgresql_vectors(self, options):
+        resume_from = None
+        if options['resume_from']:
+            resume_from = self.parse_resume_from(options['resume_from'])
+        batches = postgresql.rebuild_vectors(
+                            batch_size = options['batch_size'] or 1000,
+                            resume_from = resume_from
+                        )
+        for table_name, done_id, max_id in batches:
+            #rows with smaller ids are done
+            print '%s:%d of %d' % (table_name, done_id, max_id)
+        if options['reindex']:
+            print 'Rebuilding the search index of the threads'
+            postgresql.rebuild_gin_index()
+
+    def rebuild_inverted_index(self, options):
+        if options['resume_from'] or options['reindex']:
+            raise CommandError(
+                '--resume-from and --reindex are used only with PostgreSQL'
+            )
+        total = Thread.objects.count()
+        done = 0
+        print 'Rebuilding the search index'
+        for count in inverted_index.rebuild_index(options['batch_size'] or 200):
+            done += count
+            print_progress(done, total)
+        print '%d threads indexed, %d postings' % (
+                                        done,
+                                        SearchPosting.objects.count()
+                                    )
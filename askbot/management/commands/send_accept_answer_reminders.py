@@ -7,6 +7,7 @@ from askbot.conf import settings as askbot_settings
 from django.utils.translation import ugettext as _
 from django.utils.translation import ungettext
 from askbot import mail
+from askbot.mail.reminders import ReminderPlanner
 from askbot.utils.classes import ReminderSchedule
 
 DEBUG_THIS_COMMAND = False
@@ -37,22 +38,17 @@ class Command(NoArgsCommand):
                                         thread__accepted_answer__isnull=True #answer_accepted = False
                                     ).order_by('-added_at')
         #for all users, excluding blocked
-        #for each user, select a tag filtered subset
+        #select their questions needing a reminder
         #format the email reminder and send it
-        for user in models.User.objects.exclude(status = 'b'):
-            user_questions = questions.filter(author = user)
-
-            final_question_list = user_questions.get_questions_needing_reminder(
-                activity_type = const.TYPE_ACTIVITY_ACCEPT_ANSWER_REMINDER_SENT,
-                user = user,
-                recurrence_delay = schedule.recurrence_delay
-            )
-            #todo: rewrite using query set filter
-            #may be a lot more efficient
+        planner = ReminderPlanner(
+            questions = questions,
+            activity_type = const.TYPE_ACTIVITY_ACCEPT_ANSWER_REMINDER_SENT,
+            recurrence_delay = schedule.recurrence_delay,
+            own_questions = True
+        )
+        for user, final_question_list in planner.get_reminders():
 
             question_count = len(final_question_list)
-            if question_count == 0:
-                continue
 
             subject_line = _(
                 'Accept the best answer for %(question_count)d of your questions'
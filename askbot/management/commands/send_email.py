@@ -21,4 +21,5 @@ class Command(BaseCommand):
             subject_line = 'Askbot Mail Test',
             body_text = 'Askbot Mail Test',
             recipient_list = [args[0]],
+            raise_on_failure = True
         )
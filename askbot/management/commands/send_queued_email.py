@@ -0,0 +1,110 @@
+"""sends the messages from the outgoing email queue,
+run it from cron, or keep it running with the ``--loop`` option
+
+python manage.py send_queued_email [--workers=4] [--domain-rate=60]
+                                   [--max-attempts=5] [--retry-delay=60]
+                                   [--loop] [--retry-dead]
+
+the per-domain rates can be set in the django settings, e.g.
+ASKBOT_EMAIL_QUEUE_DOMAIN_RATES = {'example.com': 20}
+"""
+import datetime
+import time
+from optparse import make_option
+from django.conf import settings as django_settings
+from django.core.management.base import NoArgsCommand
+from django.db import connection
+from askbot.mail import queue
+from askbot.models import QueuedEmail
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--workers',
+            action = 'store',
+            type = 'int',
+            dest = 'workers',
+            default = 1,
+            help = 'number of threads sending the messages'
+        ),
+        make_option('--domain-rate',
+            action = 'store',
+            type = 'int',
+            dest = 'domain_rate',
+            default = 0,
+            help = 'messages per minute to a recipient domain, 0 - no limit'
+        ),
+        make_option('--max-attempts',
+            action = 'store',
+            type = 'int',
+            dest = 'max_attempts',
+            default = 5,
+            help = 'failed message is not retried after this many attempts'
+        ),
+        make_option('--retry-delay',
+            action = 'store',
+            type = 'int',
+            dest = 'retry_delay',
+            default = 60,
+            help = 'seconds before the first retry, doubled with each attempt'
+        ),
+        make_option('--loop',
+            action = 'store_true',
+            dest = 'loop',
+            default = False,
+            help = 'keep checking the queue every --interval seconds'
+        ),
+        make_option('--interval',
+            action = 'store',
+            type = 'int',
+            dest = 'interval',
+            default = 10,
+            help = 'seconds between the checks of the queue in the loop'
+        ),
+        make_option('--retry-dead',
+            action = 'store_true',
+            dest = 'retry_dead',
+            default = False,
+            help = 'return the undelivered messages to the queue'
+        ),
+    )
+
+    def handle_noargs(self, **options):
+        try:
+            if options['retry_dead']:
+                requeued = QueuedEmail.objects.filter(
+                            status = QueuedEmail.STATUS_DEAD
+                        ).update(
+                            status = QueuedEmail.STATUS_QUEUED,
+                            attempt_count = 0,
+                            next_attempt_at = datetime.datetime.now()
+                        )
+                print '%d undelivered messages returned to the queue' % requeued
+
+            rate_limiter = queue.DomainRateLimiter(
+                rate = options['domain_rate'],
+                domain_rates = getattr(
+                    django_settings, 'ASKBOT_EMAIL_QUEUE_DOMAIN_RATES', None
+                )
+            )
+            while True:
+                stats = queue.send_queued_messages(
+                            workers = options['workers'],
+                            rate_limiter = rate_limiter,
+                            max_attempts = options['max_attempts'],
+                            retry_delay = options['retry_delay']
+                        )
+                if stats or not options['loop']:
+                    self.print_stats(stats)
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        finally:
+            connection.close()
+
+    def print_stats(self, stats):
+        print '%d sent, %d to retry, %d undelivered, %d postponed' % (
+                                        stats.get('sent', 0),
+                                        stats.get('retried', 0),
+                                        stats.get('dead', 0),
+                                        stats.get('postponed', 0)
+                                    )
@@ -4,6 +4,7 @@ from askbot import const
 from askbot.conf import settings as askbot_settings
 from django.utils.translation import ungettext
 from askbot import mail
+from askbot.mail.reminders import ReminderPlanner
 from askbot.utils.classes import ReminderSchedule
 from askbot.models.question import Thread
 
@@ -39,25 +40,15 @@ class Command(NoArgsCommand):
         #for all users, excluding blocked
         #for each user, select a tag filtered subset
         #format the email reminder and send it
-        for user in models.User.objects.exclude(status = 'b'):
-            user_questions = questions.exclude(author = user)
-            user_questions = user.get_tag_filtered_questions(user_questions)
-
-            if askbot_settings.GROUPS_ENABLED:
-                user_groups = user.get_groups()
-                user_questions = user_questions.filter(groups__in = user_groups)
-
-            final_question_list = user_questions.get_questions_needing_reminder(
-                user = user,
-                activity_type = const.TYPE_ACTIVITY_UNANSWERED_REMINDER_SENT,
-                recurrence_delay = schedule.recurrence_delay
-            )
+        planner = ReminderPlanner(
+            questions = questions,
+            activity_type = const.TYPE_ACTIVITY_UNANSWERED_REMINDER_SENT,
+            recurrence_delay = schedule.recurrence_delay
+        )
+        for user, final_question_list in planner.get_reminders():
 
             question_count = len(final_question_list)
-            if question_count == 0:
-                continue
-
-            threads = Thread.objects.filter(id__in=[qq.thread_id for qq in final_question_list])
+            threads = [question.thread for question in final_question_list]
             tag_summary = Thread.objects.get_tag_summary_from_threads(threads)
 
             subject_line = ungettext(
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from south.db import db
+from south.v2 import SchemaMigration
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        try:
+            # Adding field 'User.upvoted_reputation_today'
+            db.add_column(
+                u'auth_user', 'upvoted_reputation_today',
+                self.gf('django.db.models.fields.IntegerField')(default=0), keep_default=False)
+        except:
+            pass
+        try:
+            # Adding field 'User.upvoted_reputation_date'
+            db.add_column(
+                u'auth_user', 'upvoted_reputation_date',
+                self.gf('django.db.models.fields.DateField')(null=True, blank=True), keep_default=False)
+        except:
+            pass
+
+    def backwards(self, orm):
+        db.delete_column('auth_user', 'upvoted_reputation_today')
+        db.delete_column('auth_user', 'upvoted_reputation_date')
+
+    complete_apps = ['askbot']
@@ -5,6 +5,7 @@ import collections
 import datetime
 import hashlib
 import logging
+import time
 import urllib
 from django.core.urlresolvers import reverse, NoReverseMatch
 from django.db.models import signals as django_signals
@@ -15,6 +16,7 @@ from django.contrib.auth.models import User
 from django.utils.safestring import mark_safe
 from django.utils.html import escape
 from django.db import models
+from django.db import connection, transaction
 from django.conf import settings as django_settings
 from django.contrib.contenttypes.models import ContentType
 from django.core import cache
@@ -29,10 +31,13 @@ from askbot.skins import utils as skin_utils
 from askbot.models.question import QuestionView, AnonymousQuestion
 from askbot.models.question import FavoriteQuestion
 from askbot.models.tag import Tag, MarkedTag
+from askbot.models.tag import record_wildcard_selection_change
 from askbot.models.user import EmailFeedSetting, ActivityAuditStatus, Activity
 from askbot.models.user import GroupMembership, GroupProfile
 from askbot.models.post import Post, PostRevision, PostFlagReason, AnonymousAnswer
 from askbot.models.reply_by_email import ReplyAddress
+from askbot.models.mail_queue import QueuedEmail
+from askbot.models.search_index import SearchPosting
 from askbot.models import signals
 from askbot.models.badges import award_badges_signal, get_badge, BadgeData
 from askbot.models.repute import Award, Repute, Vote
@@ -42,7 +47,10 @@ from askbot.utils.slug import slugify
 from askbot.utils.html import sanitize_html
 from askbot.utils.diff import textDiff as htmldiff
 from askbot.utils.url_utils import strip_path
+from askbot.utils.cache import is_shared_with_celery_workers, PendingIds
+from askbot.utils.lists import batch_size
 from askbot import mail
+from askbot.mail import render_cache
 
 def get_model(model_name):
     """a shortcut for getting model for an askbot app"""
@@ -145,6 +153,10 @@ User.add_to_class(
 User.add_to_class('new_response_count', models.IntegerField(default=0))
 User.add_to_class('seen_response_count', models.IntegerField(default=0))
 User.add_to_class('consecutive_days_visit_count', models.IntegerField(default = 0))
+#reputation gained through the upvotes on the given day,
+#used to limit the daily gain without summing up the history
+User.add_to_class('upvoted_reputation_today', models.IntegerField(default = 0))
+User.add_to_class('upvoted_reputation_date', models.DateField(null = True, blank = True))
 
 GRAVATAR_TEMPLATE = "http://www.gravatar.com/avatar/%(gravatar)s?" + \
     "s=%(size)d&amp;d=%(type)s&amp;r=PG"
@@ -278,6 +290,86 @@ def user_get_marked_tag_names(self, reason):
         
     return tag_names
 
+RESOLVED_TAG_SELECTIONS_KEY_TPL = 'user-resolved-tag-selections-%d'
+TAG_SET_VERSION_KEY = 'tag-set-version'
+
+def get_tag_set_version():
+    """returns version stamp of the set of tags, the version
+    changes when new tags are created, and is used to
+    expire resolved wildcard tag selections"""
+    version = cache.cache.get(TAG_SET_VERSION_KEY)
+    if version is None:
+        #use time, so that version does not repeat when cache is cleared
+        version = int(time.time() * 1000)
+        cache.cache.set(TAG_SET_VERSION_KEY, version, const.LONG_TIME)
+    return version
+
+def invalidate_resolved_tag_selections(user_id):
+    cache.cache.delete(RESOLVED_TAG_SELECTIONS_KEY_TPL % user_id)
+
+def user_update_resolved_tag_selections(self):
+    """calculates and caches the user tag selections with
+    the wildcards expanded to the matching tag ids.
+    Returns a dictionary keyed by the reason: good, bad and subscribed
+    with values - dictionaries with keys:
+
+    * 'tag_names' - names of the explicitly marked tags
+    * 'tag_ids' - ids of the marked tags and of tags matching
+      the wildcards of the same reason
+    """
+    tag_set_version = get_tag_set_version()
+    selections = dict()
+    for reason in MARKED_TAG_PROPERTY_MAP:
+        selections[reason] = {'tag_names': list(), 'tag_ids': set()}
+
+    marks = MarkedTag.objects.filter(
+                            user = self
+                        ).values_list('reason', 'tag__id', 'tag__name')
+    for reason, tag_id, tag_name in marks:
+        selections[reason]['tag_names'].append(tag_name)
+        selections[reason]['tag_ids'].add(tag_id)
+
+    uses_wildcards = False
+    if askbot_settings.USE_WILDCARD_TAGS:
+        for reason, attr_name in MARKED_TAG_PROPERTY_MAP.items():
+            wildcards = getattr(self, attr_name).split()
+            if wildcards:
+                uses_wildcards = True
+                wildcard_tag_ids = Tag.objects.get_by_wildcards(
+                                        wildcards
+                                    ).values_list('id', flat = True)
+                selections[reason]['tag_ids'].update(wildcard_tag_ids)
+
+    for selection in selections.values():
+        selection['tag_ids'] = list(selection['tag_ids'])
+
+    data = {
+        'selections': selections,
+        'uses_wildcards': uses_wildcards,
+        'tag_set_version': tag_set_version
+    }
+    cache.cache.set(
+        RESOLVED_TAG_SELECTIONS_KEY_TPL % self.id,
+        data,
+        const.LONG_TIME
+    )
+    return selections
+
+def user_get_resolved_tag_selections(self):
+    """returns cached tag selections of the user
+    as calculated by the
+    :meth:`~askbot.models.user_update_resolved_tag_selections`
+    the data is recalculated when missing or when new tags
+    were created since the wildcards were last expanded
+    """
+    data = cache.cache.get(RESOLVED_TAG_SELECTIONS_KEY_TPL % self.id)
+    if data is None:
+        return self.update_resolved_tag_selections()
+    if data['uses_wildcards'] \
+        and data['tag_set_version'] != get_tag_set_version():
+        return self.update_resolved_tag_selections()
+    return data['selections']
+
 def user_has_affinity_to_question(self, question = None, affinity_type = None):
     """returns True if number of tag overlap of the user tag
     selection with the question is 0 and False otherwise
@@ -1129,7 +1221,7 @@ def user_post_comment(
                     added_at = timestamp,
                     by_email = by_email
                 )
-    parent_post.thread.invalidate_cached_data()
+    parent_post.thread.update_cached_data(comment)
     award_badges_signal.send(
         None,
         event = 'post_comment',
@@ -1258,6 +1350,8 @@ def user_mark_tags(
                 marked_ts.update(reason=reason)
             cleaned_tagnames = tagnames
 
+    self.update_resolved_tag_selections()
+
     return cleaned_tagnames, cleaned_wildcards
 
 @auto_now_timestamp
@@ -1339,6 +1433,7 @@ def user_delete_comment(
     #comment.save()
     comment.delete()
     comment.thread.invalidate_cached_data()
+    update_search_index(post = comment)
 
 @auto_now_timestamp
 def user_delete_answer(
@@ -1456,6 +1551,7 @@ def user_restore_post(
         post.deleted_at = None
         post.save()
         post.thread.invalidate_cached_data()
+        update_search_index(post = post)
         if post.post_type == 'answer':
             post.thread.update_answer_count()
         else:
@@ -1537,7 +1633,7 @@ def user_edit_comment(
                         edited_by = self,
                         by_email = by_email
                     )
-    comment_post.thread.invalidate_cached_data()
+    comment_post.thread.update_cached_data(comment_post)
 
 def user_edit_post(self,
                 post = None,
@@ -1616,7 +1712,7 @@ def user_edit_question(
         by_email = by_email
     )
 
-    question.thread.invalidate_cached_data()
+    question.thread.update_cached_data(question)
 
     award_badges_signal.send(None,
         event = 'edit_question',
@@ -1646,7 +1742,7 @@ def user_edit_answer(
         wiki = wiki,
         by_email = by_email
     )
-    answer.thread.invalidate_cached_data()
+    answer.thread.update_cached_data(answer)
     award_badges_signal.send(None,
         event = 'edit_answer',
         actor = self,
@@ -1769,7 +1865,7 @@ def user_post_answer(
         wiki = wiki,
         by_email = by_email
     )
-    answer_post.thread.invalidate_cached_data()
+    answer_post.thread.update_cached_data(answer_post)
     award_badges_signal.send(None,
         event = 'post_answer',
         actor = self,
@@ -2312,13 +2408,17 @@ def _process_vote(user, post, timestamp=None, cancel=False, vote_type=None):
         else:
             auth.onDownVoted(vote, post, user, timestamp)
             
-    post.thread.invalidate_cached_data()
-
-    if post.post_type == 'question':
-        #denormalize the question post score on the thread
-        post.thread.score = post.score
-        post.thread.save()
-        post.thread.update_summary_html()
+    #other votes may have been applied at the same time,
+    #the cached post data must get the current counts
+    post.score, post.vote_up_count, post.vote_down_count = \
+        Post.objects.filter(
+            id = post.id
+        ).values_list(
+            'score', 'vote_up_count', 'vote_down_count'
+        )[0]
+    #question score is denormalized on the thread by the
+    #functions above, this also schedules update of the summary
+    post.thread.update_cached_data(post)
 
     if cancel:
         return None
@@ -2463,6 +2563,43 @@ def user_update_response_counts(user):
                                 ).count()
     user.save()
 
+def update_new_response_counts(user_ids):
+    """Recount number of new responses to many users
+    with a single query per batch of users, equivalent to
+    :func:`user_update_response_counts` for
+    the ``new_response_count`` field
+    """
+    user_ids = list(user_ids)
+    if len(user_ids) == 0:
+        return
+    ACTIVITY_TYPES = const.RESPONSE_ACTIVITY_TYPES_FOR_DISPLAY
+    ACTIVITY_TYPES += (const.TYPE_ACTIVITY_MENTION,)
+
+    quote_name = connection.ops.quote_name
+    tables = {
+        'user': quote_name(User._meta.db_table),
+        'audit': quote_name(ActivityAuditStatus._meta.db_table),
+        'activity': quote_name(Activity._meta.db_table),
+        'types': ', '.join(['%s'] * len(ACTIVITY_TYPES))
+    }
+    cursor = connection.cursor()
+    #the batches keep the number of the query parameters
+    #below the limits of the databases, e.g. 999 in sqlite
+    for id_batch in batch_size(user_ids, 500):
+        tables['user_ids'] = ', '.join(['%s'] * len(id_batch))
+        sql = 'UPDATE %(user)s SET new_response_count = (' \
+                'SELECT COUNT(*) FROM %(audit)s INNER JOIN %(activity)s ' \
+                'ON %(audit)s.activity_id = %(activity)s.id ' \
+                'WHERE %(audit)s.user_id = %(user)s.id ' \
+                'AND %(audit)s.status = %%s ' \
+                'AND %(activity)s.activity_type IN (%(types)s)' \
+            ') WHERE %(user)s.id IN (%(user_ids)s)' % tables
+        params = [ActivityAuditStatus.STATUS_NEW]
+        params.extend(ACTIVITY_TYPES)
+        params.extend(id_batch)
+        cursor.execute(sql, params)
+    transaction.commit_unless_managed()
+
 
 def user_receive_reputation(self, num_points):
     new_points = self.reputation + num_points
@@ -2515,6 +2652,8 @@ def user_update_wildcard_tag_selections(
     self.ignored_tags = ' '.join(ignored)
     self.subscribed_tags = ' '.join(subscribed)
     self.save()
+    invalidate_resolved_tag_selections(self.id)
+    record_wildcard_selection_change(self.id)
     return new_tags
 
 
@@ -2559,6 +2698,8 @@ User.add_to_class('get_gravatar_url', user_get_gravatar_url)
 User.add_to_class('get_or_create_fake_user', user_get_or_create_fake_user)
 User.add_to_class('get_marked_tags', user_get_marked_tags)
 User.add_to_class('get_marked_tag_names', user_get_marked_tag_names)
+User.add_to_class('get_resolved_tag_selections', user_get_resolved_tag_selections)
+User.add_to_class('update_resolved_tag_selections', user_update_resolved_tag_selections)
 User.add_to_class('strip_email_signature', user_strip_email_signature)
 User.add_to_class('get_groups_membership_info', user_get_groups_membership_info)
 User.add_to_class('get_anonymous_name', user_get_anonymous_name)
@@ -2675,35 +2816,24 @@ User.add_to_class(
 )
 
 #todo: move this to askbot/mail ?
-def format_instant_notification_email(
-                                        to_user = None,
-                                        from_user = None,
-                                        post = None,
-                                        reply_address = None,
-                                        alt_reply_address = None,
-                                        update_type = None,
-                                        template = None,
-                                    ):
-    """
-    returns text of the instant notification body
-    and subject line
+def get_instant_notification_data(
+                                    from_user = None,
+                                    post = None,
+                                    update_type = None
+                                ):
+    """returns parts of the instant notification about
+    the post update, which are the same for all recipients,
+    as a dictionary with keys:
+
+    * 'subject_line'
+    * 'user_action' - html line describing the update
+    * 'update_data' - template context values
 
-    that is built when post is updated
     only update_types in const.RESPONSE_ACTIVITY_TYPE_MAP_FOR_TEMPLATES
     are supported
     """
-
     site_url = askbot_settings.APP_URL
     origin_post = post.get_origin_post()
-    #todo: create a better method to access "sub-urls" in user views
-    user_subscriptions_url = site_url + \
-                                reverse(
-                                    'user_subscriptions',
-                                    kwargs = {
-                                        'id': to_user.id,
-                                        'slug': slugify(to_user.username)
-                                    }
-                                )
 
     if update_type == 'question_comment':
         assert(isinstance(post, Post) and post.is_comment())
@@ -2770,6 +2900,61 @@ def format_instant_notification_email(
         'post_link': '<a href="%s">%s</a>' % (post_url, _(post.post_type))
     }
 
+    update_data = {
+        'update_author_name': from_user.username,
+        'reply_by_email_karma_threshold': askbot_settings.MIN_REP_TO_POST_BY_EMAIL,
+        'content_preview': content_preview,#post.get_snippet()
+        'update_type': update_type,
+        'post_url': post_url,
+        'origin_post_title': origin_post.thread.title,
+    }
+    return {
+        'subject_line': _('"%(title)s"') % {'title': origin_post.thread.title},
+        'user_action': user_action,
+        'update_data': update_data
+    }
+
+def format_instant_notification_email(
+                                        to_user = None,
+                                        from_user = None,
+                                        post = None,
+                                        reply_address = None,
+                                        alt_reply_address = None,
+                                        update_type = None,
+                                        template = None,
+                                        notification_data = None
+                                    ):
+    """
+    returns text of the instant notification body
+    and subject line
+
+    that is built when post is updated
+    only update_types in const.RESPONSE_ACTIVITY_TYPE_MAP_FOR_TEMPLATES
+    are supported
+
+    ``notification_data`` - parts of the email common to
+    all recipients, as returned by
+    :func:`get_instant_notification_data`, calculated
+    if not given
+    """
+    if notification_data is None:
+        notification_data = get_instant_notification_data(
+                                    from_user = from_user,
+                                    post = post,
+                                    update_type = update_type
+                                )
+
+    site_url = askbot_settings.APP_URL
+    #todo: create a better method to access "sub-urls" in user views
+    user_subscriptions_url = site_url + \
+                                reverse(
+                                    'user_subscriptions',
+                                    kwargs = {
+                                        'id': to_user.id,
+                                        'slug': slugify(to_user.username)
+                                    }
+                                )
+
     can_reply = to_user.can_post_by_email()
 
     if can_reply:
@@ -2786,29 +2971,23 @@ def format_instant_notification_email(
                 const.REPLY_WITH_COMMENT_TEMPLATE % data
             reply_separator += '</p>'
     else:
-        reply_separator = user_action
-                    
-    update_data = {
-        'update_author_name': from_user.username,
+        reply_separator = notification_data['user_action']
+
+    update_data = dict(notification_data['update_data'])
+    update_data.update({
         'receiving_user_name': to_user.username,
         'receiving_user_karma': to_user.reputation,
-        'reply_by_email_karma_threshold': askbot_settings.MIN_REP_TO_POST_BY_EMAIL,
         'can_reply': can_reply,
-        'content_preview': content_preview,#post.get_snippet()
-        'update_type': update_type,
-        'post_url': post_url,
-        'origin_post_title': origin_post.thread.title,
         'user_subscriptions_url': user_subscriptions_url,
         'reply_separator': reply_separator
-    }
-    subject_line = _('"%(title)s"') % {'title': origin_post.thread.title}
+    })
 
     content = template.render(Context(update_data))
     if can_reply:
         content += '<p style="font-size:8px;color:#aaa">' + \
                     reply_address + '</p>'
 
-    return subject_line, content
+    return notification_data['subject_line'], content
 
 def get_reply_to_addresses(user, post):
     """Returns one or two email addresses that can be
@@ -2838,19 +3017,16 @@ def get_reply_to_addresses(user, post):
                 'reply_action': 'post_comment'
             }
             if post.post_type in ('answer', 'comment'):
-                reply_args['reply_action'] = 'post_comment'
-            elif post.post_type == 'question':
-                reply_args['reply_action'] = 'post_answer'
-
-            primary_addr = ReplyAddress.objects.create_new(
-                                                    **reply_args
-                                                ).as_email_address()
-
-            if post.post_type == 'question':
-                reply_args['reply_action'] = 'post_comment'
-                secondary_addr = ReplyAddress.objects.create_new(
+                primary_addr = ReplyAddress.objects.create_new(
                                                     **reply_args
                                                 ).as_email_address()
+            elif post.post_type == 'question':
+                #answer and comment addresses are created together
+                answer_args = dict(reply_args, reply_action = 'post_answer')
+                answer_address, comment_address = \
+                    ReplyAddress.objects.create_many([answer_args, reply_args])
+                primary_addr = answer_address.as_email_address()
+                secondary_addr = comment_address.as_email_address()
     return primary_addr, secondary_addr
 
 #todo: action
@@ -2885,33 +3061,57 @@ def send_instant_notifications_about_activity_in_post(
                             origin_post,
                             update_activity.activity_type
                         )
-    #send email for all recipients
-    for user in recipients:
+    template = get_template('instant_notification.html')
+
+    def get_messages():
+        """email messages for all recipients, made
+        as they are sent - one batch at a time"""
+        notification_data = None
+        for user in recipients:
+
+            if user.is_blocked():
+                continue
+
+            if notification_data is None:
+                #parts of the email common to all recipients are made once
+                notification_data = get_instant_notification_data(
+                                            from_user = update_activity.user,
+                                            post = post,
+                                            update_type = update_type
+                                        )
 
-        if user.is_blocked():
-            continue
-
-        reply_address, alt_reply_address = get_reply_to_addresses(user, post)
-
-        subject_line, body_text = format_instant_notification_email(
-                            to_user = user,
-                            from_user = update_activity.user,
-                            post = post,
-                            reply_address = reply_address,
-                            alt_reply_address = alt_reply_address,
-                            update_type = update_type,
-                            template = get_template('instant_notification.html')
-                        )
-      
-        headers['Reply-To'] = reply_address
-        mail.send_mail(
-            subject_line = subject_line,
-            body_text = body_text,
-            recipient_list = [user.email],
-            related_object = origin_post,
-            activity_type = const.TYPE_ACTIVITY_EMAIL_UPDATE_SENT,
-            headers = headers
+            reply_address, alt_reply_address = get_reply_to_addresses(user, post)
+
+            subject_line, body_text = format_instant_notification_email(
+                                to_user = user,
+                                from_user = update_activity.user,
+                                post = post,
+                                reply_address = reply_address,
+                                alt_reply_address = alt_reply_address,
+                                update_type = update_type,
+                                template = template,
+                                notification_data = notification_data
+                            )
+
+            message_headers = dict(headers)
+            message_headers['Reply-To'] = reply_address
+            yield mail.make_message(
+                        subject_line = subject_line,
+                        body_text = body_text,
+                        recipient_list = [user.email],
+                        headers = message_headers
+                    )
+
+    render_stats = render_cache.STATS.copy()
+    mail.send_mail_batch(
+        messages = get_messages(),
+        description = 'instant notification about post %d' % post.id
+    )
+    logging.info(
+        'mail render cache of instant notification about post %d: %s' % (
+            post.id, render_cache.STATS.since(render_stats)
         )
+    )
 
 def notify_author_of_published_revision(
     revision = None, was_approved = None, **kwargs
@@ -2972,6 +3172,46 @@ def record_post_update_activity(
     )
 
 
+def update_search_index(
+        post = None, thread = None, instance = None, **kwargs
+    ):
+    """called upon signals post_updated, tags_updated and
+    delete_question_or_answer, and when the posts are restored
+    and the comments deleted, updates the postings of the thread
+    in the built-in search index, if it is used
+    """
+    from askbot.search import inverted_index
+    if not inverted_index.is_enabled():
+        return
+    if thread is None:
+        post = post or instance
+        thread = post.thread
+        if thread is None:
+            #tag wiki and reject reason posts are not searched
+            return
+    inverted_index.update_thread(thread)
+
+
+def hide_thread_of_removed_question(instance, **kwargs):
+    """called when a post is removed from the database,
+    the thread of a removed question post loses its question
+    and is hidden from the question list"""
+    if instance.post_type == 'question' and instance.thread_id:
+        Thread.objects.filter(
+                    id = instance.thread_id,
+                    question_post__isnull = True
+                ).update(
+                    question_deleted = True
+                )
+
+
+def invalidate_search_results(**kwargs):
+    """called on changes of the posts, threads and tags,
+    makes the cached search results stale"""
+    from askbot.search import result_cache
+    result_cache.increment_content_version()
+
+
 def record_award_event(instance, created, **kwargs):
     """
     After we awarded a badge to user, we need to
@@ -3046,23 +3286,89 @@ def record_answer_accepted(instance, created, **kwargs):
                                 )
         activity.add_recipients(recipients)
 
+USER_LAST_SEEN_KEY_TPL = 'user-last-seen-%d'
+#ids of the users with visits waiting to be saved
+USERS_WITH_PENDING_VISITS = PendingIds('user-pending-visits')
+
 def record_user_visit(user, timestamp, **kwargs):
     """
     when user visits any pages, we update the last_seen and
     consecutive_days_visit_count
+
+    last visit time is kept in the cache and the visits of all
+    users are saved to the database by one celery task at most
+    once in ``LAST_SEEN_UPDATE_DELAY`` seconds, the first visit
+    on a new day is saved right away
+
+    the cache must be shared with the celery workers, otherwise
+    the visit is saved right away
     """
-    prev_last_seen = user.last_seen or datetime.datetime.now()
+    last_seen_key = USER_LAST_SEEN_KEY_TPL % user.id
+    #the database value is behind the cached one,
+    #while the visit is waiting to be saved
+    prev_last_seen = cache.cache.get(last_seen_key) \
+                        or user.last_seen or datetime.datetime.now()
     user.last_seen = timestamp
+    update_data = {'last_seen': timestamp}
     if (user.last_seen - prev_last_seen).days == 1:
         user.consecutive_days_visit_count += 1
+        update_data['consecutive_days_visit_count'] = \
+                                    user.consecutive_days_visit_count
         award_badges_signal.send(None,
             event = 'site_visit',
             actor = user,
             context_object = user,
             timestamp = timestamp
         )
-    #somehow it saves on the query as compared to user.save()
-    User.objects.filter(id = user.id).update(last_seen = timestamp)
+    cache.cache.set(last_seen_key, timestamp, const.LONG_TIME)
+
+    delay = askbot_settings.LAST_SEEN_UPDATE_DELAY
+    if delay <= 0 or len(update_data) > 1 \
+        or timestamp.date() != prev_last_seen.date() \
+        or not is_shared_with_celery_workers():
+        #somehow it saves on the query as compared to user.save()
+        User.objects.filter(id = user.id).update(**update_data)
+        return
+
+    from askbot import tasks
+    USERS_WITH_PENDING_VISITS.add(user.id, 2 * delay)
+    USERS_WITH_PENDING_VISITS.schedule(
+        tasks.save_pending_user_visits_celery_task, delay
+    )
+
+
+def save_pending_user_visits(user_ids = None):
+    """saves last visit times of the users, recorded in the cache
+    by :func:`record_user_visit`, by default - of all users
+    who visited the site since the last save, the visits
+    of the same second are saved with one query
+    """
+    #visits from now on must schedule a new save
+    USERS_WITH_PENDING_VISITS.unschedule()
+    if user_ids is None:
+        user_ids = USERS_WITH_PENDING_VISITS.pop_all()
+    else:
+        USERS_WITH_PENDING_VISITS.clear_marks(user_ids)
+
+    ids_by_time = dict()
+    for id_batch in batch_size(user_ids, 1000):
+        key_map = dict(
+            (USER_LAST_SEEN_KEY_TPL % user_id, user_id)
+            for user_id in id_batch
+        )
+        last_seen_times = cache.cache.get_many(key_map.keys())
+        for key, last_seen in last_seen_times.items():
+            last_seen = last_seen.replace(microsecond = 0)
+            ids_by_time.setdefault(last_seen, list()).append(key_map[key])
+
+    for last_seen, ids in ids_by_time.items():
+        for id_batch in batch_size(ids, 500):
+            User.objects.filter(
+                            id__in = id_batch,
+                            last_seen__lt = last_seen
+                        ).update(
+                            last_seen = last_seen
+                        )
 
 
 def record_vote(instance, created, **kwargs):
@@ -3278,6 +3584,21 @@ def complete_pending_tag_subscriptions(sender, request, *args, **kwargs):
             message = _('Your tag subscription was saved, thanks!')
         )
 
+def expire_resolved_wildcard_tag_selections(sender, instance, created, **kwargs):
+    """new tags may match wildcards of some users,
+    so the tag set version is bumped when a tag is created
+    """
+    if created:
+        try:
+            cache.cache.incr(TAG_SET_VERSION_KEY)
+        except ValueError:
+            #version is not in the cache yet
+            get_tag_set_version()
+
+def invalidate_user_tag_selections(sender, instance, **kwargs):
+    """``instance`` is a ``MarkedTag``"""
+    invalidate_resolved_tag_selections(instance.user_id)
+
 def add_missing_subscriptions(sender, instance, created, **kwargs):
     """``sender`` is instance of ``User``. When the ``User``
     is created, any required email subscription settings will be
@@ -3285,6 +3606,20 @@ def add_missing_subscriptions(sender, instance, created, **kwargs):
     if created:
         instance.add_missing_askbot_subscriptions()
 
+def update_subscriptions_tag_filter_strategy(sender, instance, created, **kwargs):
+    """copies email tag filter strategy of the ``User``
+    to the user's email feed settings, where it is
+    used to look up the subscribers"""
+    if created:
+        return#new subscriptions copy the strategy themselves
+    EmailFeedSetting.objects.filter(
+        subscriber = instance
+    ).exclude(
+        tag_filter_strategy = instance.email_tag_filter_strategy
+    ).update(
+        tag_filter_strategy = instance.email_tag_filter_strategy
+    )
+
 def post_anonymous_askbot_content(
                                 sender,
                                 request,
@@ -3326,6 +3661,10 @@ def make_admin_if_first_user(instance, **kwargs):
 django_signals.pre_save.connect(make_admin_if_first_user, sender=User)
 django_signals.pre_save.connect(calculate_gravatar_hash, sender=User)
 django_signals.post_save.connect(add_missing_subscriptions, sender=User)
+django_signals.post_save.connect(update_subscriptions_tag_filter_strategy, sender=User)
+django_signals.post_save.connect(expire_resolved_wildcard_tag_selections, sender=Tag)
+django_signals.post_save.connect(invalidate_user_tag_selections, sender=MarkedTag)
+django_signals.post_delete.connect(invalidate_user_tag_selections, sender=MarkedTag)
 django_signals.post_save.connect(record_award_event, sender=Award)
 django_signals.post_save.connect(notify_award_message, sender=Award)
 django_signals.post_save.connect(record_answer_accepted, sender=Post)
@@ -3349,6 +3688,17 @@ signals.user_updated.connect(record_user_full_updated, sender=User)
 signals.user_logged_in.connect(complete_pending_tag_subscriptions)#todo: add this to fake onlogin middleware
 signals.user_logged_in.connect(post_anonymous_askbot_content)
 signals.post_updated.connect(record_post_update_activity)
+signals.post_updated.connect(update_search_index)
+signals.tags_updated.connect(update_search_index)
+signals.delete_question_or_answer.connect(update_search_index, sender=Post)
+django_signals.post_save.connect(invalidate_search_results, sender=Post)
+django_signals.post_delete.connect(hide_thread_of_removed_question, sender=Post)
+django_signals.post_delete.connect(invalidate_search_results, sender=Post)
+django_signals.post_save.connect(invalidate_search_results, sender=Thread)
+django_signals.post_delete.connect(invalidate_search_results, sender=Thread)
+django_signals.post_save.connect(invalidate_search_results, sender=Tag)
+django_signals.post_delete.connect(invalidate_search_results, sender=Tag)
+signals.tags_updated.connect(invalidate_search_results)
 
 #probably we cannot use post-save here the point of this is
 #to tell when the revision becomes publicly visible, not when it is saved
@@ -3395,6 +3745,9 @@ __all__ = [
 
         'ReplyAddress',
 
+        'QueuedEmail',
+        'SearchPosting',
+
         'get_model',
         'get_admins_and_moderators'
 ]
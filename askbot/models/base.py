@@ -1,7 +1,43 @@
 import datetime
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import sql
 from django.contrib.auth.models import User
 
+def insert_objects(objects, using = 'default'):
+    """inserts unsaved model instances of one model with one
+    ``executemany`` query, no signals are sent and the
+    primary keys, unless set beforehand, remain unknown
+    """
+    connection = connections[using]
+    statement = None
+    param_list = list()
+    for obj in objects:
+        fields = obj._meta.local_fields
+        if obj.pk is None:
+            fields = [
+                field for field in fields
+                if not isinstance(field, models.AutoField)
+            ]
+        values = [
+            (
+                field,
+                field.get_db_prep_save(
+                    field.pre_save(obj, True),
+                    connection = connection
+                )
+            )
+            for field in fields
+        ]
+        query = sql.InsertQuery(obj.__class__)
+        query.insert_values(values)
+        compiler = query.get_compiler(connection = connection)
+        compiler.return_id = False
+        statement, params = compiler.as_sql()
+        param_list.append(params)
+    if param_list:
+        connection.cursor().executemany(statement, param_list)
+        transaction.commit_unless_managed(using = using)
+
 class BaseQuerySetManager(models.Manager):
     """a base class that allows chainable qustom filters
     on the query sets
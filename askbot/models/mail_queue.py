@@ -0,0 +1,98 @@
+"""persistent queue of the outgoing email messages,
+filled by :func:`askbot.mail.send_mail` and emptied by the
+``send_queued_email`` management command
+"""
+import base64
+import cPickle
+import datetime
+from django.db import models
+from django.utils.encoding import force_unicode
+from django.utils.translation import ugettext as _
+
+class QueuedEmailManager(models.Manager):
+    """A manager for the :class:`QueuedEmail` model"""
+
+    def enqueue(self, message):
+        """adds the ``django.core.mail.EmailMessage`` to the queue"""
+        item = QueuedEmail()
+        item.set_message(message)
+        item.save()
+        return item
+
+    def get_due(self, count, now = None):
+        """returns up to ``count`` messages due to be sent"""
+        now = now or datetime.datetime.now()
+        return list(
+            self.filter(
+                status = QueuedEmail.STATUS_QUEUED,
+                next_attempt_at__lte = now
+            ).order_by('next_attempt_at', 'id')[:count]
+        )
+
+    def claim(self, item, lease_until):
+        """takes the message for sending by moving its next attempt
+        time to ``lease_until``, returns False if another worker
+        has done that first. If the worker dies, the message
+        is taken again when the lease expires"""
+        claimed = self.filter(
+                        id = item.id,
+                        status = QueuedEmail.STATUS_QUEUED,
+                        next_attempt_at = item.next_attempt_at
+                    ).update(next_attempt_at = lease_until)
+        if claimed:
+            item.next_attempt_at = lease_until
+        return claimed == 1
+
+
+class QueuedEmail(models.Model):
+    """an email message waiting to be sent,
+    failed messages are retried until the attempts
+    run out, then they are kept as dead letters"""
+    STATUS_QUEUED = 'q'
+    STATUS_DEAD = 'd'
+    STATUS_CHOICES = (
+        (STATUS_QUEUED, _('queued')),
+        (STATUS_DEAD, _('not delivered')),
+    )
+    #pickled and base64 encoded EmailMessage
+    message_data = models.TextField()
+    #domain of the first recipient, for the rate limits
+    recipient_domain = models.CharField(max_length = 255, default = '')
+    status = models.CharField(
+                        max_length = 1,
+                        choices = STATUS_CHOICES,
+                        default = STATUS_QUEUED
+                    )
+    attempt_count = models.PositiveIntegerField(default = 0)
+    next_attempt_at = models.DateTimeField(
+                        default = datetime.datetime.now,
+                        db_index = True
+                    )
+    last_error = models.TextField(default = '', blank = True)
+    added_at = models.DateTimeField(default = datetime.datetime.now)
+
+    objects = QueuedEmailManager()
+
+    class Meta:
+        app_label = 'askbot'
+
+    def __unicode__(self):
+        return u'email to %s, %d attempts' % (
+                                    self.recipient_domain,
+                                    self.attempt_count
+                                )
+
+    def set_message(self, message):
+        #lazy translations are not pickled
+        message.subject = force_unicode(message.subject)
+        message.body = force_unicode(message.body)
+        message.connection = None
+        recipients = message.recipients()
+        if recipients:
+            self.recipient_domain = recipients[0].rsplit('@', 1)[-1].lower()
+        self.message_data = base64.b64encode(
+                        cPickle.dumps(message, cPickle.HIGHEST_PROTOCOL)
+                    )
+
+    def get_message(self):
+        return cPickle.loads(base64.b64decode(self.message_data))
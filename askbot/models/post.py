@@ -24,7 +24,8 @@ import askbot
 from askbot.utils.slug import slugify
 from askbot import const
 from askbot.models.user import EmailFeedSetting
-from askbot.models.tag import Tag, MarkedTag, tags_match_some_wildcard
+from askbot.models.tag import Tag, MarkedTag
+from askbot.models.tag import wildcard_selection_index
 from askbot.conf import settings as askbot_settings
 from askbot import exceptions
 from askbot.utils import markup
@@ -47,6 +48,13 @@ class PostQuerySet(models.query.QuerySet):
         """returns a query set of questions,
         matching the full text query
         """
+        from askbot.search import inverted_index
+        if inverted_index.is_enabled():
+            return inverted_index.run_full_text_search(
+                        self,
+                        search_query,
+                        thread_id_column = self.model._meta.db_table + '.thread_id'
+                    )
         return self.filter(
             models.Q(thread__title__icontains = search_query)\
             | models.Q(text__icontains = search_query)\
@@ -468,6 +476,8 @@ class Post(models.Model):
         #this save must precede saving the mention activity
         #because generic relation needs primary key of the related object
         super(self.__class__, self).save(**kwargs)
+        if self.is_question() and self.thread_id:
+            self._update_thread_question_denorm()
         if last_revision:
             diff = htmldiff(
                         sanitize_html(last_revision),
@@ -601,10 +611,33 @@ class Post(models.Model):
         if self.is_answer() and self.is_anonymous:
             raise ValueError('Answer cannot be anonymous!')
         super(Post, self).save(*args, **kwargs)
+        if self.is_question() and self.thread_id:
+            self._update_thread_question_denorm()
         if self.is_answer() and 'postgres' in askbot.get_database_engine_name():
             #hit the database to trigger update of full text search vector
             self.thread._question_post().save()
 
+    def _update_thread_question_denorm(self):
+        """copies id and deleted status of the question post
+        to the thread, the database is hit only if the values
+        known to the cached thread object differ
+        """
+        thread = getattr(self, '_thread_cache', None)
+        if thread is not None \
+            and thread.question_post_id == self.id \
+            and thread.question_deleted == self.deleted:
+            return
+        thread_model = self._meta.get_field('thread').rel.to
+        thread_model.objects.filter(
+                            id=self.thread_id
+                        ).update(
+                            question_post=self.id,
+                            question_deleted=self.deleted
+                        )
+        if thread is not None:
+            thread.question_post_id = self.id
+            thread.question_deleted = self.deleted
+
     def _get_slug(self):
         if not self.is_question():
             raise NotImplementedError
@@ -627,15 +660,24 @@ class Post(models.Model):
             import absolutize_urls_func
         from askbot.skins.loaders import get_template
         from django.template import Context
-        template = get_template('email/quoted_post.html')
-        data = {
-            'post': self,
-            'quote_level': quote_level,
-            #'html': absolutize_urls_func(self.html),
-            'is_leaf_post': is_leaf_post,
-            'format': format
-        }
-        return template.render(Context(data))
+        from askbot.mail import render_cache
+
+        def render():
+            template = get_template('email/quoted_post.html')
+            data = {
+                'post': self,
+                'quote_level': quote_level,
+                #'html': absolutize_urls_func(self.html),
+                'is_leaf_post': is_leaf_post,
+                'format': format
+            }
+            return template.render(Context(data))
+
+        stamp = (
+            render_cache.get_post_stamp(self),
+            quote_level, is_leaf_post, format
+        )
+        return render_cache.render_once('post', stamp, render)
 
     def format_for_email_as_parent_thread_summary(self):
         """format for email as summary of parent posts
@@ -672,8 +714,14 @@ class Post(models.Model):
         """
         from askbot.skins.loaders import get_template
         from django.template import Context
-        template = get_template('email/post_as_subthread.html')
-        return template.render(Context({'post': self}))
+        from askbot.mail import render_cache
+
+        def render():
+            template = get_template('email/post_as_subthread.html')
+            return template.render(Context({'post': self}))
+
+        stamp = render_cache.get_subthread_stamp(self)
+        return render_cache.render_once('subthread', stamp, render)
 
     def set_cached_comments(self, comments):
         """caches comments in the lifetime of the object
@@ -756,6 +804,9 @@ class Post(models.Model):
             tag__name__in = tag_names,
             reason = tag_mark_reason
         )
+        subscription_records = subscription_records.filter(
+            tag_filter_strategy = email_tag_filter_strategy
+        )
         subscribers = set(
             user_set_getter(
                 tag_selections__in = tag_selections
@@ -767,36 +818,25 @@ class Post(models.Model):
         )
 
         #part 2 - find users who follow or not ignore tags via wildcard selections
-        #inside there is a potentially time consuming loop
         if askbot_settings.USE_WILDCARD_TAGS:
-            #todo: fix this
-            #this branch will not scale well
-            #because we have to loop through the list of users
-            #in python
             if tag_mark_reason == 'good':
-                empty_wildcard_filter = {'interesting_tags__exact': ''}
-                wildcard_tags_attribute = 'interesting_tags'
                 update_subscribers = lambda the_set, item: the_set.add(item)
             elif tag_mark_reason == 'bad':
-                empty_wildcard_filter = {'ignored_tags__exact': ''}
-                wildcard_tags_attribute = 'ignored_tags'
                 update_subscribers = lambda the_set, item: the_set.discard(item)
 
-            potential_wildcard_subscribers = User.objects.filter(
-                notification_subscriptions__in = subscription_records
-            ).filter(
-                email_tag_filter_strategy = email_tag_filter_strategy
-            ).exclude(
-                **empty_wildcard_filter #need this to limit size of the loop
-            )
-            for potential_subscriber in potential_wildcard_subscribers:
-                wildcard_tags = getattr(
-                    potential_subscriber,
-                    wildcard_tags_attribute
-                ).split(' ')
-
-                if tags_match_some_wildcard(tag_names, wildcard_tags):
-                    update_subscribers(subscribers, potential_subscriber)
+            matching_user_ids = wildcard_selection_index.get_matching_user_ids(
+                                                    tag_names, tag_mark_reason
+                                                )
+            if matching_user_ids:
+                wildcard_subscribers = User.objects.filter(
+                    id__in = matching_user_ids
+                ).filter(
+                    notification_subscriptions__in = subscription_records
+                ).filter(
+                    email_tag_filter_strategy = email_tag_filter_strategy
+                )
+                for wildcard_subscriber in wildcard_subscribers:
+                    update_subscribers(subscribers, wildcard_subscriber)
 
         return subscribers
 
@@ -818,8 +858,13 @@ class Post(models.Model):
         )
 
         #segment of users who have tag filter turned off
+        global_subscriber_ids = EmailFeedSetting.objects.get_subscriber_ids(
+            feed_type = 'q_all',
+            frequency = 'i',
+            tag_filter_strategy = const.INCLUDE_ALL
+        )
         global_subscribers = User.objects.filter(
-            email_tag_filter_strategy = const.INCLUDE_ALL
+            id__in = global_subscriber_ids
         )
         subscriber_set.update(global_subscribers)
 
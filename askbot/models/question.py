@@ -1,6 +1,7 @@
 import datetime
 import operator
 import re
+import time
 
 from django.conf import settings
 from django.db import models
@@ -8,6 +9,7 @@ from django.contrib.auth.models import User
 from django.core import cache  # import cache, not from cache import cache, to be able to monkey-patch cache.cache in test cases
 from django.core.urlresolvers import reverse
 from django.utils.hashcompat import md5_constructor
+from django.utils.http import urlquote as django_urlquote
 from django.utils.translation import ugettext as _
 from django.utils.translation import ungettext
 
@@ -18,12 +20,97 @@ from askbot.models.base import DraftContent
 from askbot.models.post import Post, PostRevision
 from askbot.models import signals
 from askbot import const
-from askbot.utils.lists import LazyList
+from askbot.utils.lists import LazyList, batch_size
+from askbot.utils.cache import is_shared_with_celery_workers, PendingIds
 from askbot.utils import mysql
 from askbot.utils.slug import slugify
 from askbot.skins.loaders import get_template #jinja2 template loading enviroment
 from askbot.search.state_manager import DummySearchState
 
+QUESTION_ORDER_BY_MAP = {
+    'age-desc': '-added_at',
+    'age-asc': 'added_at',
+    'activity-desc': '-last_activity_at',
+    'activity-asc': 'last_activity_at',
+    'answers-desc': '-answer_count',
+    'answers-asc': 'answer_count',
+    'votes-desc': '-score',
+    'votes-asc': 'score',
+
+    'relevance-desc': '-relevance', # 'relevance' quasi-column is added by get_for_query()
+}
+#sort methods that can be paginated with the keyset paginator:
+#those ordered by a real column of the thread table
+KEYSET_SORT_METHODS = tuple(
+    sort for sort in QUESTION_ORDER_BY_MAP if sort != 'relevance-desc'
+)
+#fields of the threads shown in the question list,
+#added_at and score are needed by the keyset paginator,
+#question_post - to build urls without loading the posts
+QUESTION_LIST_FIELDS = (
+    'id', 'title', 'view_count', 'answer_count', 'last_activity_at',
+    'last_activity_by', 'closed', 'tagnames', 'accepted_answer',
+    'added_at', 'score', 'question_post'
+)
+
+# use `<<<` and `>>>` because they cannot be confused with user input
+# - if user accidentialy types <<<tag-name>>> into question title or body,
+# then in html it'll become escaped like this: &lt;&lt;&lt;tag-name&gt;&gt;&gt;
+SUMMARY_TAG_MARKER_RE = re.compile(
+    r'<<<(%s)>>>' % const.TAG_REGEX_BARE,
+    re.UNICODE
+)
+
+def copy_post_fields(source, target):
+    """copies values of the database fields of the post
+    to another post object and returns the target,
+    related objects cached on the source are not copied,
+    to keep the cached post data small"""
+    for field in source._meta.fields:
+        setattr(target, field.attname, getattr(source, field.attname))
+    return target
+
+class CachedSearchResult(object):
+    """threads found by the search, in the order of the thread
+    ids taken from the search result cache, only the threads
+    of the requested slice are loaded, so the result can
+    be paged through with the django paginator
+
+    ``get_query_set`` returns the query set of the search, it
+    is used for the slices beyond the cached ids, ``None``
+    if the ids of all found threads are cached
+    """
+    def __init__(self, thread_ids, count, get_query_set = None):
+        self.thread_ids = thread_ids
+        self.total_count = count
+        self.get_query_set = get_query_set
+
+    def count(self):
+        return self.total_count
+
+    def __len__(self):
+        return self.total_count
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            if key < 0:
+                key += self.total_count
+            threads = self[key:key + 1]
+            if len(threads) == 0:
+                raise IndexError('thread index out of range')
+            return threads[0]
+
+        start, stop, step = key.indices(self.total_count)
+        if stop > len(self.thread_ids) and self.get_query_set:
+            return list(self.get_query_set()[start:stop])
+
+        thread_ids = self.thread_ids[start:stop]
+        threads = Thread.objects.only(*QUESTION_LIST_FIELDS).in_bulk(thread_ids)
+        #threads deleted after the search are skipped
+        return [
+            threads[thread_id] for thread_id in thread_ids
+            if thread_id in threads
+        ]
 
 class ThreadManager(models.Manager):
     def get_tag_summary_from_threads(self, threads):
@@ -108,6 +195,7 @@ class ThreadManager(models.Manager):
             question.last_edited_at = added_at
             question.wikified_at = added_at
 
+        #saving the question fills in thread.question_post
         question.parse_and_save(author = author)
 
         question.add_revision(
@@ -144,13 +232,10 @@ class ThreadManager(models.Manager):
             )
         elif 'postgresql_psycopg2' in askbot.get_database_engine_name():
             from askbot.search import postgresql
-            return postgresql.run_full_text_search(qs, search_query)
+            return postgresql.run_thread_search(qs, search_query)
         else:
-            return qs.filter(
-                models.Q(title__icontains=search_query) |
-                models.Q(tagnames__icontains=search_query) |
-                models.Q(posts__deleted=False, posts__text__icontains = search_query)
-            )
+            from askbot.search import inverted_index
+            return inverted_index.run_full_text_search(qs, search_query)
 
 
     def run_advanced_search(self, request_user, search_state):  # TODO: !! review, fix, and write tests for this
@@ -163,10 +248,11 @@ class ThreadManager(models.Manager):
         from askbot.conf import settings as askbot_settings # Avoid circular import
 
         # TODO: add a possibility to see deleted questions
-        qs = self.filter(
-                posts__post_type='question', 
-                posts__deleted=False,
-            ) # (***) brings `askbot_post` into the SQL query, see the ordering section below
+        #question status is denormalized on the thread, so the post
+        #table is joined only by the filters that really need it,
+        #and only then the results have to be made distinct
+        qs = self.filter(question_deleted=False)
+        needs_distinct = False
 
         if askbot_settings.ENABLE_CONTENT_MODERATION:
             qs = qs.filter(approved = True)
@@ -175,12 +261,14 @@ class ThreadManager(models.Manager):
 
         if search_state.stripped_query:
             qs = self.get_for_query(search_query=search_state.stripped_query, qs=qs)
+            needs_distinct = True
         if search_state.query_title:
             qs = qs.filter(title__icontains = search_state.query_title)
         if search_state.query_users:
             query_users = User.objects.filter(username__in=search_state.query_users)
             if query_users:
                 qs = qs.filter(posts__post_type='question', posts__author__in=query_users) # TODO: unify with search_state.author ?
+                needs_distinct = True
 
         tags = search_state.unified_tags()
         if len(tags) > 0:
@@ -226,6 +314,7 @@ class ThreadManager(models.Manager):
                 followed_users = request_user.get_followed_users()
                 favorite_filter |= models.Q(posts__post_type__in=('question', 'answer'), posts__author__in=followed_users)
             qs = qs.filter(favorite_filter)
+            needs_distinct = True
 
         #user contributed questions & answers
         if search_state.author:
@@ -236,63 +325,20 @@ class ThreadManager(models.Manager):
                 meta_data['author_name'] = None
             else:
                 qs = qs.filter(posts__post_type__in=('question', 'answer'), posts__author=u, posts__deleted=False)
+                needs_distinct = True
                 meta_data['author_name'] = u.username
 
         #get users tag filters
-        if request_user and request_user.is_authenticated():
-            #mark questions tagged with interesting tags
-            #a kind of fancy annotation, would be nice to avoid it
-            interesting_tags = Tag.objects.filter(
-                user_selections__user = request_user,
-                user_selections__reason = 'good'
-            )
-            ignored_tags = Tag.objects.filter(
-                user_selections__user = request_user,
-                user_selections__reason = 'bad'
-            )
-            if askbot_settings.SUBSCRIBED_TAG_SELECTOR_ENABLED:
-                meta_data['subscribed_tag_names'] = Tag.objects.filter(
-                    user_selections__user = request_user,
-                    user_selections__reason = 'subscribed'
-                ).values_list('name', flat = True)
-
-            meta_data['interesting_tag_names'] = [tag.name for tag in interesting_tags]
-            meta_data['ignored_tag_names'] = [tag.name for tag in ignored_tags]
-
-            if request_user.display_tag_filter_strategy == const.INCLUDE_INTERESTING and (interesting_tags or request_user.has_interesting_wildcard_tags()):
-                #filter by interesting tags only
-                interesting_tag_filter = models.Q(tags__in=interesting_tags)
-                if request_user.has_interesting_wildcard_tags():
-                    interesting_wildcards = request_user.interesting_tags.split()
-                    extra_interesting_tags = Tag.objects.get_by_wildcards(interesting_wildcards)
-                    interesting_tag_filter |= models.Q(tags__in=extra_interesting_tags)
-                qs = qs.filter(interesting_tag_filter)
-
-            # get the list of interesting and ignored tags (interesting_tag_names, ignored_tag_names) = (None, None)
-            if request_user.display_tag_filter_strategy == const.EXCLUDE_IGNORED and (ignored_tags or request_user.has_ignored_wildcard_tags()):
-                #exclude ignored tags if the user wants to
-                qs = qs.exclude(tags__in=ignored_tags)
-                if request_user.has_ignored_wildcard_tags():
-                    ignored_wildcards = request_user.ignored_tags.split()
-                    extra_ignored_tags = Tag.objects.get_by_wildcards(ignored_wildcards)
-                    qs = qs.exclude(tags__in = extra_ignored_tags)
-
-            if askbot_settings.USE_WILDCARD_TAGS:
-                meta_data['interesting_tag_names'].extend(request_user.interesting_tags.split())
-                meta_data['ignored_tag_names'].extend(request_user.ignored_tags.split())
-
-        QUESTION_ORDER_BY_MAP = {
-            'age-desc': '-added_at',
-            'age-asc': 'added_at',
-            'activity-desc': '-last_activity_at',
-            'activity-asc': 'last_activity_at',
-            'answers-desc': '-answer_count',
-            'answers-asc': 'answer_count',
-            'votes-desc': '-score',
-            'votes-asc': 'score',
-
-            'relevance-desc': '-relevance', # special Postgresql-specific ordering, 'relevance' quaso-column is added by get_for_query()
-        }
+        interesting_tag_ids, ignored_tag_ids = \
+                self.get_user_tag_filters(request_user, meta_data)
+        if interesting_tag_ids is not None:
+            #filter by interesting tags only
+            qs = qs.filter(tags__id__in=interesting_tag_ids)
+            needs_distinct = True
+        if ignored_tag_ids is not None:
+            #exclude ignored tags if the user wants to
+            qs = qs.exclude(tags__id__in=ignored_tag_ids)
+
         orderby = QUESTION_ORDER_BY_MAP[search_state.sort]
         qs = qs.extra(order_by=[orderby])
 
@@ -303,11 +349,156 @@ class ThreadManager(models.Manager):
         # qs = qs.extra(select={'ordering_key': orderby.lstrip('-')}, order_by=['-ordering_key' if orderby.startswith('-') else 'ordering_key'])
         # qs = qs.distinct()
 
-        qs = qs.only('id', 'title', 'view_count', 'answer_count', 'last_activity_at', 'last_activity_by', 'closed', 'tagnames', 'accepted_answer')
+        qs = qs.only(*QUESTION_LIST_FIELDS)
 
         #print qs.query
 
-        return qs.distinct(), meta_data
+        if needs_distinct:
+            qs = qs.distinct()
+
+        return qs, meta_data
+
+    def get_user_tag_filters(self, request_user, meta_data):
+        """returns ids of the interesting tags, if the user
+        wants to see only the threads with these tags, and ids of
+        the ignored tags, if the user wants to hide the threads
+        with them, ``None`` in place of the unused filter.
+        Names of the selected tags are added to the ``meta_data``
+        """
+        from askbot.conf import settings as askbot_settings # Avoid circular import
+        if not (request_user and request_user.is_authenticated()):
+            return None, None
+
+        #tag selections are precomputed per user, with
+        #wildcards already expanded to the matching tag ids
+        tag_selections = request_user.get_resolved_tag_selections()
+        interesting_selection = tag_selections['good']
+        ignored_selection = tag_selections['bad']
+        if askbot_settings.SUBSCRIBED_TAG_SELECTOR_ENABLED:
+            meta_data['subscribed_tag_names'] = list(
+                tag_selections['subscribed']['tag_names']
+            )
+
+        meta_data['interesting_tag_names'] = list(interesting_selection['tag_names'])
+        meta_data['ignored_tag_names'] = list(ignored_selection['tag_names'])
+
+        interesting_tag_ids = None
+        if request_user.display_tag_filter_strategy == const.INCLUDE_INTERESTING and (interesting_selection['tag_names'] or request_user.has_interesting_wildcard_tags()):
+            interesting_tag_ids = interesting_selection['tag_ids']
+
+        # get the list of interesting and ignored tags (interesting_tag_names, ignored_tag_names) = (None, None)
+        ignored_tag_ids = None
+        if request_user.display_tag_filter_strategy == const.EXCLUDE_IGNORED and (ignored_selection['tag_names'] or request_user.has_ignored_wildcard_tags()):
+            ignored_tag_ids = ignored_selection['tag_ids']
+
+        if askbot_settings.USE_WILDCARD_TAGS:
+            meta_data['interesting_tag_names'].extend(request_user.interesting_tags.split())
+            meta_data['ignored_tag_names'].extend(request_user.ignored_tags.split())
+
+        return interesting_tag_ids, ignored_tag_ids
+
+    def run_cached_search(self, request_user, search_state, page_size):
+        """same as :meth:`run_advanced_search`, but the found
+        threads are returned as :class:`CachedSearchResult` and
+        their order on the first pages is taken from the search
+        result cache, see :mod:`askbot.search.result_cache`
+
+        the results are cached without the tag filters of the user,
+        the filters are applied to the cached threads in memory.
+        Search of the favorite threads is not cached.
+        """
+        from askbot.conf import settings as askbot_settings # Avoid circular import
+        from askbot.search import result_cache
+        max_pages = askbot_settings.SEARCH_RESULT_CACHE_PAGES
+        if max_pages <= 0 or search_state.scope == 'favorite':
+            return self.run_advanced_search(request_user, search_state)
+
+        user_meta_data = {}
+        interesting_tag_ids, ignored_tag_ids = \
+                self.get_user_tag_filters(request_user, user_meta_data)
+        has_tag_filters = interesting_tag_ids is not None \
+                            or ignored_tag_ids is not None
+
+        cache_key = result_cache.get_cache_key(search_state)
+        results = result_cache.get_results(cache_key)
+        if results is None:
+            result_cache.count_miss()
+            results = self.get_search_results(
+                                        search_state,
+                                        max_pages * page_size
+                                    )
+            result_cache.set_results(cache_key, results)
+        elif has_tag_filters and not results['complete']:
+            result_cache.count_miss()
+        else:
+            result_cache.count_hit()
+
+        if has_tag_filters and not results['complete']:
+            #number of the threads passing the filters is not known
+            return self.run_advanced_search(request_user, search_state)
+
+        meta_data = dict(results['meta_data'])
+        meta_data.update(user_meta_data)
+
+        if has_tag_filters:
+            thread_ids = list()
+            for thread_id, tag_ids in zip(
+                results['thread_ids'], results['tag_ids']
+            ):
+                tag_ids = set(tag_ids)
+                if interesting_tag_ids is not None \
+                    and tag_ids.isdisjoint(interesting_tag_ids):
+                    continue
+                if ignored_tag_ids is not None \
+                    and not tag_ids.isdisjoint(ignored_tag_ids):
+                    continue
+                thread_ids.append(thread_id)
+            return CachedSearchResult(thread_ids, len(thread_ids)), meta_data
+
+        get_query_set = None
+        if not results['complete']:
+            get_query_set = lambda: self.run_advanced_search(
+                                                None, search_state
+                                            )[0]
+        result = CachedSearchResult(
+                            results['thread_ids'],
+                            results['count'],
+                            get_query_set
+                        )
+        return result, meta_data
+
+    def get_search_results(self, search_state, limit):
+        """runs the search without the tag filters of a user and
+        returns dictionary with the search results to be cached:
+        ids of the first ``limit`` threads, ids of their tags,
+        total number of the found threads, whether all of them
+        are in the list and the meta data of the search
+        """
+        qs, meta_data = self.run_advanced_search(None, search_state)
+        thread_ids = [thread.id for thread in qs[:limit + 1]]
+        complete = len(thread_ids) <= limit
+        if complete:
+            count = len(thread_ids)
+        else:
+            thread_ids = thread_ids[:limit]
+            count = qs.count()
+
+        tag_ids = dict((thread_id, list()) for thread_id in thread_ids)
+        thread_tags = self.model.tags.through.objects
+        for id_batch in batch_size(thread_ids, 500):
+            tag_links = thread_tags.filter(
+                                thread__id__in = id_batch
+                            ).values_list('thread', 'tag')
+            for thread_id, tag_id in tag_links:
+                tag_ids[thread_id].append(tag_id)
+
+        return {
+            'thread_ids': thread_ids,
+            'tag_ids': [tag_ids[thread_id] for thread_id in thread_ids],
+            'count': count,
+            'complete': complete,
+            'meta_data': meta_data
+        }
 
     def precache_view_data_hack(self, threads):
         # TODO: Re-enable this when we have a good test cases to verify that it works properly.
@@ -317,7 +508,13 @@ class ThreadManager(models.Manager):
         # Precache data only for non-cached threads - only those will be rendered
         #threads = [thread for thread in threads if not thread.summary_html_cached()]
 
-        page_questions = Post.objects.filter(post_type='question', thread__in=[obj.id for obj in threads])\
+        question_ids = [obj.question_post_id for obj in threads]
+        if None in question_ids:
+            #denormalized question ids are not filled in yet
+            page_questions = Post.objects.filter(post_type='question', thread__in=[obj.id for obj in threads])
+        else:
+            page_questions = Post.objects.filter(id__in=question_ids)
+        page_questions = page_questions\
                             .only('id', 'thread', 'score', 'is_anonymous', 'summary', 'post_type', 'deleted') # pick only the used fields
         page_question_map = {}
         for pq in page_questions:
@@ -334,6 +531,98 @@ class ThreadManager(models.Manager):
             thread._last_activity_by_cache = user_map[thread.last_activity_by_id]
 
 
+    def precache_summary_html(self, threads):
+        """fetches summary html of all ``threads`` with one
+        cache round trip, renders summaries missing in the cache
+        as a batch and stores them with one more round trip,
+        the html is kept on the thread objects, so that
+        :meth:`Thread.get_summary_html` does not query the cache again
+        """
+        thread_map = dict(
+            (self.model.SUMMARY_CACHE_KEY_TPL % thread.id, thread)
+            for thread in threads
+        )
+        cached_html = cache.cache.get_many(thread_map.keys())
+
+        missing_threads = list()
+        for key, thread in thread_map.items():
+            html = cached_html.get(key)
+            if html:
+                thread._summary_html_cache = html
+            else:
+                missing_threads.append(thread)
+
+        if len(missing_threads) == 0:
+            return
+
+        #question posts and last activity users for all
+        #the missing summaries are fetched with one query each
+        self.precache_view_data_hack(threads=missing_threads)
+        rendered_html = dict()
+        for thread in missing_threads:
+            html = thread.render_summary_html()
+            thread._summary_html_cache = html
+            rendered_html[self.model.SUMMARY_CACHE_KEY_TPL % thread.id] = html
+        #timeout is positional, dummy cache of django 1.3
+        #does not accept it as a keyword argument
+        cache.cache.set_many(rendered_html, const.LONG_TIME)
+
+    def save_pending_view_counts(self, thread_ids = None):
+        """moves view counts accumulated in the cache by
+        :meth:`Thread.increase_view_count` to the database,
+        by default - of all threads viewed since the last save,
+        threads with the same number of new views are
+        updated with one query
+        """
+        pending_views = self.model.PENDING_VIEWS
+        #views counted from now on must schedule a new save
+        pending_views.unschedule()
+        if thread_ids is None:
+            thread_ids = pending_views.pop_all()
+        else:
+            pending_views.clear_marks(thread_ids)
+
+        key_map = dict(
+            (self.model.PENDING_VIEW_COUNT_KEY_TPL % thread_id, thread_id)
+            for thread_id in thread_ids
+        )
+        pending_counts = cache.cache.get_many(key_map.keys())
+
+        ids_by_increment = dict()
+        from askbot.conf import settings as askbot_settings
+        delay = askbot_settings.VIEW_COUNT_UPDATE_DELAY
+        has_new_views = False
+        for key, increment in pending_counts.items():
+            if not increment:
+                continue
+            #decrement instead of deleting the key to keep
+            #the views counted since the value was read
+            if cache.cache.decr(key, increment) > 0:
+                #these views will be saved next time
+                pending_views.add(key_map[key], 2 * delay)
+                has_new_views = True
+            ids_by_increment.setdefault(increment, list()).append(key_map[key])
+
+        updated_ids = list()
+        for increment, ids in ids_by_increment.items():
+            for id_batch in batch_size(ids, 500):
+                self.filter(
+                    id__in=id_batch
+                ).update(
+                    view_count=models.F('view_count') + increment
+                )
+            updated_ids.extend(ids)
+
+        for id_batch in batch_size(updated_ids, 500):
+            for thread in self.filter(id__in=id_batch):
+                thread.schedule_summary_html_update()
+
+        if has_new_views:
+            from askbot import tasks
+            pending_views.schedule(
+                tasks.save_pending_view_counts_celery_task, delay
+            )
+
     #todo: this function is similar to get_response_receivers - profile this function against the other one
     def get_thread_contributors(self, thread_list):
         """Returns query set of Thread contributors"""
@@ -367,7 +656,12 @@ class ThreadManager(models.Manager):
 
 class Thread(models.Model):
     SUMMARY_CACHE_KEY_TPL = 'thread-question-summary-%d'
+    SUMMARY_UPDATE_SCHEDULED_KEY_TPL = 'thread-question-summary-scheduled-%d'
+    PENDING_VIEW_COUNT_KEY_TPL = 'thread-pending-view-count-%d'
+    #ids of the threads with views waiting to be saved
+    PENDING_VIEWS = PendingIds('thread-pending-views')
     ANSWER_LIST_KEY_TPL = 'thread-answer-list-%d'
+    POST_DATA_VERSION_KEY_TPL = 'thread-data-version-%d'
 
     title = models.CharField(max_length=300)
 
@@ -404,6 +698,20 @@ class Thread(models.Model):
 
     score = models.IntegerField(default = 0)
 
+    #denormalized data: question post of the thread and whether it
+    #is deleted, kept in sync by Post.save(), so that listings
+    #do not need to join the post table; when the question post
+    #is removed from the database, the thread stays with the answers
+    #and is hidden, as if the question were deleted
+    question_post = models.ForeignKey(
+                            Post,
+                            null=True,
+                            blank=True,
+                            related_name='+',
+                            on_delete=models.SET_NULL
+                        )
+    question_deleted = models.BooleanField(default=False, db_index=True)
+
     objects = ThreadManager()
     
     class Meta:
@@ -415,13 +723,18 @@ class Thread(models.Model):
         post = getattr(self, '_question_cache', None)
         if post:
             return post
-        self._question_cache = Post.objects.get(post_type='question', thread=self)
+        if self.question_post_id:
+            self._question_cache = Post.objects.get(id=self.question_post_id)
+        else:
+            self._question_cache = Post.objects.get(post_type='question', thread=self)
         return self._question_cache
 
     def get_absolute_url(self):
-        return self._question_post().get_absolute_url(thread = self)
-        #question_id = self._question_post().id
-        #return reverse('question', args = [question_id]) + slugify(self.title)
+        if self.question_post_id is None:
+            return self._question_post().get_absolute_url(thread = self)
+        #same as Post.get_absolute_url(), but without loading the question
+        url = reverse('question', args = [self.question_post_id])
+        return url + django_urlquote(slugify(self.title)) + '/'
 
     def update_favorite_count(self):
         self.favourite_count = FavoriteQuestion.objects.filter(thread=self).count()
@@ -432,12 +745,54 @@ class Thread(models.Model):
         self.save()
 
     def increase_view_count(self, increment=1):
-        qset = Thread.objects.filter(id=self.id)
-        qset.update(view_count=models.F('view_count') + increment)
-        self.view_count = qset.values('view_count')[0]['view_count'] # get the new view_count back because other pieces of code relies on such behaviour
-        ####################################################################
-        self.update_summary_html() # regenerate question/thread summary html
-        ####################################################################
+        """adds views to the counter in the cache, the counters
+        of all viewed threads are saved to the database by one celery
+        task after ``VIEW_COUNT_UPDATE_DELAY`` seconds, together with
+        all views counted in the meantime
+
+        the cache must be shared with the celery workers, otherwise
+        the view count is updated right away"""
+        from askbot.conf import settings as askbot_settings
+        delay = askbot_settings.VIEW_COUNT_UPDATE_DELAY
+        if delay <= 0 or not is_shared_with_celery_workers():
+            qset = Thread.objects.filter(id=self.id)
+            qset.update(view_count=models.F('view_count') + increment)
+            self.view_count = qset.values('view_count')[0]['view_count'] # get the new view_count back because other pieces of code relies on such behaviour
+            self._pending_view_count = 0
+            ####################################################################
+            self.schedule_summary_html_update() # regenerate question/thread summary html
+            ####################################################################
+            return
+
+        pending_key = self.PENDING_VIEW_COUNT_KEY_TPL % self.id
+        try:
+            pending_count = cache.cache.incr(pending_key, increment)
+        except ValueError:
+            #no pending views yet
+            if cache.cache.add(pending_key, increment, const.LONG_TIME):
+                pending_count = increment
+            else:
+                pending_count = cache.cache.incr(pending_key, increment)
+        self._pending_view_count = pending_count
+
+        from askbot import tasks
+        Thread.PENDING_VIEWS.add(self.id, 2 * delay)
+        Thread.PENDING_VIEWS.schedule(
+            tasks.save_pending_view_counts_celery_task, delay
+        )
+
+    def get_pending_view_count(self):
+        """returns number of views not yet saved to the database"""
+        if not hasattr(self, '_pending_view_count'):
+            pending_key = self.PENDING_VIEW_COUNT_KEY_TPL % self.id
+            self._pending_view_count = cache.cache.get(pending_key) or 0
+        return self._pending_view_count
+
+    def get_view_count(self):
+        """view count including the views not yet saved,
+        use this instead of the ``view_count`` field for display
+        """
+        return self.view_count + self.get_pending_view_count()
 
     def set_closed_status(self, closed, closed_by, closed_at, close_reason):
         self.closed = closed
@@ -459,7 +814,7 @@ class Thread(models.Model):
         self.last_activity_by = last_activity_by
         self.save()
         ####################################################################
-        self.update_summary_html() # regenerate question/thread summary html
+        self.schedule_summary_html_update() # regenerate question/thread summary html
         ####################################################################
 
     def get_tag_names(self):
@@ -485,18 +840,26 @@ class Thread(models.Model):
 
     def format_for_email(self):
         """experimental function: output entire thread for email"""
+        from askbot.mail import render_cache
         question, answers, junk = self.get_cached_post_data()
-        output = question.format_for_email_as_subthread()
-        if answers:
-            answer_heading = ungettext(
-                                    '%(count)d answer:',
-                                    '%(count)d answers:',
-                                    len(answers)
-                                ) % {'count': len(answers)}
-            output += '<p>%s</p>' % answer_heading
-            for answer in answers:
-                output += answer.format_for_email_as_subthread()
-        return output
+
+        def render():
+            output = question.format_for_email_as_subthread()
+            if answers:
+                answer_heading = ungettext(
+                                        '%(count)d answer:',
+                                        '%(count)d answers:',
+                                        len(answers)
+                                    ) % {'count': len(answers)}
+                output += '<p>%s</p>' % answer_heading
+                for answer in answers:
+                    output += answer.format_for_email_as_subthread()
+            return output
+
+        stamp = (self.id,) + tuple(
+            map(render_cache.get_subthread_stamp, [question] + answers)
+        )
+        return render_cache.render_once('thread', stamp, render)
 
     def get_answers_by_user(self, user):
         """regardless - deleted or not"""
@@ -530,30 +893,162 @@ class Thread(models.Model):
     def invalidate_cached_thread_content_fragment(self):
         cache.cache.delete(self.SUMMARY_CACHE_KEY_TPL % self.id)
 
-    def get_post_data_cache_key(self, sort_method = None):
-        return 'thread-data-%s-%s' % (self.id, sort_method)
+    def get_post_data_version(self):
+        """returns version stamp of the cached post data,
+        the stamp is a part of the cache keys and changes
+        on every update of the post data"""
+        key = self.POST_DATA_VERSION_KEY_TPL % self.id
+        version = cache.cache.get(key)
+        if version is None:
+            #start from the current time, so that the post data
+            #cached before the stamp was evicted is not reused
+            version = int(time.time() * 1000000)
+            if not cache.cache.add(key, version, const.LONG_TIME):
+                version = cache.cache.get(key, version)
+        return version
+
+    def increment_post_data_version(self):
+        """changes the version stamp and returns the new value,
+        or ``None`` if there was no stamp"""
+        try:
+            return cache.cache.incr(self.POST_DATA_VERSION_KEY_TPL % self.id)
+        except ValueError:
+            return None
+
+    def get_post_data_cache_key(self, sort_method = None, version = None):
+        if version is None:
+            version = self.get_post_data_version()
+        return 'thread-data-%s-%s-%s' % (self.id, sort_method, version)
 
     def invalidate_cached_post_data(self):
-        """needs to be called when anything notable 
-        changes in the post data - on votes, adding,
-        deleting, editing content"""
-        #we can call delete_many() here if using Django > 1.2
-        for sort_method in const.ANSWER_SORT_METHODS:
-            cache.cache.delete(self.get_post_data_cache_key(sort_method))
+        """needs to be called on the structural changes of
+        the post data - when posts are deleted, restored,
+        answers accepted, etc, the data is rebuilt on the next read.
+        New posts, edits and votes are applied to the cached data
+        with ``update_cached_post_data()``"""
+        self.increment_post_data_version()
+
+    def update_cached_post_data(self, post):
+        """applies new or changed question, answer or comment
+        to the cached post data of all sort methods
+
+        the data is patched only if nobody else changed it
+        in the meantime, otherwise it will be rebuilt on
+        the next read
+        """
+        version = self.get_post_data_version()
+        keys = dict([
+            (self.get_post_data_cache_key(sort_method, version), sort_method)
+            for sort_method in const.ANSWER_SORT_METHODS
+        ])
+        cached_data = cache.cache.get_many(keys.keys())
+        new_version = self.increment_post_data_version()
+        if new_version != version + 1:
+            return
+
+        updated_data = dict()
+        for key, post_data in cached_data.items():
+            post_data = self.patch_post_data(post_data, post, keys[key])
+            if post_data is None:
+                return
+            new_key = self.get_post_data_cache_key(keys[key], new_version)
+            updated_data[new_key] = post_data
+        if updated_data:
+            cache.cache.set_many(updated_data, const.LONG_TIME)
+
+    def patch_post_data(self, post_data, post, sort_method):
+        """returns post data, as calculated by ``get_post_data()``,
+        with the post added or updated, or ``None`` if the change
+        requires the data to be rebuilt
+        """
+        question_post, answers, post_to_author = post_data
+        is_visible = (post.deleted == False and post.is_approved())
+
+        if post.post_type == 'question':
+            if question_post is None or question_post.id != post.id \
+                or question_post.deleted != post.deleted:
+                return None
+            copy_post_fields(post, question_post)
+            return post_data
+
+        if post.post_type == 'answer':
+            for answer in answers:
+                if answer.id == post.id:
+                    if is_visible == False:
+                        return None
+                    copy_post_fields(post, answer)
+                    break
+            else:
+                if is_visible == False:
+                    return post_data
+                answer = copy_post_fields(post, Post())
+                answer.set_cached_comments(list())
+                answers.append(answer)
+                post_to_author[answer.id] = answer.author_id
+
+            if sort_method == 'votes':
+                sort_key = operator.attrgetter('score')
+            else:
+                sort_key = operator.attrgetter('added_at')
+            answers.sort(
+                key = sort_key,
+                reverse = (sort_method in ('latest', 'votes'))
+            )
+            if self.accepted_answer_id:
+                for answer in answers:
+                    if answer.id == self.accepted_answer_id:
+                        answers.remove(answer)
+                        answers.insert(0, answer)
+                        break
+            return post_data
+
+        if post.post_type == 'comment':
+            parents = [question_post] + answers
+            for parent in parents:
+                if parent is not None and parent.id == post.parent_id:
+                    break
+            else:
+                return post_data#comment to a hidden post
+
+            comments = parent.get_cached_comments()
+            for comment in comments:
+                if comment.id == post.id:
+                    if is_visible == False:
+                        return None
+                    copy_post_fields(post, comment)
+                    break
+            else:
+                if is_visible == False:
+                    return post_data
+                comments.append(copy_post_fields(post, Post()))
+                comments.sort(key = operator.attrgetter('added_at'))
+                post_to_author[post.id] = post.author_id
+            return post_data
+
+        return None
 
     def invalidate_cached_data(self):
         self.invalidate_cached_post_data()
         #self.invalidate_cached_thread_content_fragment()
-        self.update_summary_html()
+        self.schedule_summary_html_update()
+
+    def update_cached_data(self, post):
+        """same as ``invalidate_cached_data()``, but the post
+        data is updated with the new or changed post"""
+        self.update_cached_post_data(post)
+        self.schedule_summary_html_update()
 
     def get_cached_post_data(self, sort_method = 'votes'):
         """returns cached post data, as calculated by
         the method get_post_data()"""
+        #the key must be taken before the data is read from
+        #the database, then data is not stored if it changes
+        #in the meantime
         key = self.get_post_data_cache_key(sort_method)
         post_data = cache.cache.get(key)
         if not post_data:
             post_data = self.get_post_data(sort_method)
-            cache.cache.set(key, post_data, const.LONG_TIME)
+            cache.cache.add(key, post_data, const.LONG_TIME)
         return post_data
 
     def get_post_data(self, sort_method = 'votes'):
@@ -641,16 +1136,13 @@ class Thread(models.Model):
         """
 
         def get_data():
-            # todo: code in this function would be simpler if
-            # we had question post id denormalized on the thread
             tags_list = self.get_tag_names()
             similar_threads = Thread.objects.filter(
                                         tags__name__in=tags_list
                                     ).exclude(
                                         id = self.id
                                     ).exclude(
-                                        posts__post_type='question',
-                                        posts__deleted = True
+                                        question_deleted = True
                                     ).distinct()[:100]
             similar_threads = list(similar_threads)
 
@@ -661,10 +1153,14 @@ class Thread(models.Model):
             similar_threads = similar_threads[:10]
 
             # Denormalize questions to speed up template rendering
-            # todo: just denormalize question_post_id on the thread!
             thread_map = dict([(thread.id, thread) for thread in similar_threads])
+            question_ids = [thread.question_post_id for thread in similar_threads]
             questions = Post.objects.get_questions()
-            questions = questions.select_related('thread').filter(thread__in=similar_threads)
+            if None in question_ids:
+                questions = questions.filter(thread__in=similar_threads)
+            else:
+                questions = questions.filter(id__in=question_ids)
+            questions = questions.select_related('thread')
             for q in questions:
                 thread_map[q.thread_id].question_denorm = q
 
@@ -791,7 +1287,7 @@ class Thread(models.Model):
             modified_tags.extend(added_tags)
 
         ####################################################################
-        self.update_summary_html() # regenerate question/thread summary html
+        self.schedule_summary_html_update() # regenerate question/thread summary html
         ####################################################################
 
         #if there are any modified tags, update their use counts
@@ -860,39 +1356,36 @@ class Thread(models.Model):
         return last_updated_at, last_updated_by
 
     def get_summary_html(self, search_state):
-        html = self.get_cached_summary_html()
+        #html may be prefetched by ThreadManager.precache_summary_html()
+        html = getattr(self, '_summary_html_cache', None)
+        if not html:
+            html = self.get_cached_summary_html()
         if not html:
             html = self.update_summary_html()
 
-        # use `<<<` and `>>>` because they cannot be confused with user input
-        # - if user accidentialy types <<<tag-name>>> into question title or body,
-        # then in html it'll become escaped like this: &lt;&lt;&lt;tag-name&gt;&gt;&gt;
-        regex = re.compile(
-            r'<<<(%s)>>>' % const.TAG_REGEX_BARE,
-            re.UNICODE
+        #tag urls are memoized on the search state, which
+        #is shared by all threads on the page
+        return SUMMARY_TAG_MARKER_RE.sub(
+            lambda match: search_state.add_tag_url(match.group(1)),
+            html
         )
 
-        while True:
-            match = regex.search(html)
-            if not match:
-                break
-            seq = match.group(0)  # e.g "<<<my-tag>>>"
-            tag = match.group(1)  # e.g "my-tag"
-            full_url = search_state.add_tag(tag).full_url()
-            html = html.replace(seq, full_url)
-
-        return html
-
     def get_cached_summary_html(self):
         return cache.cache.get(self.SUMMARY_CACHE_KEY_TPL % self.id)
 
-    def update_summary_html(self):
+    def render_summary_html(self):
+        """renders summary with tag url placeholders,
+        uses the question post cached on the thread, if any"""
         context = {
             'thread': self,
-            'question': self._question_post(refresh=True),  # fetch new question post to make sure we're up-to-date
+            'question': self._question_post(),
             'search_state': DummySearchState(),
         }
-        html = get_template('widgets/question_summary.html').render(context)
+        return get_template('widgets/question_summary.html').render(context)
+
+    def update_summary_html(self):
+        self._question_post(refresh=True)  # fetch new question post to make sure we're up-to-date
+        html = self.render_summary_html()
         # INFO: Timeout is set to 30 days:
         # * timeout=0/None is not a reliable cross-backend way to set infinite timeout
         # * We probably don't need to pollute the cache with threads older than 30 days
@@ -905,6 +1398,26 @@ class Thread(models.Model):
         )
         return html
 
+    def schedule_summary_html_update(self):
+        """marks summary html as outdated, the summary is re-rendered
+        by a celery task after ``SUMMARY_HTML_UPDATE_DELAY`` seconds;
+        more changes of the thread within that time are picked
+        up by the already scheduled task
+        """
+        from askbot.conf import settings as askbot_settings
+        delay = askbot_settings.SUMMARY_HTML_UPDATE_DELAY
+        if delay <= 0:
+            self.update_summary_html()
+            return
+        #the flag expires by itself, should the task get lost
+        flag_key = self.SUMMARY_UPDATE_SCHEDULED_KEY_TPL % self.id
+        if cache.cache.add(flag_key, True, 2 * delay):
+            from askbot import tasks
+            tasks.update_thread_summary_html_celery_task.apply_async(
+                                                        args=(self.id,),
+                                                        countdown=delay
+                                                    )
+
     def summary_html_cached(self):
         return cache.cache.has_key(self.SUMMARY_CACHE_KEY_TPL % self.id)
 
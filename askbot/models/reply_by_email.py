@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import random
 import string
 import logging
@@ -6,32 +6,66 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils.translation import ugettext as _
 from askbot.models.post import Post
-from askbot.models.base import BaseQuerySetManager
+from askbot.models.base import BaseQuerySetManager, insert_objects
 from askbot.conf import settings as askbot_settings
 from askbot import mail
 
 class ReplyAddressManager(BaseQuerySetManager):
     """A manager for the :class:`ReplyAddress` model"""
 
+    def get_expiry_date(self):
+        """addresses created before this time are expired"""
+        lifetime = askbot_settings.REPLY_BY_EMAIL_ADDRESS_LIFETIME
+        return datetime.now() - timedelta(lifetime)
+
+    def get_valid(self, address, allowed_from_email):
+        """returns the not expired reply address,
+        with the user and the post"""
+        return self.select_related('user', 'post').get(
+            address = address,
+            allowed_from_email = allowed_from_email,
+            added_at__gt = self.get_expiry_date()
+        )
+
     def get_unused(self, address, allowed_from_email):
         return self.get(
             address = address,
             allowed_from_email = allowed_from_email,
-            used_at__isnull = True
+            used_at__isnull = True,
+            added_at__gt = self.get_expiry_date()
         )
-    
+
+    def get_expired(self):
+        return self.filter(added_at__lte = self.get_expiry_date())
+
+    def make_address(self):
+        """returns a random address code, the codes are long
+        enough for the collisions to be practically impossible,
+        then the unique index rejects them"""
+        return ''.join(random.choice(string.letters +
+            string.digits) for i in xrange(random.randint(12, 25))).lower()
+
     def create_new(self, **kwargs):
         """creates a new reply address"""
         kwargs['allowed_from_email'] = kwargs['user'].email
         reply_address = ReplyAddress(**kwargs)
-        while True:
-            reply_address.address = ''.join(random.choice(string.letters +
-                string.digits) for i in xrange(random.randint(12, 25))).lower()
-            if self.filter(address = reply_address.address).count() == 0:
-                break
+        reply_address.address = self.make_address()
         reply_address.save()
         return reply_address
-			
+
+    def create_many(self, kwargs_list):
+        """creates reply addresses with one insert, returns
+        the address objects without the ids"""
+        reply_addresses = list()
+        for kwargs in kwargs_list:
+            kwargs = dict(kwargs)
+            kwargs['allowed_from_email'] = kwargs['user'].email
+            reply_address = ReplyAddress(**kwargs)
+            reply_address.address = self.make_address()
+            reply_addresses.append(reply_address)
+        insert_objects(reply_addresses)
+        return reply_addresses
+
 
 REPLY_ACTION_CHOICES = (
     ('post_answer', _('Post an answer')),
@@ -63,6 +97,7 @@ class ReplyAddress(models.Model):
     user = models.ForeignKey(User)
     allowed_from_email = models.EmailField(max_length = 150)
     used_at = models.DateTimeField(null = True, default = None)
+    added_at = models.DateTimeField(default = datetime.now, db_index = True)
 
     objects = ReplyAddressManager()
 
@@ -123,7 +158,7 @@ class ReplyAddress(models.Model):
                 revision_comment = revision_comment,
                 by_email = True
             )
-        self.post.thread.invalidate_cached_data()
+        post.thread.update_cached_data(post)
 
     def create_reply(self, body_text):
         """creates a reply to the post which was emailed
@@ -169,7 +204,7 @@ class ReplyAddress(models.Model):
                                     body_text,
                                     by_email = True
                                 )
-        result.thread.invalidate_cached_data()
+        result.thread.update_cached_data(result)
         self.response_post = result
         self.used_at = datetime.now()
         self.save()
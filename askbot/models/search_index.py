@@ -0,0 +1,22 @@
+"""postings of the built-in search index, used for the full text
+search on the database engines without one - sqlite and MySQL
+with InnoDB tables, see :mod:`askbot.search.inverted_index`
+"""
+from django.db import models
+
+class SearchPosting(models.Model):
+    """a search term found in the thread, ``weight`` sums
+    the occurrences of the term in the title, tags and
+    the texts of the posts, multiplied by the weights of these fields
+    """
+    #the index on (term, thread) serves the lookups by the terms
+    term = models.CharField(max_length = 64)
+    thread = models.ForeignKey('Thread', related_name = 'search_postings')
+    weight = models.PositiveIntegerField(default = 0)
+
+    class Meta:
+        app_label = 'askbot'
+        unique_together = ('term', 'thread')
+
+    def __unicode__(self):
+        return u'%s in thread %d' % (self.term, self.thread_id)
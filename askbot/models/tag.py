@@ -1,21 +1,255 @@
 import re
+import time
 from django.db import models
 from django.contrib.auth.models import User
+from django.core import cache
 from django.utils.translation import ugettext as _
 from askbot.models.base import BaseQuerySetManager
 from askbot import const
+from askbot.utils.cache import is_shared_with_celery_workers
 
 def tags_match_some_wildcard(tag_names, wildcard_tags):
     """Same as 
     :meth:`~askbot.models.tag.TagQuerySet.tags_match_some_wildcard`
     except it works on tag name strings
     """
+    prefixes = tuple([wildcard_tag[:-1] for wildcard_tag in wildcard_tags])
+    if len(prefixes) == 0:
+        return False
     for tag_name in tag_names:
-        for wildcard_tag in sorted(wildcard_tags):
-            if tag_name.startswith(wildcard_tag[:-1]):
-                return True
+        if tag_name.startswith(prefixes):
+            return True
     return False
 
+def get_email_tag_filter(user, marked_tags):
+    """returns function of a set of tag names of a question,
+    which is true if the question passes the email tag filter
+    of the user - same selection as
+    :meth:`~askbot.models.User.get_tag_filtered_questions`,
+    but done in memory
+
+    ``marked_tags`` - pairs of reason and tag name
+    of the tag selections of the user
+    """
+    strategy = user.email_tag_filter_strategy
+    if strategy == const.EXCLUDE_IGNORED:
+        ignored_tag_names = set([
+            tag_name for reason, tag_name in marked_tags if reason == 'bad'
+        ])
+        wildcards = user.ignored_tags.strip().split()
+        def tag_filter(tag_names):
+            if tag_names & ignored_tag_names:
+                return False
+            return not tags_match_some_wildcard(tag_names, wildcards)
+        return tag_filter
+    elif strategy == const.INCLUDE_INTERESTING:
+        from askbot.conf import settings as askbot_settings
+        if askbot_settings.SUBSCRIBED_TAG_SELECTOR_ENABLED:
+            selected_reason = 'subscribed'
+            wildcards = user.subscribed_tags.strip().split()
+        else:
+            selected_reason = 'good'
+            wildcards = user.interesting_tags.strip().split()
+        selected_tag_names = set([
+            tag_name for reason, tag_name in marked_tags
+            if reason == selected_reason
+        ])
+        def tag_filter(tag_names):
+            if tag_names & selected_tag_names:
+                return True
+            return tags_match_some_wildcard(tag_names, wildcards)
+        return tag_filter
+    else:
+        return lambda tag_names: True
+
+class WildcardTrie(object):
+    """prefix tree of wildcard tags, each wildcard
+    is stored with a set of keys - ids of the users who selected it.
+    Node of the tree is a dictionary of child nodes by
+    character, the set of keys is stored under ``None``
+    """
+    def __init__(self):
+        self.root = dict()
+
+    def add(self, wildcard, key):
+        node = self.root
+        for char in wildcard[:-1]:
+            node = node.setdefault(char, dict())
+        node.setdefault(None, set()).add(key)
+
+    def remove(self, wildcard, key):
+        path = [self.root]
+        prefix = wildcard[:-1]
+        for char in prefix:
+            node = path[-1].get(char)
+            if node is None:
+                return
+            path.append(node)
+        keys = path[-1].get(None)
+        if keys is None:
+            return
+        keys.discard(key)
+        if len(keys) == 0:
+            del path[-1][None]
+        #prune the branches left without keys
+        for depth in xrange(len(prefix), 0, -1):
+            if len(path[depth]) > 0:
+                break
+            del path[depth - 1][prefix[depth - 1]]
+
+    def get_matching_keys(self, tag_names):
+        """returns set of keys of the wildcards matching
+        any of the tag names, time is proportional to
+        the total length of the tag names"""
+        matching_keys = set()
+        for tag_name in tag_names:
+            node = self.root
+            if None in node:
+                matching_keys.update(node[None])
+            for char in tag_name:
+                node = node.get(char)
+                if node is None:
+                    break
+                if None in node:
+                    matching_keys.update(node[None])
+        return matching_keys
+
+WILDCARD_SELECTIONS_VERSION_KEY = 'wildcard-tag-selections-version'
+WILDCARD_SELECTIONS_CHANGE_KEY_TPL = 'wildcard-tag-selections-change-%d'
+#user fields with the wildcard tag selections by the reason of the selection
+WILDCARD_SELECTION_FIELDS = {
+    'good': 'interesting_tags',
+    'bad': 'ignored_tags',
+    'subscribed': 'subscribed_tags'
+}
+
+def record_wildcard_selection_change(user_id):
+    """to be called when user changes wildcard tag selections,
+    processes bring their copy of the wildcard selection index
+    up to date by reloading the users recorded here"""
+    try:
+        version = cache.cache.incr(WILDCARD_SELECTIONS_VERSION_KEY)
+    except ValueError:
+        #no version in the cache, all indexes will be rebuilt
+        return
+    cache.cache.set(
+        WILDCARD_SELECTIONS_CHANGE_KEY_TPL % version,
+        user_id,
+        const.LONG_TIME
+    )
+
+def get_wildcard_matching_user_ids(tag_names, reason):
+    """returns set of ids of users whose wildcards of given
+    reason match any of the tag names, read from the database"""
+    field = WILDCARD_SELECTION_FIELDS[reason]
+    user_data = User.objects.exclude(**{field: ''}).values_list('id', field)
+    return set([
+        user_id for user_id, wildcards in user_data
+        if tags_match_some_wildcard(tag_names, wildcards.split())
+    ])
+
+class WildcardSelectionIndex(object):
+    """wildcard tag selections of all users in prefix tries,
+    one trie per reason of the selection
+
+    there is one index per process, it is built on the first
+    use and afterwards only the users who changed their selections
+    are reloaded, the changes are recorded in the cache by
+    :func:`record_wildcard_selection_change`
+
+    if the cache is not shared between the processes, the index
+    would not see the changes, then the selections are read
+    from the database by :func:`get_wildcard_matching_user_ids`
+    """
+    #after so many changes the index is rebuilt instead
+    MAX_REPLAYED_CHANGES = 1000
+
+    def __init__(self):
+        self.version = None
+        self.tries = None
+        self.user_wildcards = None
+
+    def get_matching_user_ids(self, tag_names, reason):
+        """returns set of ids of users whose wildcards
+        of given reason match any of the tag names"""
+        if not is_shared_with_celery_workers():
+            return get_wildcard_matching_user_ids(tag_names, reason)
+        self.synchronize()
+        return self.tries[reason].get_matching_keys(tag_names)
+
+    def synchronize(self):
+        version = cache.cache.get(WILDCARD_SELECTIONS_VERSION_KEY)
+        if version is None:
+            #use time, so that version does not repeat when cache is cleared
+            version = int(time.time() * 1000)
+            cache.cache.add(WILDCARD_SELECTIONS_VERSION_KEY, version, const.LONG_TIME)
+            self.rebuild(version)
+        elif self.tries is None or version < self.version \
+            or version - self.version > self.MAX_REPLAYED_CHANGES:
+            self.rebuild(version)
+        elif version > self.version:
+            keys = [
+                WILDCARD_SELECTIONS_CHANGE_KEY_TPL % change_no
+                for change_no in xrange(self.version + 1, version + 1)
+            ]
+            changes = cache.cache.get_many(keys)
+            if len(changes) < len(keys):
+                self.rebuild(version)
+            else:
+                self.version = version
+                self.update_users(set(changes.values()))
+
+    def rebuild(self, version):
+        tries = dict()
+        for reason in WILDCARD_SELECTION_FIELDS:
+            tries[reason] = WildcardTrie()
+        self.tries = tries
+        self.user_wildcards = dict()
+        self.version = version
+        self.update_users()
+
+    def update_users(self, user_ids = None):
+        """loads wildcard selections of the given users,
+        or of all users if ``user_ids`` is ``None``"""
+        fields = WILDCARD_SELECTION_FIELDS.items()
+        users = User.objects.all()
+        if user_ids is None:
+            #only users who have some wildcard selections
+            users = users.exclude(
+                        **dict([(field, '') for reason, field in fields])
+                    )
+        else:
+            users = users.filter(id__in = user_ids)
+        field_names = [field for reason, field in fields]
+        user_data = users.values_list('id', *field_names)
+
+        loaded_ids = set()
+        for row in user_data:
+            user_id = row[0]
+            loaded_ids.add(user_id)
+            wildcards = dict()
+            for (reason, field), value in zip(fields, row[1:]):
+                wildcards[reason] = set(value.split())
+            self.set_user_wildcards(user_id, wildcards)
+
+        #deleted users
+        for user_id in set(user_ids or ()) - loaded_ids:
+            self.set_user_wildcards(user_id, dict())
+
+    def set_user_wildcards(self, user_id, wildcards):
+        old_wildcards = self.user_wildcards.pop(user_id, dict())
+        for reason, trie in self.tries.items():
+            old = old_wildcards.get(reason, set())
+            new = wildcards.get(reason, set())
+            for wildcard in old - new:
+                trie.remove(wildcard, user_id)
+            for wildcard in new - old:
+                trie.add(wildcard, user_id)
+        if any(wildcards.values()):
+            self.user_wildcards[user_id] = wildcards
+
+wildcard_selection_index = WildcardSelectionIndex()
+
 def get_mandatory_tags():
     """returns list of mandatory tags,
     or an empty list, if there aren't any"""
@@ -44,13 +278,11 @@ class TagQuerySet(models.query.QuerySet):
 
         :arg:`wildcard_tags` is an iterable of wildcard tag strings
 
-        todo: refactor to use :func:`tags_match_some_wildcard`
         """
-        for tag in self.all():
-            for wildcard_tag in sorted(wildcard_tags):
-                if tag.name.startswith(wildcard_tag[:-1]):
-                    return True
-        return False
+        return tags_match_some_wildcard(
+            self.values_list('name', flat = True),
+            wildcard_tags
+        )
 
     def get_by_wildcards(self, wildcards = None):
         """returns query set of tags that match the wildcard tags
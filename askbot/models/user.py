@@ -2,6 +2,7 @@ import datetime
 import logging
 import re
 from django.db import models
+from django.db import connections, transaction
 from django.db.backends.dummy.base import IntegrityError
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
@@ -136,6 +137,32 @@ class ActivityManager(models.Manager):
         return self.filter(**kwargs)
 
 
+class ActivityAuditStatusManager(models.Manager):
+    def create_many(self, activity_user_pairs, status = None):
+        """creates audit status records for the pairs
+        of activity and user objects with one query,
+        by default with status "new"
+        """
+        if status is None:
+            status = self.model.STATUS_NEW
+        rows = [
+            (activity.id, user.id, status)
+            for activity, user in activity_user_pairs
+        ]
+        if len(rows) == 0:
+            return
+        connection = connections[self.db]
+        quote_name = connection.ops.quote_name
+        sql = 'INSERT INTO %s (%s, %s, %s) VALUES (%%s, %%s, %%s)' % (
+                    quote_name(self.model._meta.db_table),
+                    quote_name('activity_id'),
+                    quote_name('user_id'),
+                    quote_name('status')
+                )
+        connection.cursor().executemany(sql, rows)
+        transaction.commit_unless_managed(using = self.db)
+
+
 class ActivityAuditStatus(models.Model):
     """bridge "through" relation between activity and users"""
     STATUS_NEW = 0
@@ -148,6 +175,8 @@ class ActivityAuditStatus(models.Model):
     activity = models.ForeignKey('Activity')
     status = models.SmallIntegerField(choices=STATUS_CHOICES, default=STATUS_NEW)
 
+    objects = ActivityAuditStatusManager()
+
     class Meta:
         unique_together = ('user', 'activity')
         app_label = 'askbot'
@@ -191,10 +220,9 @@ class Activity(models.Model):
         """have to use a special method, because django does not allow
         auto-adding to M2M with "through" model
         """
-        for recipient in recipients:
-            #todo: may optimize for bulk addition
-            aas = ActivityAuditStatus(user = recipient, activity = self)
-            aas.save()
+        ActivityAuditStatus.objects.create_many(
+            [(self, recipient) for recipient in recipients]
+        )
 
     def get_mentioned_user(self):
         assert(self.activity_type == const.TYPE_ACTIVITY_MENTION)
@@ -244,6 +272,22 @@ class EmailFeedSettingManager(models.Manager):
 
         return subscriber_set
 
+    def get_subscriber_ids(
+                        self,
+                        feed_type = None,
+                        frequency = None,
+                        tag_filter_strategy = None
+                    ):
+        """returns query set of ids of users with the matching
+        subscriptions, the lookup is covered by the index on
+        feed type, frequency and tag filter strategy
+        """
+        return self.filter(
+                        feed_type = feed_type,
+                        frequency = frequency,
+                        tag_filter_strategy = tag_filter_strategy
+                    ).values_list('subscriber_id', flat = True)
+
 class EmailFeedSetting(models.Model):
     #definitions of delays before notification for each type of notification frequency
     DELTA_TABLE = {
@@ -290,6 +334,12 @@ class EmailFeedSetting(models.Model):
                                     choices=const.NOTIFICATION_DELIVERY_SCHEDULE_CHOICES,
                                     default='n',
                                 )
+    #copy of the email tag filter strategy of the subscriber,
+    #kept up to date by the save hooks of this model and the user
+    tag_filter_strategy = models.SmallIntegerField(
+                                    choices=const.TAG_EMAIL_FILTER_STRATEGY_CHOICES,
+                                    default=const.EXCLUDE_IGNORED
+                                )
     added_at = models.DateTimeField(auto_now_add=True)
     reported_at = models.DateTimeField(null=True)
     objects = EmailFeedSettingManager()
@@ -321,6 +371,7 @@ class EmailFeedSetting(models.Model):
                                         ).exclude(pk=self.id)
         if len(similar) > 0:
             raise IntegrityError('email feed setting already exists')
+        self.tag_filter_strategy = subscriber.email_tag_filter_strategy
         super(EmailFeedSetting,self).save(*args,**kwargs)
 
     def get_previous_report_cutoff_time(self):
@@ -0,0 +1,168 @@
+"""built-in full text search for the database engines without one -
+sqlite and MySQL with InnoDB tables
+
+the words of the thread title, tags and of the texts of its posts
+are kept in the :class:`~askbot.models.SearchPosting` table, one row
+per word and thread, with the weight summing the occurrences of the
+word in these fields. The postings of a thread are updated when its
+posts or tags change and can be rebuilt with the ``rebuild_search_index``
+management command.
+
+The search matches threads that have all words of the query,
+relevance of the thread is the sum of weights of the query words.
+"""
+import re
+from django.db import connection, transaction
+import askbot
+from askbot.utils import mysql
+from askbot.utils.lists import batch_size
+
+TITLE_WEIGHT = 5
+TAGS_WEIGHT = 3
+TEXT_WEIGHT = 1
+
+#longer words are cut to the length of the term column
+MAX_TERM_LENGTH = 64
+#the rest of the words of a very long query is not used
+MAX_QUERY_TERMS = 16
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+def is_enabled():
+    """True if the search runs against the postings table,
+    i.e. the database does not have its own full text search"""
+    engine_name = askbot.get_database_engine_name()
+    if 'postgresql_psycopg2' in engine_name:
+        return False
+    if engine_name.endswith('mysql') and mysql.supports_full_text_search():
+        return False
+    return True
+
+def tokenize(text):
+    """returns list of the lower case words of the text"""
+    if not text:
+        return list()
+    return [word[:MAX_TERM_LENGTH] for word in WORD_RE.findall(text.lower())]
+
+def get_query_terms(query_text):
+    """returns sorted list of distinct words of the search query"""
+    return sorted(set(tokenize(query_text)))[:MAX_QUERY_TERMS]
+
+def get_term_weights(title, tagnames, texts):
+    """returns dictionary of weights of the words
+    in the thread title, tags and texts of the posts"""
+    weights = dict()
+    for text, field_weight in (
+        (title, TITLE_WEIGHT),
+        (tagnames, TAGS_WEIGHT),
+    ):
+        for term in tokenize(text):
+            weights[term] = weights.get(term, 0) + field_weight
+    for text in texts:
+        for term in tokenize(text):
+            weights[term] = weights.get(term, 0) + TEXT_WEIGHT
+    return weights
+
+def index_threads(threads):
+    """replaces postings of the threads, the ``threads``
+    are dictionaries with keys ``id``, ``title`` and ``tagnames``
+
+    the postings are written with plain sql, as there may be
+    hundreds of them per thread
+    """
+    from askbot.models import Post, SearchPosting
+    thread_ids = [thread['id'] for thread in threads]
+    if len(thread_ids) == 0:
+        return
+
+    texts = dict((thread_id, list()) for thread_id in thread_ids)
+    posts = Post.objects.filter(
+                        thread__id__in = thread_ids,
+                        deleted = False
+                    ).values_list('thread', 'text')
+    for thread_id, text in posts:
+        texts[thread_id].append(text)
+
+    postings = list()
+    for thread in threads:
+        weights = get_term_weights(
+                            thread['title'],
+                            thread['tagnames'],
+                            texts[thread['id']]
+                        )
+        for term, weight in weights.iteritems():
+            postings.append((term, thread['id'], weight))
+
+    table_name = SearchPosting._meta.db_table
+    cursor = connection.cursor()
+    cursor.execute(
+        'DELETE FROM ' + table_name + ' WHERE thread_id IN (' + \
+        ', '.join(['%s'] * len(thread_ids)) + ')',
+        thread_ids
+    )
+    if postings:
+        cursor.executemany(
+            'INSERT INTO ' + table_name + ' (term, thread_id, weight) ' + \
+            'VALUES (%s, %s, %s)',
+            postings
+        )
+    transaction.commit_unless_managed()
+
+def update_thread(thread):
+    """updates postings of one thread"""
+    index_threads([{
+        'id': thread.id,
+        'title': thread.title,
+        'tagnames': thread.tagnames
+    }])
+
+def rebuild_index(batch = 200):
+    """builds postings of all threads, indexing
+    ``batch`` threads at a time, yields the numbers
+    of the indexed threads"""
+    from askbot.models import Thread, SearchPosting
+    connection.cursor().execute('DELETE FROM ' + SearchPosting._meta.db_table)
+    transaction.commit_unless_managed()
+    thread_ids = list(Thread.objects.values_list('id', flat = True))
+    for id_batch in batch_size(thread_ids, batch):
+        threads = Thread.objects.filter(
+                            id__in = id_batch
+                        ).values('id', 'title', 'tagnames')
+        index_threads(list(threads))
+        yield len(id_batch)
+
+def run_full_text_search(query_set, query_text, thread_id_column = None):
+    """filters the query set to the threads having all words
+    of the query text and adds the ``relevance`` column
+
+    ``thread_id_column`` is the column with thread id of the query set
+    table, by default - the primary key, i.e. the query set is of threads
+    """
+    from askbot.models import SearchPosting
+    terms = get_query_terms(query_text)
+    if len(terms) == 0:
+        return query_set.none()
+
+    if thread_id_column is None:
+        thread_id_column = '%s.%s' % (
+                                query_set.model._meta.db_table,
+                                query_set.model._meta.pk.column
+                            )
+    postings_table = SearchPosting._meta.db_table
+    terms_sql = ', '.join(['%s'] * len(terms))
+
+    where_clause = thread_id_column + ' IN (' + \
+        'SELECT thread_id FROM ' + postings_table + \
+        ' WHERE term IN (' + terms_sql + ')' + \
+        ' GROUP BY thread_id HAVING COUNT(*) = %s)'
+
+    rank_clause = '(SELECT SUM(weight) FROM ' + postings_table + \
+        ' WHERE thread_id = ' + thread_id_column + \
+        ' AND term IN (' + terms_sql + '))'
+
+    return query_set.extra(
+        select = {'relevance': rank_clause},
+        select_params = terms,
+        where = [where_clause,],
+        params = terms + [len(terms)]
+    )
@@ -0,0 +1,231 @@
+"""Keyset ("seek") paginator for the question listing
+
+Unlike the django ``Paginator``, the keyset paginator does not
+use ``OFFSET`` to reach deeper pages and does not count the
+whole result set on every request. Instead each page is
+selected with a ``WHERE (sort_column, id) < (value, id)``
+condition, so the cost of any page is the same as the cost
+of the first one.
+
+Position in the listing is passed between requests as an opaque
+token (the "cursor"), which encodes direction, the ordering field
+and the sort column value plus the id of the boundary row.
+"""
+import base64
+import datetime
+
+from django.core import cache
+from django.db import models
+from django.utils.encoding import smart_str
+from django.utils.hashcompat import md5_constructor
+
+#how long the approximate result count is kept in the cache
+COUNT_CACHE_TIMEOUT = 300
+FORWARD = 'f'
+BACKWARD = 'b'
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def encode_cursor(direction, order_by, value, pk):
+    """returns url-safe token for the position in the listing,
+    ``order_by`` is the ordering field name, e.g. '-last_activity_at'
+    """
+    if isinstance(value, datetime.datetime):
+        value = value.strftime(DATETIME_FORMAT)
+    token = '|'.join((direction, order_by, smart_str(value), str(pk)))
+    return base64.urlsafe_b64encode(token).rstrip('=')
+
+
+def decode_cursor(cursor, order_by, value_field):
+    """returns tuple (direction, value, pk) or ``None``
+    if the cursor is malformed or was made for a different
+    ordering - in that case listing must restart from the
+    first page
+    """
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        token = base64.urlsafe_b64decode(smart_str(cursor) + padding)
+        direction, cursor_order_by, value, pk = token.split('|')
+        if direction not in (FORWARD, BACKWARD):
+            return None
+        if cursor_order_by != order_by:
+            return None
+        if isinstance(value_field, models.DateTimeField):
+            value = datetime.datetime.strptime(value, DATETIME_FORMAT)
+        else:
+            value = int(value)
+        return direction, value, int(pk)
+    except (TypeError, ValueError):
+        return None
+
+
+class KeysetPage(object):
+    """a page of the keyset paginator, implements
+    the subset of django ``Page`` interface used by the
+    questions view and the paginator templates
+    """
+    def __init__(self, object_list, number, paginator,
+                has_previous, has_next, previous_cursor, next_cursor):
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self._has_previous = has_previous
+        self._has_next = has_next
+        self.previous_cursor = previous_cursor
+        self.next_cursor = next_cursor
+
+    def __repr__(self):
+        return '<Keyset page %s>' % self.number
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+
+class KeysetPaginator(object):
+    """paginates a query set ordered by ``order_by``
+    (a single field name, optionally prefixed with "-")
+    with the primary key as the tie breaker
+
+    ``count`` is approximate - it is cached for
+    ``count_timeout`` seconds per distinct query
+    """
+    def __init__(self, queryset, order_by, per_page,
+                count_timeout=COUNT_CACHE_TIMEOUT):
+        self.queryset = queryset
+        self.order_by = order_by
+        self.per_page = per_page
+        self.count_timeout = count_timeout
+        self.descending = order_by.startswith('-')
+        self.field_name = order_by.lstrip('-')
+        self.value_field = queryset.model._meta.get_field(self.field_name)
+        self._count = None
+
+    def get_ordering(self, direction):
+        """returns list of ordering fields for the direction
+        of the seek"""
+        descending = self.descending
+        if direction == BACKWARD:
+            descending = not descending
+        prefix = descending and '-' or ''
+        return [prefix + self.field_name, prefix + 'id']
+
+    def get_seek_filter(self, direction, value, pk):
+        """returns ``Q`` object selecting rows after
+        the boundary (value, pk) in the given direction"""
+        descending = self.descending
+        if direction == BACKWARD:
+            descending = not descending
+        lookup = descending and 'lt' or 'gt'
+        past_value = models.Q(
+            **{'%s__%s' % (self.field_name, lookup): value}
+        )
+        past_pk = models.Q(
+            **{self.field_name: value, 'id__%s' % lookup: pk}
+        )
+        return past_value | past_pk
+
+    def get_cursor(self, direction, obj):
+        value = getattr(obj, self.field_name)
+        return encode_cursor(direction, self.order_by, value, obj.id)
+
+    def _get_count(self):
+        """approximate number of items - the exact count
+        is cached for a short time, because counting large
+        joined query sets is as expensive as the deep offsets
+        """
+        if self._count is None:
+            sql = smart_str(self.queryset.query)
+            key = 'keyset-count-%s' % md5_constructor(sql).hexdigest()
+            count = cache.cache.get(key)
+            if count is None:
+                count = self.queryset.count()
+                cache.cache.set(key, count, self.count_timeout)
+            self._count = count
+        return self._count
+    count = property(_get_count)
+
+    def _get_num_pages(self):
+        count = self.count
+        if count == 0:
+            return 1
+        return (count + self.per_page - 1) / self.per_page
+    num_pages = property(_get_num_pages)
+
+    def page(self, number, cursor=None):
+        """returns :class:`KeysetPage`, if cursor is not
+        given, or is invalid, the page is selected by the offset
+        (e.g. when links to page numbers were bookmarked)
+        """
+        number = max(int(number or 1), 1)
+        position = None
+        if cursor:
+            position = decode_cursor(cursor, self.order_by, self.value_field)
+
+        per_page = self.per_page
+        if position is None:
+            queryset = self.queryset.extra(
+                                order_by=self.get_ordering(FORWARD)
+                            )
+            offset = (number - 1) * per_page
+            object_list = list(queryset[offset:offset + per_page + 1])
+            has_next = len(object_list) > per_page
+            has_previous = number > 1
+            object_list = object_list[:per_page]
+        else:
+            direction, value, pk = position
+            queryset = self.queryset.filter(
+                                self.get_seek_filter(direction, value, pk)
+                            ).extra(
+                                order_by=self.get_ordering(direction)
+                            )
+            object_list = list(queryset[:per_page + 1])
+            has_more = len(object_list) > per_page
+            object_list = object_list[:per_page]
+            if direction == FORWARD:
+                has_next = has_more
+                has_previous = True
+            else:
+                object_list.reverse()
+                has_next = True
+                has_previous = has_more
+                if has_previous is False:
+                    number = 1
+
+        previous_cursor = None
+        next_cursor = None
+        if object_list:
+            if has_previous:
+                previous_cursor = self.get_cursor(BACKWARD, object_list[0])
+            if has_next:
+                next_cursor = self.get_cursor(FORWARD, object_list[-1])
+
+        return KeysetPage(
+                    object_list,
+                    number,
+                    self,
+                    has_previous=has_previous,
+                    has_next=has_next,
+                    previous_cursor=previous_cursor,
+                    next_cursor=next_cursor
+                )
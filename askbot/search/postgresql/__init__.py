@@ -1,5 +1,60 @@
 """Procedures to initialize the full text search in PostgresQL"""
-from django.db import connection
+import hashlib
+import os
+import re
+from django.core import cache
+from django.db import connection, transaction
+import askbot
+from askbot.search import result_cache
+
+#script setting up the incremental maintenance of the thread
+#and post search vectors, it does not calculate the vectors
+THREAD_AND_POST_SCRIPT = 'thread_and_post_models_10182026.plsql'
+
+#statements calculating the vectors of the rows with ids in a range,
+#thread vectors are made of the post vectors, so they go second
+REBUILD_VECTORS_SQL = (
+    (
+        'askbot_post',
+        'UPDATE askbot_post SET text_search_vector = '
+        'get_post_tsv(text, post_type) WHERE id >= %s AND id < %s'
+    ),
+    (
+        'askbot_thread',
+        'UPDATE askbot_thread SET text_search_vector = '
+        'get_thread_tsv(title, tagnames) || get_thread_posts_tsv(id) '
+        'WHERE id >= %s AND id < %s'
+    ),
+)
+
+#weights of the parts D, C, B and A of the thread search vectors:
+#A - title and tags, B - question and answers, C - comments
+RANK_WEIGHTS = '{0.05, 0.2, 0.4, 1.0}'
+#relevance grows with logarithm of the thread score
+SCORE_BOOST = 0.1
+#and is up to RECENCY_BOOST higher for the recently active threads
+RECENCY_BOOST = 0.5
+RECENCY_DAYS = 30
+
+#the rest of the parts of a very long query is not used
+MAX_QUERY_PARTS = 16
+#matches of the queries matching more threads are not cached,
+#the cached ones are stale after any change of the posts or tags,
+#as the content version of the search results is in the key
+MAX_CACHED_MATCHES = 500
+MATCHES_CACHE_TIMEOUT = 300
+
+#optionally negated quoted phrase or a word
+QUERY_PART_RE = re.compile(r'(-?)"([^"]*)"?|(\S+)', re.UNICODE)
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+def get_script_path(script_name):
+    return os.path.join(
+                    askbot.get_install_directory(),
+                    'search',
+                    'postgresql',
+                    script_name
+                )
 
 def setup_full_text_search(script_path):
     """using postgresql database connection,
@@ -20,25 +75,78 @@ def setup_full_text_search(script_path):
     finally:
         cursor.close()
 
+def get_phrase_operator():
+    """the followed-by operator of tsquery is available
+    since PostgreSQL 9.6, with older versions the words
+    of the phrase are only required to be present"""
+    if connection.ops.postgres_version[0:2] >= (9, 6):
+        return '<->'
+    return '&'
+
+def parse_query(query_text, phrase_operator = '<->'):
+    """turns the search query into the text of a ``to_tsquery``
+    expression, all parts of the query are required:
+
+    * words are joined with the ``&`` operator
+    * ``word*`` matches words starting with "word"
+    * ``"quoted phrase"`` matches the words in this order,
+      words joined with punctuation, like ``foo-bar``, are phrases too
+    * ``-word`` or ``-"phrase"`` excludes the matches
+
+    the parts are sorted, so queries differing only in the order
+    of the parts have the same expression. Returns None, if there
+    is nothing to search for
+    """
+    included = set()
+    excluded = set()
+    for negation, phrase, word in QUERY_PART_RE.findall(query_text):
+        is_prefix = False
+        if word:
+            if word.startswith('-') and len(word) > 1:
+                negation = '-'
+                word = word[1:]
+            is_prefix = word.endswith('*')
+            phrase = word
+        words = WORD_RE.findall(phrase.lower())
+        if len(words) == 0:
+            continue
+        if is_prefix:
+            words[-1] += ':*'
+        if len(words) == 1:
+            clause = words[0]
+        else:
+            clause = '(' + (' %s ' % phrase_operator).join(words) + ')'
+        if negation:
+            excluded.add(clause)
+        else:
+            included.add(clause)
+
+    if len(included) == 0:
+        return None
+    clauses = sorted(included)[:MAX_QUERY_PARTS]
+    clauses += ['!' + clause for clause in sorted(excluded)[:MAX_QUERY_PARTS]]
+    return ' & '.join(clauses)
+
 def run_full_text_search(query_set, query_text):
     """runs full text search against the query set and
-    the search text. All words in the query text are
-    added to the search with the & operator - i.e.
-    the more terms in search, the narrower it is.
+    the search text, parsed with :func:`parse_query`
 
     It is also assumed that we ar searching in the same
     table as the query set was built against, also
     it is assumed that the table has text search vector
     stored in the column called `text_search_vector`.
     """
+    search_query = parse_query(query_text, get_phrase_operator())
+    if search_query is None:
+        return query_set.none()
+
     table_name = query_set.model._meta.db_table
 
     rank_clause = 'ts_rank(' + table_name + \
-        '.text_search_vector, plainto_tsquery(%s))'
+        '.text_search_vector, to_tsquery(%s))'
 
-    where_clause = table_name + '.text_search_vector @@ plainto_tsquery(%s)'
+    where_clause = table_name + '.text_search_vector @@ to_tsquery(%s)'
 
-    search_query = '&'.join(query_text.split())#apply "AND" operator
     extra_params = (search_query,)
     extra_kwargs = {
         'select': {'relevance': rank_clause},
@@ -48,3 +156,149 @@ def run_full_text_search(query_set, query_text):
     }
 
     return query_set.extra(**extra_kwargs)
+
+def get_thread_rank_sql(table_name):
+    """sql of the thread relevance - weighted rank of the
+    text match, raised for the higher scored and
+    recently active threads, has one parameter - the tsquery"""
+    return (
+        "ts_rank('%(weights)s', %(table)s.text_search_vector, to_tsquery(%%s))"
+        " * (1 + %(score_boost)s * ln(1 + greatest(%(table)s.score, 0)))"
+        " * (1 + %(recency_boost)s / (1 + extract(epoch from"
+        " localtimestamp - %(table)s.last_activity_at) / %(recency_seconds)d))"
+    ) % {
+        'weights': RANK_WEIGHTS,
+        'table': table_name,
+        'score_boost': SCORE_BOOST,
+        'recency_boost': RECENCY_BOOST,
+        'recency_seconds': RECENCY_DAYS * 24 * 60 * 60
+    }
+
+def get_matches_cache_key(search_query):
+    """returns cache key of the matches of the parsed search query,
+    includes the content version of the search results"""
+    key_text = '%s:%s' % (
+        result_cache.get_content_version(),
+        search_query.encode('utf-8')
+    )
+    return 'thread-search-matches-' + hashlib.md5(key_text).hexdigest()
+
+def get_ranked_matches(search_query):
+    """returns list of pairs (thread id, relevance) of all threads
+    matching the parsed search query, ordered by relevance,
+    or None if there are more than ``MAX_CACHED_MATCHES`` of them.
+
+    The result is cached by the query and the content version
+    of the search results, so repeated searches do not hit the database
+    until the posts or tags change"""
+    cache_key = get_matches_cache_key(search_query)
+    matches = cache.cache.get(cache_key)
+    if matches is not None:
+        return matches[0]
+
+    from askbot.models import Thread
+    table_name = Thread._meta.db_table
+    cursor = connection.cursor()
+    cursor.execute(
+        'SELECT id, ' + get_thread_rank_sql(table_name) + ' AS relevance' + \
+        ' FROM ' + table_name + \
+        ' WHERE text_search_vector @@ to_tsquery(%s)' + \
+        ' ORDER BY relevance DESC LIMIT %s',
+        (search_query, search_query, MAX_CACHED_MATCHES + 1)
+    )
+    matches = cursor.fetchall()
+    if len(matches) > MAX_CACHED_MATCHES:
+        matches = None
+    #wrapped in a tuple, so that the cached None is told from a cache miss
+    cache.cache.set(cache_key, (matches,), MATCHES_CACHE_TIMEOUT)
+    return matches
+
+def run_thread_search(query_set, query_text):
+    """full text search of the threads, ranked by the weighted
+    text match and the score and the recency of the threads.
+
+    Unless the query matches too many threads, the matches
+    are taken from the cache and the query set is
+    filtered by their ids.
+    """
+    search_query = parse_query(query_text, get_phrase_operator())
+    if search_query is None:
+        return query_set.none()
+
+    table_name = query_set.model._meta.db_table
+    matches = get_ranked_matches(search_query)
+    if matches is None:
+        return query_set.extra(
+            select = {'relevance': get_thread_rank_sql(table_name)},
+            select_params = (search_query,),
+            where = [table_name + '.text_search_vector @@ to_tsquery(%s)'],
+            params = (search_query,)
+        )
+
+    if len(matches) == 0:
+        return query_set.none()
+    thread_ids = [thread_id for thread_id, relevance in matches]
+    rank_clause = 'CASE ' + table_name + '.id' + \
+                    ' WHEN %s THEN %s' * len(matches) + ' END'
+    rank_params = list()
+    for thread_id, relevance in matches:
+        rank_params.extend((thread_id, relevance))
+    return query_set.filter(id__in = thread_ids).extra(
+                            select = {'relevance': rank_clause},
+                            select_params = rank_params
+                        )
+
+def rebuild_vectors(batch_size = 1000, resume_from = None):
+    """recalculates search vectors of the posts, then of the
+    threads, ``batch_size`` rows at a time, each batch is
+    committed separately, so only the rows of the current batch
+    are locked
+
+    ``resume_from`` - pair (table name, id) to continue the
+    interrupted rebuild from
+
+    yields (table name, id up to which the rows are done, max id)
+    """
+    table_names = [table_name for table_name, sql in REBUILD_VECTORS_SQL]
+    if resume_from:
+        resume_table, resume_id = resume_from
+        skipped_count = table_names.index(resume_table)
+    else:
+        resume_table, resume_id = None, None
+        skipped_count = 0
+
+    cursor = connection.cursor()
+    for table_name, update_sql in REBUILD_VECTORS_SQL[skipped_count:]:
+        cursor.execute('SELECT min(id), max(id) FROM ' + table_name)
+        min_id, max_id = cursor.fetchone()
+        if max_id is None:
+            continue
+        if table_name == resume_table:
+            min_id = max(min_id, resume_id)
+        for start_id in xrange(min_id, max_id + 1, batch_size):
+            end_id = start_id + batch_size
+            cursor.execute(update_sql, (start_id, end_id))
+            transaction.commit_unless_managed()
+            yield table_name, min(end_id, max_id + 1), max_id
+
+def rebuild_gin_index():
+    """rebuilds the gin index of the thread search vectors
+    without locking the table for writes - a new index is built
+    concurrently and then replaces the old one"""
+    connection.cursor()#make sure that the connection is open
+    isolation_level = connection.connection.isolation_level
+    #create index concurrently cannot run within a transaction
+    connection.connection.set_isolation_level(0)
+    try:
+        cursor = connection.cursor()
+        cursor.execute('DROP INDEX IF EXISTS askbot_search_idx_new')
+        cursor.execute(
+            'CREATE INDEX CONCURRENTLY askbot_search_idx_new '
+            'ON askbot_thread USING gin(text_search_vector)'
+        )
+        cursor.execute('DROP INDEX IF EXISTS askbot_search_idx')
+        cursor.execute(
+            'ALTER INDEX askbot_search_idx_new RENAME TO askbot_search_idx'
+        )
+    finally:
+        connection.connection.set_isolation_level(isolation_level)
@@ -0,0 +1,101 @@
+"""cache of the question list search results
+
+the ordered ids of the threads on the first pages of the search
+are kept in cache under the key made of the canonical form of the
+:class:`~askbot.search.state_manager.SearchState` - query, tags,
+scope, sort method and author - so that the searches differing only
+in the order of the tags or the case of the query share one entry.
+The tag filters of the users are not a part of the key,
+they are applied to the cached results in memory.
+
+Each key includes the content version - a global counter bumped
+on every change of the posts, threads and tags, so the entries
+are never invalidated one by one, the stale ones expire from cache.
+Votes change the scores with sql updates and do not bump the version,
+so the order by votes may lag by up to ``RESULT_CACHE_TIMEOUT`` seconds.
+
+Numbers of hits and misses of the cache are available
+from :func:`get_stats` and the ``get_search_cache_stats``
+management command.
+"""
+import hashlib
+import time
+from django.core import cache
+from askbot import const
+
+CONTENT_VERSION_KEY = 'search-content-version'
+HITS_KEY = 'search-result-cache-hits'
+MISSES_KEY = 'search-result-cache-misses'
+RESULT_CACHE_TIMEOUT = 600
+
+def get_content_version():
+    """returns the current content version"""
+    version = cache.cache.get(CONTENT_VERSION_KEY)
+    if version is None:
+        #start from the current time, so that the results
+        #cached before the counter was evicted are not reused
+        version = int(time.time() * 1000000)
+        if not cache.cache.add(CONTENT_VERSION_KEY, version, const.LONG_TIME):
+            version = cache.cache.get(CONTENT_VERSION_KEY, version)
+    return version
+
+def increment_content_version():
+    """makes all cached search results stale,
+    returns the new version, or ``None`` if there was none"""
+    try:
+        return cache.cache.incr(CONTENT_VERSION_KEY)
+    except ValueError:
+        return None
+
+def get_cache_key(search_state):
+    """returns cache key of the results of the search,
+    includes the current content version and the settings
+    which change the results of the search"""
+    from askbot.conf import settings as askbot_settings
+    key_parts = search_state.canonical_form() + (
+        askbot_settings.ENABLE_CONTENT_MODERATION,
+        askbot_settings.TAG_SEARCH_INPUT_ENABLED,
+        askbot_settings.UNANSWERED_QUESTION_MEANING,
+        get_content_version()
+    )
+    key_hash = hashlib.md5(repr(key_parts)).hexdigest()
+    return 'search-results-' + key_hash
+
+def get_results(cache_key):
+    """returns the cached results or ``None``"""
+    return cache.cache.get(cache_key)
+
+def set_results(cache_key, results):
+    cache.cache.set(cache_key, results, RESULT_CACHE_TIMEOUT)
+
+def _increment_counter(key):
+    try:
+        cache.cache.incr(key)
+    except ValueError:
+        #the counter is started, unless it was started in the meantime,
+        #the numbers are approximate anyway, as they may be evicted
+        if not cache.cache.add(key, 1, const.LONG_TIME):
+            try:
+                cache.cache.incr(key)
+            except ValueError:
+                pass
+
+def count_hit():
+    _increment_counter(HITS_KEY)
+
+def count_miss():
+    _increment_counter(MISSES_KEY)
+
+def get_stats():
+    """returns dictionary with numbers of the ``hits``
+    and ``misses`` and the ``hit_ratio`` of the cache"""
+    hits = cache.cache.get(HITS_KEY) or 0
+    misses = cache.cache.get(MISSES_KEY) or 0
+    if hits + misses:
+        hit_ratio = float(hits) / (hits + misses)
+    else:
+        hit_ratio = None
+    return {'hits': hits, 'misses': misses, 'hit_ratio': hit_ratio}
+
+def reset_stats():
+    cache.cache.delete_many([HITS_KEY, MISSES_KEY])
@@ -13,32 +13,34 @@ from askbot import const
 from askbot.utils.functions import strip_plus
 
 
-def extract_matching_token(text, regexes):
-    """if text matches any of the regexes,
-    * the entire match is removed from text
-    * repeating spaces in the remaining string are replaced with one
-    * returned is a tuple of: first group from the regex, remaining text
-    """
-    for regex in regexes:
-        m = regex.search(text)
-        if m:
-            text = regex.sub('', text)
-            extracted_match = m.group(1)
-            return (strip_plus(extracted_match), strip_plus(text))
-    return ('', text.strip())
-
-def extract_all_matching_tokens(text, regexes):
-    """the same as the ``extract_matching_token``
-    but returns a tuple of: list of first group matches from the regexes
-    and the remains of the input text
-    """
-    matching_tokens = set()
-    for regex in regexes:
-        matches = regex.findall(text)
-        if len(matches) > 0:
-            text = regex.sub('', text)
-            matching_tokens.update([match.strip() for match in matches])
-    return ([strip_plus(token) for token in matching_tokens], strip_plus(text))
+#one regex for all selectors of the search query, each alternative
+#puts the selected value into a named group, the name tells the kind
+#of the selector, at one position titles are tried before tags,
+#and tags - before users
+QUERY_SELECTOR_RE = re.compile(
+    r'\[title:(?P<title1>.+?)\]'
+    r'|title:"(?P<title2>[^"]+?)"'
+    r"|title:'(?P<title3>[^']+?)'"
+    r'|\[(?P<tag1>[^:]+?)\]'
+    r'|\[tag:\s*(?P<tag2>[\S]+)\s*]'
+    r'|#(?P<tag3>\S+)'
+    r'|\[user:(?P<user1>[^\]]+?)\]'
+    r'|user:"(?P<user2>[^"]+?)"'
+    r"|user:'(?P<user3>[^']+?)'"
+    r"""|@(?P<user4>[^'"\s]+)"""
+    r'|@"(?P<user5>[^"]+)"'
+    r"|@'(?P<user6>[^']+)'"
+)
+
+def get_unique_values(values):
+    """returns list of the values with repeating spaces
+    replaced with one, without the empty and repeated ones"""
+    unique_values = list()
+    for value in values:
+        value = strip_plus(value)
+        if value and value not in unique_values:
+            unique_values.append(value)
+    return unique_values
 
 
 def parse_query(query):
@@ -52,45 +54,92 @@ def parse_query(query):
     against which global search will be performed
     the original query will still all be shown in the search
     query input box
+
+    the query is scanned once, of several titles the first one of
+    the most preferred form is used: [title:...], then title:"..."
+    and title:'...', the titles of the other forms are left in the
+    stripped query
     """
-    title_re1 = re.compile(r'\[title:(.+?)\]')
-    title_re2 = re.compile(r'title:"([^"]+?)"')
-    title_re3 = re.compile(r"title:'([^']+?)'")
-    title_regexes = (title_re1, title_re2, title_re3)
-    (query_title, query) = extract_matching_token(query, title_regexes)
-
-    tag_re1 = re.compile(r'\[([^:]+?)\]')
-    tag_re2 = re.compile(r'\[tag:\s*([\S]+)\s*]')
-    tag_re3 = re.compile(r'#(\S+)')
-    tag_regexes = (tag_re1, tag_re2, tag_re3)
-    (query_tags, query) = extract_all_matching_tokens(query, tag_regexes)
-
-    user_re1 = re.compile(r'\[user:([^\]]+?)\]')
-    user_re2 = re.compile(r'user:"([^"]+?)"')
-    user_re3 = re.compile(r"user:'([^']+?)'")
-    user_re4 = re.compile(r"""@([^'"\s]+)""")
-    user_re5 = re.compile(r'@"([^"]+)"')
-    user_re6 = re.compile(r"@'([^']+)'")
-    user_regexes = (user_re1, user_re2, user_re3, user_re4, user_re5, user_re6)
-    (query_users, stripped_query) = extract_all_matching_tokens(query, user_regexes)
+    text_parts = list()
+    titles = list()
+    tags = list()
+    users = list()
+    position = 0
+    for match in QUERY_SELECTOR_RE.finditer(query):
+        text_parts.append(query[position:match.start()])
+        position = match.end()
+        kind = match.lastgroup
+        if kind.startswith('title'):
+            titles.append(match)
+            text_parts.append(match)
+        elif kind.startswith('tag'):
+            tags.append(match.group(kind))
+        else:
+            users.append(match.group(kind))
+    text_parts.append(query[position:])
+
+    query_title = ''
+    title_kind = None
+    if titles:
+        #group names sort in the order of preference
+        title_kind = min([match.lastgroup for match in titles])
+        for match in titles:
+            if match.lastgroup == title_kind:
+                query_title = strip_plus(match.group(title_kind))
+                break
+
+    for index, part in enumerate(text_parts):
+        if not isinstance(part, basestring):
+            if part.lastgroup == title_kind:
+                text_parts[index] = ''
+            else:
+                text_parts[index] = part.group(0)
 
     return {
-        'stripped_query': stripped_query,
+        'stripped_query': strip_plus(''.join(text_parts)),
         'query_title': query_title,
-        'query_tags': query_tags,
-        'query_users': query_users
+        'query_tags': get_unique_values(tags),
+        'query_users': get_unique_values(users)
     }
 
+#a character that can never be a part of a tag name,
+#see SearchState.add_tag_url()
+TAG_URL_PLACEHOLDER = '\x00'
+
+#valid values of the scope and the sort method
+POST_SCOPES = frozenset(scope for scope, label in const.POST_SCOPE_LIST)
+POST_SORT_METHODS = frozenset(sort for sort, label in const.POST_SORT_METHODS)
+
+_questions_urls = {}
+
+def get_questions_url():
+    """returns url of the questions page, memoized
+    per script prefix of the site"""
+    script_prefix = urlresolvers.get_script_prefix()
+    url = _questions_urls.get(script_prefix)
+    if url is None:
+        url = urlresolvers.reverse('questions')
+        _questions_urls[script_prefix] = url
+    return url
+
+
 class SearchState(object):
+    """Selection of the questions list - scope, sort method,
+    search query, tags, author and page.
+
+    The search state is treated as an immutable value: methods like
+    :meth:`add_tag` and :meth:`change_page` return new search states,
+    which share the unchanged lists and the quoted url fragments
+    with the original one, so the links of a page are cheap to build.
+    Use :meth:`deepcopy` to get a copy that can be modified.
+    """
 
     @classmethod
     def get_empty(cls):
         return cls(scope=None, sort=None, query=None, tags=None, author=None, page=None, user_logged_in=None)
 
-    def __init__(self, scope, sort, query, tags, author, page, user_logged_in):
-        # INFO: zip(*[('a', 1), ('b', 2)])[0] == ('a', 'b')
-
-        if (scope not in zip(*const.POST_SCOPE_LIST)[0]) or (scope == 'favorite' and not user_logged_in):
+    def __init__(self, scope, sort, query, tags, author, page, user_logged_in, cursor=None):
+        if (scope not in POST_SCOPES) or (scope == 'favorite' and not user_logged_in):
             self.scope = const.DEFAULT_POST_SCOPE
         else:
             self.scope = scope
@@ -112,7 +161,7 @@ class SearchState(object):
             self.query_users = None
             self.query_title = None
 
-        if (sort not in zip(*const.POST_SORT_METHODS)[0]) or (sort == 'relevance-desc' and (not self.query or not askbot.conf.should_show_sort_by_relevance())):
+        if (sort not in POST_SORT_METHODS) or (sort == 'relevance-desc' and (not self.query or not askbot.conf.should_show_sort_by_relevance())):
             self.sort = const.DEFAULT_POST_SORT_METHOD
         else:
             self.sort = sort
@@ -129,7 +178,30 @@ class SearchState(object):
         if self.page == 0:  # in case someone likes jokes :)
             self.page = 1
 
-        self._questions_url = urlresolvers.reverse('questions')
+        #opaque position token of the keyset paginator
+        self.cursor = cursor or None
+
+        self._questions_url = get_questions_url()
+        self._query_fragment = None
+        self._tags_fragment = None
+        self._reset_urls()
+
+    def _reset_urls(self):
+        """drops memoized query string and urls built by :meth:`add_tag_url`"""
+        self._query_string = None
+        self._tag_urls = {}
+        self._tag_url_affixes = None
+
+    def _replace(self, **changes):
+        """returns new search state with the attributes changed,
+        the rest of the attributes is shared with this one"""
+        ss = self.__class__.__new__(self.__class__)
+        ss.__dict__.update(self.__dict__)
+        ss.__dict__.update(changes)
+        if 'tags' in changes:
+            ss._tags_fragment = None
+        ss._reset_urls()
+        return ss
 
     def __str__(self):
         return self.query_string()
@@ -151,6 +223,26 @@ class SearchState(object):
         "Returns tags both from tag selector and extracted from query"
         return (self.query_tags or []) + (self.tags or [])
 
+    def canonical_form(self):
+        """Returns tuple of the values selecting the questions,
+        equal for the search states finding the same questions
+        in the same order - the text search is case insensitive
+        and the order of the tags does not matter.
+        Page and the tag filters of the user are not included"""
+        def normalize(text):
+            if text:
+                return u' '.join(text.lower().split())
+            return None
+        return (
+            self.scope,
+            self.sort,
+            normalize(self.stripped_query),
+            normalize(self.query_title),
+            tuple(sorted(set(self.query_users or []))),
+            tuple(sorted(set(self.unified_tags()))),
+            self.author
+        )
+
     #
     # Safe characters in urlquote() according to http://www.ietf.org/rfc/rfc1738.txt:
     #
@@ -166,22 +258,31 @@ class SearchState(object):
     SAFE_CHARS = const.TAG_SEP + '_+.-'
 
     def query_string(self):
+        if self._query_string is not None:
+            return self._query_string
         lst = [
             'scope:' + self.scope,
             'sort:' + self.sort
         ]
         if self.query:
-            lst.append('query:' + urllib.quote(smart_str(self.query), safe=self.SAFE_CHARS))
+            if self._query_fragment is None:
+                self._query_fragment = 'query:' + urllib.quote(smart_str(self.query), safe=self.SAFE_CHARS)
+            lst.append(self._query_fragment)
         if self.tags:
-            lst.append('tags:' + urllib.quote(smart_str(const.TAG_SEP.join(self.tags)), safe=self.SAFE_CHARS))
+            if self._tags_fragment is None:
+                self._tags_fragment = 'tags:' + urllib.quote(smart_str(const.TAG_SEP.join(self.tags)), safe=self.SAFE_CHARS)
+            lst.append(self._tags_fragment)
         if self.author:
             lst.append('author:' + str(self.author))
         if self.page:
             lst.append('page:' + str(self.page))
-        return '/'.join(lst) + '/'
+        if self.cursor:
+            lst.append('cursor:' + self.cursor)
+        self._query_string = '/'.join(lst) + '/'
+        return self._query_string
 
     def deepcopy(self): # TODO: test me
-        "Used to contruct a new SearchState for manipulation, e.g. for adding/removing tags"
+        "Used to contruct a new SearchState for manipulation, the lists are copied"
         ss = copy.copy(self) #SearchState.get_empty()
 
         #ss.scope = self.scope
@@ -201,48 +302,68 @@ class SearchState(object):
 
         #ss._questions_url = self._questions_url
 
+        #copies are modified by the callers, so they
+        #must not share the memoized urls
+        ss._tags_fragment = None
+        ss._reset_urls()
+
         return ss
 
     def add_tag(self, tag):
-        ss = self.deepcopy()
-        if tag not in ss.tags:
-            ss.tags.append(tag)
-            ss.page = 1 # state change causes page reset
-        return ss
+        if tag in self.tags:
+            return self
+        # state change causes page reset
+        return self._replace(tags=self.tags + [tag], page=1, cursor=None)
+
+    def _get_tag_url_affixes(self):
+        """returns parts of the url of this search state with one
+        more tag added, that go before and after the quoted new tag;
+        the tag list is the last variable part of the url
+        before author and page, so the url is built once
+        with a placeholder tag and split around it
+        """
+        if self._tag_url_affixes is None:
+            url = self.add_tag(TAG_URL_PLACEHOLDER).full_url()
+            quoted_placeholder = urllib.quote(TAG_URL_PLACEHOLDER)
+            self._tag_url_affixes = url.rsplit(quoted_placeholder, 1)
+        return self._tag_url_affixes
+
+    def add_tag_url(self, tag):
+        """same as ``self.add_tag(tag).full_url()``, but without
+        copying the search state, urls are memoized per tag,
+        so it is cheap to call many times for one page
+        """
+        url = self._tag_urls.get(tag)
+        if url is None:
+            if tag in self.tags:
+                url = self.add_tag(tag).full_url()
+            else:
+                prefix, suffix = self._get_tag_url_affixes()
+                quoted_tag = urllib.quote(smart_str(tag), safe=self.SAFE_CHARS)
+                url = prefix + quoted_tag + suffix
+            self._tag_urls[tag] = url
+        return url
 
     def remove_author(self):
-        ss = self.deepcopy()
-        ss.author = None
-        ss.page = 1
-        return ss
+        return self._replace(author=None, page=1, cursor=None)
 
     def remove_tags(self, tags = None):
-        ss = self.deepcopy()
         if tags:
-            ss.tags = list(
-                set(ss.tags) - set(tags)
+            new_tags = list(
+                set(self.tags) - set(tags)
             )
         else:
-            ss.tags = []
-        ss.page = 1
-        return ss
+            new_tags = []
+        return self._replace(tags=new_tags, page=1, cursor=None)
 
     def change_scope(self, new_scope):
-        ss = self.deepcopy()
-        ss.scope = new_scope
-        ss.page = 1
-        return ss
+        return self._replace(scope=new_scope, page=1, cursor=None)
 
     def change_sort(self, new_sort):
-        ss = self.deepcopy()
-        ss.sort = new_sort
-        ss.page = 1
-        return ss
+        return self._replace(sort=new_sort, page=1, cursor=None)
 
-    def change_page(self, new_page):
-        ss = self.deepcopy()
-        ss.page = new_page
-        return ss
+    def change_page(self, new_page, cursor=None):
+        return self._replace(page=new_page, cursor=cursor)
 
 
 class DummySearchState(object): # Used for caching question/thread summaries
@@ -256,3 +377,6 @@ class DummySearchState(object): # Used for caching question/thread summaries
 
     def full_url(self):
         return '<<<%s>>>' % self.tag
+
+    def add_tag_url(self, tag):
+        return self.add_tag(tag).full_url()
@@ -222,6 +222,13 @@ ASKBOT_USE_STACKEXCHANGE_URLS = False #mimic url scheme of stackexchange
 BROKER_TRANSPORT = "djkombu.transport.DatabaseTransport"
 CELERY_ALWAYS_EAGER = True
 
+#Outgoing email is queued and delivered by the send_queued_email
+#management command, set to True to send it immediately instead
+ASKBOT_EMAIL_QUEUE_ALWAYS_EAGER = False
+if 'test' in sys.argv:
+    #the tests check the sent email right away
+    ASKBOT_EMAIL_QUEUE_ALWAYS_EAGER = True
+
 import djcelery
 djcelery.setup_loader()
 
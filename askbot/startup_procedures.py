@@ -456,7 +456,8 @@ def test_csrf_cookie_domain():
         )
 
 def test_settings_for_test_runner():
-    """makes sure that debug toolbar is disabled when running tests"""
+    """makes sure that debug toolbar is disabled and
+    the email is not queued when running tests"""
     errors = list()
     if 'debug_toolbar' in django_settings.INSTALLED_APPS:
         errors.append(
@@ -468,6 +469,12 @@ def test_settings_for_test_runner():
             'When testing - remove debug_toolbar.middleware.DebugToolbarMiddleware '
             'from MIDDLEWARE_CLASSES'
         )
+    if not getattr(django_settings, 'ASKBOT_EMAIL_QUEUE_ALWAYS_EAGER', False):
+        errors.append(
+            'When testing - add to settings.py:\n'
+            "if 'test' in sys.argv:\n"
+            '    ASKBOT_EMAIL_QUEUE_ALWAYS_EAGER = True'
+        )
     print_errors(errors)
 
 
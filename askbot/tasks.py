@@ -21,6 +21,7 @@ import sys
 import traceback
 
 from django.contrib.contenttypes.models import ContentType
+from django.core import cache
 from django.template import Context
 from django.utils.translation import ugettext as _
 from celery.decorators import task
@@ -28,7 +29,9 @@ from askbot.conf import settings as askbot_settings
 from askbot import const
 from askbot import mail
 from askbot.models import Activity, Post, Thread, User, ReplyAddress
+from askbot.models import ActivityAuditStatus, update_new_response_counts
 from askbot.models import send_instant_notifications_about_activity_in_post
+from askbot.models import save_pending_user_visits
 from askbot.models.badges import award_badges_signal
 
 # TODO: Make exceptions raised inside record_post_update_celery_task() ...
@@ -48,13 +51,13 @@ def notify_author_of_published_revision_celery_task(revision):
             'post': revision.post,
             'reply_action': 'append_content'
         }
-        append_content_address = ReplyAddress.objects.create_new(
-                                                        **reply_options
-                                                    ).as_email_address()
-        reply_options['reply_action'] = 'replace_content'
-        replace_content_address = ReplyAddress.objects.create_new(
-                                                        **reply_options
-                                                    ).as_email_address()
+        append_content_address, replace_content_address = [
+            reply_address.as_email_address()
+            for reply_address in ReplyAddress.objects.create_many([
+                reply_options,
+                dict(reply_options, reply_action = 'replace_content')
+            ])
+        ]
 
         #populate template context variables
         reply_code = append_content_address + ',' + replace_content_address
@@ -91,6 +94,32 @@ def notify_author_of_published_revision_celery_task(revision):
             headers = headers
         )
 
+@task(ignore_result = True)
+def update_thread_summary_html_celery_task(thread_id):
+    """re-renders summary html of the thread, scheduled by
+    :meth:`~askbot.models.Thread.schedule_summary_html_update`"""
+    #changes made from now on must schedule a new update
+    cache.cache.delete(Thread.SUMMARY_UPDATE_SCHEDULED_KEY_TPL % thread_id)
+    try:
+        thread = Thread.objects.get(id = thread_id)
+    except Thread.DoesNotExist:
+        return
+    thread.update_summary_html()
+
+@task(ignore_result = True)
+def save_pending_view_counts_celery_task(thread_ids = None):
+    """saves view counts accumulated in the cache, by default - of
+    all threads viewed since the last run, scheduled by
+    :meth:`~askbot.models.Thread.increase_view_count`"""
+    Thread.objects.save_pending_view_counts(thread_ids)
+
+@task(ignore_result = True)
+def save_pending_user_visits_celery_task(user_ids = None):
+    """saves last visit times of the users, by default - of all
+    users who visited the site since the last run, scheduled by
+    :func:`~askbot.models.record_user_visit`"""
+    save_pending_user_visits(user_ids)
+
 @task(ignore_result = True)
 def record_post_update_celery_task(
         post_id,
@@ -174,24 +203,27 @@ def record_post_update(
     update_activity.add_recipients(recipients)
 
     #create new mentions
+    recipient_set = set(recipients)
+    mentions = list()
     for u in newly_mentioned_users:
         #todo: a hack - some users will not have record of a mention
         #may need to fix this in the future. Added this so that 
         #recipients of the response who are mentioned as well would
         #not get two notifications in the inbox for the same post
-        if u in recipients:
+        if u in recipient_set:
             continue
-        Activity.objects.create_new_mention(
-                                mentioned_whom = u,
+        mention = Activity.objects.create_new_mention(
                                 mentioned_in = post,
                                 mentioned_by = updated_by,
                                 mentioned_at = timestamp
                             )
+        mentions.append((mention, u))
+    ActivityAuditStatus.objects.create_many(mentions)
 
-    assert(updated_by not in recipients)
+    assert(updated_by not in recipient_set)
 
-    for user in (set(recipients) | set(newly_mentioned_users)):
-        user.update_response_counts()
+    affected_users = recipient_set | set(newly_mentioned_users)
+    update_new_response_counts([user.id for user in affected_users])
 
     #shortcircuit if the email alerts are disabled
     if askbot_settings.ENABLE_EMAIL_ALERTS == False:
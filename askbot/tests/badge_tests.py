@@ -1,5 +1,6 @@
 import datetime
 from django.conf import settings as django_settings
+from django.core import cache
 from django.test.client import Client
 from askbot.tests.utils import AskbotTestCase
 from askbot.conf import settings
@@ -190,6 +191,47 @@ class BadgeTests(AskbotTestCase):
         self.client.get(question2.get_absolute_url())
         self.assert_have_badge('popular-question', recipient = self.u1, expected_count = 2)
 
+    def test_popular_question_badge_with_pending_views(self):
+        question = self.post_question(user = self.u1)
+        thread = question.thread
+        min_views = settings.POPULAR_QUESTION_BADGE_MIN_VIEWS
+        thread.view_count = min_views - 1
+        thread.save()
+
+        #view counts are not saved until the scheduled task runs
+        from askbot import tasks
+        task = tasks.save_pending_view_counts_celery_task
+        old_apply_async = task.apply_async
+        task.apply_async = lambda *args, **kwargs: None
+        old_delay = settings.VIEW_COUNT_UPDATE_DELAY
+        settings.update('VIEW_COUNT_UPDATE_DELAY', 60)
+        try:
+            question = models.Post.objects.get(id = question.id)
+            tasks.record_question_visit(
+                question_post = question,
+                user = self.u2,
+                update_view_count = True
+            )
+            self.assert_have_badge('popular-question', recipient = self.u1)
+
+            thread = models.Thread.objects.get(id = thread.id)
+            self.assertEqual(thread.view_count, min_views - 1)
+            self.assertEqual(thread.get_view_count(), min_views)
+
+            models.Thread.objects.save_pending_view_counts([thread.id])
+            thread = models.Thread.objects.get(id = thread.id)
+            self.assertEqual(thread.view_count, min_views)
+            self.assertEqual(thread.get_view_count(), min_views)
+        finally:
+            task.apply_async = old_apply_async
+            settings.update('VIEW_COUNT_UPDATE_DELAY', old_delay)
+            #local memory caches share storage
+            from django.core import cache
+            cache.cache.delete(
+                models.Thread.PENDING_VIEW_COUNT_KEY_TPL % thread.id
+            )
+            cache.cache.delete(models.Thread.PENDING_VIEWS.scheduled_key)
+
     def test_student_badge(self):
         question = self.post_question(user = self.u1)
         self.u2.upvote(question)
@@ -500,8 +542,110 @@ class BadgeTests(AskbotTestCase):
         prev_visit_count = settings.ENTHUSIAST_BADGE_MIN_DAYS - 1
         self.u1.consecutive_days_visit_count = prev_visit_count
         self.u1.save()
+        #forget visits recorded by other tests
+        cache.cache.delete(models.USER_LAST_SEEN_KEY_TPL % self.u1.id)
         self.assert_have_badge('enthusiast', self.u1, 0)
         self.client.login(method = 'force', user_id = self.u1.id)
         self.client.get('/' + django_settings.ASKBOT_URL)
         self.assert_have_badge('enthusiast', self.u1, 1)
 
+    def test_enthusiast_badge_with_pending_visits(self):
+        from askbot import tasks
+        task = tasks.save_pending_user_visits_celery_task
+        old_apply_async = task.apply_async
+        scheduled = list()
+        task.apply_async = lambda *args, **kwargs: scheduled.append(kwargs)
+        old_delay = settings.LAST_SEEN_UPDATE_DELAY
+        settings.update('LAST_SEEN_UPDATE_DELAY', 60)
+        cache.cache.delete(models.USER_LAST_SEEN_KEY_TPL % self.u1.id)
+        try:
+            now = datetime.datetime(2012, 6, 2, 12, 0)
+            yesterday = datetime.datetime(2012, 6, 1, 10, 0)
+            self.u1.last_seen = yesterday
+            self.u1.consecutive_days_visit_count = \
+                            settings.ENTHUSIAST_BADGE_MIN_DAYS - 1
+            self.u1.save()
+
+            #later visits of the same day are not saved right away
+            later_yesterday = datetime.datetime(2012, 6, 1, 11, 0)
+            models.record_user_visit(self.u1, later_yesterday)
+            self.assertEqual(scheduled, [{'countdown': 60}])
+            user = self.reload_object(self.u1)
+            self.assertEqual(user.last_seen, yesterday)
+
+            #first visit of the new day is saved immediately
+            #and is compared with the pending visit time
+            models.record_user_visit(user, now)
+            user = self.reload_object(self.u1)
+            self.assertEqual(user.last_seen, now)
+            self.assertEqual(
+                user.consecutive_days_visit_count,
+                settings.ENTHUSIAST_BADGE_MIN_DAYS
+            )
+            self.assert_have_badge('enthusiast', self.u1, 1)
+
+            later_now = now + datetime.timedelta(0, 1)
+            models.record_user_visit(user, later_now)
+            models.save_pending_user_visits()
+            user = self.reload_object(self.u1)
+            self.assertEqual(user.last_seen, later_now)
+        finally:
+            task.apply_async = old_apply_async
+            settings.update('LAST_SEEN_UPDATE_DELAY', old_delay)
+            #local memory caches share storage
+            cache.cache.delete(models.USER_LAST_SEEN_KEY_TPL % self.u1.id)
+            cache.cache.delete(
+                models.USERS_WITH_PENDING_VISITS.scheduled_key
+            )
+
+    def test_pending_visits_of_users_are_saved_together(self):
+        from askbot import tasks
+        task = tasks.save_pending_user_visits_celery_task
+        old_apply_async = task.apply_async
+        scheduled = list()
+        task.apply_async = lambda *args, **kwargs: scheduled.append(kwargs)
+        old_delay = settings.LAST_SEEN_UPDATE_DELAY
+        settings.update('LAST_SEEN_UPDATE_DELAY', 60)
+        users = (self.u1, self.u2)
+        morning = datetime.datetime(2012, 6, 1, 10, 0)
+        for user in users:
+            cache.cache.delete(models.USER_LAST_SEEN_KEY_TPL % user.id)
+            user.last_seen = morning
+            user.save()
+        try:
+            noon = datetime.datetime(2012, 6, 1, 12, 0)
+            models.record_user_visit(self.u1, noon - datetime.timedelta(0, 60))
+            models.record_user_visit(self.u2, noon)
+            models.record_user_visit(self.u1, noon)
+            self.assertEqual(scheduled, [{'countdown': 60}])
+            for user in users:
+                self.assertEqual(self.reload_object(user).last_seen, morning)
+
+            task()
+            for user in users:
+                self.assertEqual(self.reload_object(user).last_seen, noon)
+        finally:
+            task.apply_async = old_apply_async
+            settings.update('LAST_SEEN_UPDATE_DELAY', old_delay)
+            for user in users:
+                cache.cache.delete(models.USER_LAST_SEEN_KEY_TPL % user.id)
+            cache.cache.delete(
+                models.USERS_WITH_PENDING_VISITS.scheduled_key
+            )
+
+    def test_visits_are_saved_right_away_without_shared_cache(self):
+        from django.core.cache.backends.dummy import DummyCache
+        old_cache = cache.cache
+        cache.cache = DummyCache('', {})
+        old_delay = settings.LAST_SEEN_UPDATE_DELAY
+        settings.update('LAST_SEEN_UPDATE_DELAY', 60)
+        try:
+            self.u1.last_seen = datetime.datetime(2012, 6, 1, 10, 0)
+            self.u1.save()
+            noon = datetime.datetime(2012, 6, 1, 12, 0)
+            models.record_user_visit(self.u1, noon)
+            self.assertEqual(self.reload_object(self.u1).last_seen, noon)
+        finally:
+            cache.cache = old_cache
+            settings.update('LAST_SEEN_UPDATE_DELAY', old_delay)
+
@@ -3,13 +3,17 @@ functions that happen on behalf of users
 
 e.g. ``some_user.do_something(...)``
 """
+from django.core import cache
 from django.core import exceptions
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.dummy import DummyCache
 from django.core.urlresolvers import reverse
 from django.test.client import Client
 from django.conf import settings
 from django import forms
 from askbot.tests.utils import AskbotTestCase
 from askbot import models
+from askbot.models.tag import WildcardTrie, WildcardSelectionIndex
 from askbot import const
 from askbot.conf import settings as askbot_settings
 import datetime
@@ -256,6 +260,126 @@ class UserLikeTagTests(AskbotTestCase):
         self.assert_affinity_is('like', False)
         self.assert_affinity_is('dislike', False)
 
+class ResolvedTagSelectionTests(AskbotTestCase):
+    """tests for the cached per-user tag selections
+    used by the question listing"""
+    def setUp(self):
+        self.create_user()
+        self.post_question(tags = 'one two three')
+        askbot_settings.update('USE_WILDCARD_TAGS', True)
+
+    def get_tag_ids(self, *names):
+        return set(
+            models.Tag.objects.filter(name__in = names).values_list('id', flat = True)
+        )
+
+    def test_marked_tags_are_resolved(self):
+        self.user.mark_tags(['one'], reason = 'good', action = 'add')
+        self.user.mark_tags(['two'], reason = 'bad', action = 'add')
+        selections = self.user.get_resolved_tag_selections()
+        self.assertEqual(selections['good']['tag_names'], ['one'])
+        self.assertEqual(set(selections['good']['tag_ids']), self.get_tag_ids('one'))
+        self.assertEqual(set(selections['bad']['tag_ids']), self.get_tag_ids('two'))
+
+        self.user.mark_tags(['one'], reason = 'good', action = 'remove')
+        selections = self.user.get_resolved_tag_selections()
+        self.assertEqual(selections['good']['tag_ids'], [])
+
+    def test_wildcards_are_expanded(self):
+        self.user.mark_tags(wildcards = ['t*'], reason = 'good', action = 'add')
+        selections = self.user.get_resolved_tag_selections()
+        self.assertEqual(set(selections['good']['tag_ids']), self.get_tag_ids('two', 'three'))
+
+    def test_new_tag_matching_wildcard_is_added(self):
+        self.user.mark_tags(wildcards = ['t*'], reason = 'bad', action = 'add')
+        self.user.get_resolved_tag_selections()
+        self.post_question(tags = 'ten')
+        selections = self.user.get_resolved_tag_selections()
+        self.assertEqual(
+            set(selections['bad']['tag_ids']),
+            self.get_tag_ids('two', 'three', 'ten')
+        )
+
+    def test_listing_uses_resolved_selections(self):
+        self.post_question(title = 'other question', tags = 'ten')
+        self.user.display_tag_filter_strategy = const.EXCLUDE_IGNORED
+        self.user.save()
+        self.user.mark_tags(wildcards = ['t*'], reason = 'bad', action = 'add')
+        from askbot.search.state_manager import SearchState
+        threads, meta_data = models.Thread.objects.run_advanced_search(
+                                request_user = self.user,
+                                search_state = SearchState.get_empty()
+                            )
+        self.assertEqual(list(threads), [])
+        self.assertEqual(meta_data['ignored_tag_names'], ['t*'])
+
+class WildcardSelectionIndexTests(AskbotTestCase):
+    def setUp(self):
+        self.create_user()
+        self.create_user(username = 'user2')
+        self.old_cache = cache.cache
+        cache.cache = LocMemCache('', {})
+        cache.cache.clear()
+
+    def tearDown(self):
+        cache.cache.clear()
+        cache.cache = self.old_cache
+
+    def test_trie_matches_tag_prefixes(self):
+        trie = WildcardTrie()
+        trie.add('da*', 1)
+        trie.add('day*', 2)
+        trie.add('x*', 3)
+        self.assertEqual(trie.get_matching_keys(['day']), set([1, 2]))
+        self.assertEqual(trie.get_matching_keys(['dab', 'xyz']), set([1, 3]))
+        self.assertEqual(trie.get_matching_keys(['d', 'y']), set())
+        trie.remove('day*', 2)
+        self.assertEqual(trie.get_matching_keys(['day']), set([1]))
+        trie.remove('da*', 1)
+        trie.remove('x*', 3)
+        self.assertEqual(trie.root, {})
+
+    def test_index_follows_wildcard_edits(self):
+        index = WildcardSelectionIndex()
+        self.user.mark_tags(wildcards = ['da*'], reason = 'good', action = 'add')
+        self.assertEqual(
+            index.get_matching_user_ids(['day'], 'good'),
+            set([self.user.id])
+        )
+        #changes are replayed from the cache without a rebuild
+        def fail_rebuild(version):
+            self.fail('index must not be rebuilt')
+        index.rebuild = fail_rebuild
+        self.user.mark_tags(wildcards = ['da*'], reason = 'bad', action = 'add')
+        self.user2.mark_tags(wildcards = ['d*'], reason = 'good', action = 'add')
+        self.assertEqual(
+            index.get_matching_user_ids(['day'], 'good'),
+            set([self.user2.id])
+        )
+        self.assertEqual(
+            index.get_matching_user_ids(['day', 'night'], 'bad'),
+            set([self.user.id])
+        )
+        self.assertEqual(index.get_matching_user_ids(['night'], 'bad'), set())
+
+    def test_index_is_not_used_without_shared_cache(self):
+        cache.cache = DummyCache('', {})
+        index = WildcardSelectionIndex()
+        def fail_rebuild(version):
+            self.fail('index must not be built')
+        index.rebuild = fail_rebuild
+        self.user.mark_tags(wildcards = ['da*'], reason = 'good', action = 'add')
+        self.assertEqual(
+            index.get_matching_user_ids(['day'], 'good'),
+            set([self.user.id])
+        )
+        self.user2.mark_tags(wildcards = ['d*'], reason = 'good', action = 'add')
+        self.assertEqual(
+            index.get_matching_user_ids(['day', 'night'], 'good'),
+            set([self.user.id, self.user2.id])
+        )
+        self.assertEqual(index.get_matching_user_ids(['night'], 'bad'), set())
+
 class GlobalTagSubscriberGetterTests(AskbotTestCase):
     """tests for the :meth:`~askbot.models.Question.get_global_tag_based_subscribers`
     """
@@ -367,6 +491,34 @@ class GlobalTagSubscriberGetterTests(AskbotTestCase):
             reason = 'bad'
         )
 
+    def test_global_subscribers_without_tag_filter(self):
+        """only users with the instant subscription to the
+        entire forum get emails on all tags"""
+        self.create_user(
+            username = 'user3',
+            notification_schedule = {'q_all': 'd'}
+        )
+        for user in (self.u1, self.u2, self.user3):
+            user.email_tag_filter_strategy = const.INCLUDE_ALL
+            user.save()
+        self.assertEquals(
+            self.question.get_global_instant_notification_subscribers(),
+            set([self.u1, self.u2])
+        )
+
+    def test_subscriptions_follow_tag_filter_strategy(self):
+        self.set_email_tag_filter_strategy(const.INCLUDE_INTERESTING)
+        subscriber_ids = models.EmailFeedSetting.objects.get_subscriber_ids(
+            feed_type = 'q_all',
+            frequency = 'i',
+            tag_filter_strategy = const.INCLUDE_INTERESTING
+        )
+        self.assertEquals(set(subscriber_ids), set([self.u1.id, self.u2.id]))
+        strategies = models.EmailFeedSetting.objects.filter(
+                            subscriber = self.u1
+                        ).values_list('tag_filter_strategy', flat = True)
+        self.assertEquals(set(strategies), set([const.INCLUDE_INTERESTING]))
+
 class CommentTests(AskbotTestCase):
     """unfortunately, not very useful tests,
     as assertions of type "user can" are not inside
@@ -399,6 +551,83 @@ class CommentTests(AskbotTestCase):
         comment = models.Post.objects.get_comments().get(id = self.comment.id)
         self.assertEquals(comment.score, 0)
 
+class VoteTests(AskbotTestCase):
+    def setUp(self):
+        self.create_user()
+        self.voters = [
+            self.create_user(username = 'voter%d' % voter_no)
+            for voter_no in range(3)
+        ]
+        self.question = self.post_question()
+        self.initial_reputation = self.reload_object(self.user).reputation
+
+    def test_votes_on_stale_post_objects_add_up(self):
+        #each voter works with own copy of the question
+        for voter in self.voters:
+            question = models.Post.objects.get(id = self.question.id)
+            voter.upvote(question)
+        question = self.reload_object(self.question)
+        self.assertEquals(question.score, 3)
+        self.assertEquals(question.vote_up_count, 3)
+        self.assertEquals(question.thread.score, 3)
+
+        question = models.Post.objects.get(id = self.question.id)
+        self.voters[0].upvote(question, cancel = True)
+        question = self.reload_object(self.question)
+        self.assertEquals(question.score, 2)
+        self.assertEquals(question.vote_up_count, 2)
+        self.assertEquals(question.thread.score, 2)
+
+    def test_cancelled_vote_does_not_make_vote_count_negative(self):
+        self.voters[0].upvote(self.question)
+        #simulate a vote count that went out of sync with the votes
+        models.Post.objects.filter(id = self.question.id).update(vote_up_count = 0)
+        question = models.Post.objects.get(id = self.question.id)
+        self.voters[0].upvote(question, cancel = True)
+        self.assertEquals(question.vote_up_count, 0)
+        question = self.reload_object(self.question)
+        self.assertEquals(question.score, 0)
+        self.assertEquals(question.vote_up_count, 0)
+        self.assertEquals(question.thread.score, 0)
+
+    def test_daily_upvote_reputation_counter(self):
+        gain = askbot_settings.REP_GAIN_FOR_RECEIVING_UPVOTE
+        max_gain = askbot_settings.MAX_REP_GAIN_PER_USER_PER_DAY
+        askbot_settings.update('MAX_REP_GAIN_PER_USER_PER_DAY', 2 * gain)
+        try:
+            for voter in self.voters:
+                voter.upvote(self.question)
+        finally:
+            askbot_settings.update('MAX_REP_GAIN_PER_USER_PER_DAY', max_gain)
+
+        author = self.reload_object(self.user)
+        self.assertEquals(author.reputation, self.initial_reputation + 2 * gain)
+        self.assertEquals(author.upvoted_reputation_today, 2 * gain)
+        self.assertEquals(author.upvoted_reputation_date, datetime.date.today())
+        self.assertEquals(
+            author.upvoted_reputation_today,
+            models.Repute.objects.get_reputation_by_upvoted_today(author)
+        )
+
+        self.voters[0].upvote(self.question, cancel = True)
+        author = self.reload_object(self.user)
+        loss = askbot_settings.REP_LOSS_FOR_RECEIVING_UPVOTE_CANCELATION
+        self.assertEquals(author.upvoted_reputation_today, 2 * gain + loss)
+        self.assertEquals(
+            author.reputation, self.initial_reputation + 2 * gain + loss
+        )
+
+    def test_daily_counter_restarts_on_a_new_day(self):
+        self.user.upvoted_reputation_today = 1000
+        self.user.upvoted_reputation_date = \
+            datetime.date.today() - datetime.timedelta(1)
+        self.user.save()
+        self.voters[0].upvote(self.question)
+        author = self.reload_object(self.user)
+        gain = askbot_settings.REP_GAIN_FOR_RECEIVING_UPVOTE
+        self.assertEquals(author.upvoted_reputation_today, gain)
+        self.assertEquals(author.reputation, self.initial_reputation + gain)
+
 class TagAndGroupTests(AskbotTestCase):
     def setUp(self):
         self.u1 = self.create_user('u1')
@@ -409,3 +638,56 @@ class TagAndGroupTests(AskbotTestCase):
         tag_one = models.Tag.objects.filter(name__iexact = 'one')
         self.assertEqual(tag_one.count(), 1)
         self.assertEqual(tag_one[0].name, 'one')
+
+class KeysetPaginatorTests(AskbotTestCase):
+    def setUp(self):
+        self.create_user()
+        timestamp = datetime.datetime(2012, 1, 1)
+        for idx in range(7):
+            self.post_question(
+                title = 'question number %d' % idx,
+                timestamp = timestamp + datetime.timedelta(hours = idx)
+            )
+        #two threads with equal timestamps to test the tie breaker
+        self.post_question(title = 'tie one', timestamp = timestamp)
+
+    def get_titles(self, page):
+        return [thread.title for thread in page.object_list]
+
+    def test_pages_match_offset_pagination(self):
+        from askbot.search.keyset_paginator import KeysetPaginator
+        from django.core.paginator import Paginator
+        for order_by in ('-added_at', 'added_at', '-score', 'answer_count'):
+            qs = models.Thread.objects.all().order_by(order_by, order_by[0] == '-' and '-id' or 'id')
+            expected = Paginator(qs, 3)
+            paginator = KeysetPaginator(models.Thread.objects.all(), order_by, 3)
+            page = paginator.page(1)
+            cursors = [None]
+            for number in range(1, expected.num_pages + 1):
+                expected_titles = [t.title for t in expected.page(number).object_list]
+                self.assertEqual(self.get_titles(page), expected_titles)
+                self.assertEqual(page.has_next(), number < expected.num_pages)
+                if page.has_next():
+                    cursors.append(page.next_cursor)
+                    page = paginator.page(number + 1, page.next_cursor)
+            #walk back from the last page
+            for number in range(expected.num_pages - 1, 0, -1):
+                page = paginator.page(number, page.previous_cursor)
+                expected_titles = [t.title for t in expected.page(number).object_list]
+                self.assertEqual(self.get_titles(page), expected_titles)
+            self.assertFalse(page.has_previous())
+
+    def test_invalid_cursor_restarts_listing(self):
+        from askbot.search.keyset_paginator import KeysetPaginator
+        paginator = KeysetPaginator(models.Thread.objects.all(), '-added_at', 3)
+        next_cursor = paginator.page(1).next_cursor
+        other_paginator = KeysetPaginator(models.Thread.objects.all(), 'added_at', 3)
+        self.assertEqual(
+            self.get_titles(other_paginator.page(1, next_cursor)),
+            self.get_titles(other_paginator.page(1))
+        )
+        self.assertEqual(
+            self.get_titles(paginator.page(1, 'garbage!')),
+            self.get_titles(paginator.page(1))
+        )
+        self.assertEqual(paginator.count, 8)
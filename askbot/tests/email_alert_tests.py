@@ -5,15 +5,20 @@ import time
 from django.conf import settings as django_settings
 from django.core import management
 from django.core import serializers
+from django.core import cache
 import django.core.mail
+import django.core.mail.backends.locmem
 from django.core.urlresolvers import reverse
 from django.test import TestCase
 from django.test.client import Client
 from askbot.tests import utils
 from askbot import models
 from askbot import mail
+from askbot.mail import reminders
+from askbot.mail import render_cache
 from askbot.conf import settings as askbot_settings
 from askbot import const
+from askbot import exceptions
 from askbot.models.question import Thread
 
 TO_JSON = functools.partial(serializers.serialize, 'json')
@@ -909,6 +914,32 @@ class UnansweredReminderTests(EmailReminderTestCase):
         self.do_post(timestamp)
         self.assert_have_emails(0)
 
+    def test_reminder_recorded_for_user_chunks(self):
+        """users are processed in chunks, each reminder
+        is recorded once and is not repeated before the
+        recurrence delay passes"""
+        self.create_user(username = 'user3')
+        old_chunk_size = reminders.USER_CHUNK_SIZE
+        reminders.USER_CHUNK_SIZE = 1
+        try:
+            days_ago = self.wait_days
+            timestamp = datetime.datetime.now() - datetime.timedelta(days_ago, 3600)
+            self.do_post(timestamp)
+            self.assert_have_emails(2)
+            self.assert_have_emails(2)
+        finally:
+            reminders.USER_CHUNK_SIZE = old_chunk_size
+        activities = models.Activity.objects.filter(
+                activity_type = const.TYPE_ACTIVITY_UNANSWERED_REMINDER_SENT
+            )
+        self.assertEqual(
+            set(activities.values_list('user__username', flat = True)),
+            set(['user2', 'user3'])
+        )
+        for activity in activities:
+            self.assertEqual(activity.question, self.question)
+            self.assertEqual(activity.content_object, self.question)
+
 class EmailFeedSettingTests(utils.AskbotTestCase):
     def setUp(self):
         self.user = self.create_user('user')
@@ -1013,3 +1044,292 @@ class MailMessagesTests(utils.AskbotTestCase):
         user = self.create_user('user')
         message = messages.ask_for_signature(user, footer_code = 'nothing')
         self.assertTrue(user.username in message)
+
+
+class CountingEmailBackend(django.core.mail.backends.locmem.EmailBackend):
+    """stores messages in the outbox and counts the
+    opened connections, fails messages to the ``fail_recipients``
+    """
+    open_count = 0
+    fail_recipients = ()
+
+    def open(self):
+        CountingEmailBackend.open_count += 1
+        return True
+
+    def send_messages(self, messages):
+        for message in messages:
+            if set(message.recipients()) & set(self.fail_recipients):
+                raise Exception('recipient refused')
+        return super(CountingEmailBackend, self).send_messages(messages)
+
+
+class BatchEmailTests(utils.AskbotTestCase):
+    def setUp(self):
+        self.old_backend = django_settings.EMAIL_BACKEND
+        self.old_batch_size = mail.EMAIL_BATCH_SIZE
+        django_settings.EMAIL_BACKEND = \
+            'askbot.tests.email_alert_tests.CountingEmailBackend'
+        CountingEmailBackend.open_count = 0
+        CountingEmailBackend.fail_recipients = ()
+        mail.EMAIL_BATCH_SIZE = 2
+
+    def tearDown(self):
+        django_settings.EMAIL_BACKEND = self.old_backend
+        mail.EMAIL_BATCH_SIZE = self.old_batch_size
+        #thread data cached here is stale once the ids are reused
+        cache.cache.clear()
+
+    def make_messages(self, count):
+        return [
+            mail.make_message(
+                subject_line = 'subject',
+                body_text = 'text',
+                recipient_list = ['user%d@example.com' % number]
+            )
+            for number in range(count)
+        ]
+
+    def test_send_mail_batch_opens_connection_per_batch(self):
+        sent, failed = mail.send_mail_batch(iter(self.make_messages(5)))
+        self.assertEqual((sent, failed), (5, 0))
+        self.assertEqual(CountingEmailBackend.open_count, 3)
+        self.assertEqual(len(django.core.mail.outbox), 5)
+
+    def test_send_mail_batch_continues_after_failure(self):
+        CountingEmailBackend.fail_recipients = ('user1@example.com',)
+        sent, failed = mail.send_mail_batch(self.make_messages(4))
+        self.assertEqual((sent, failed), (3, 1))
+        recipients = [msg.recipients()[0] for msg in django.core.mail.outbox]
+        self.assertFalse('user1@example.com' in recipients)
+        self.assertEqual(len(recipients), 3)
+
+    def test_instant_notifications_are_sent_in_batches(self):
+        subscribers = [
+            self.create_user(
+                username = 'subscriber%d' % number,
+                notification_schedule = {'q_all': 'i'}
+            )
+            for number in range(5)
+        ]
+        author = self.create_user('author', status = 'm')
+        question = self.post_question(user = author)
+        outbox = django.core.mail.outbox
+        recipients = set([msg.recipients()[0] for msg in outbox])
+        self.assertEqual(recipients, set([user.email for user in subscribers]))
+        self.assertEqual(CountingEmailBackend.open_count, 3)
+        #per-user parts of the otherwise shared message
+        for message in outbox:
+            self.assertTrue(question.thread.title in message.subject)
+            self.assertTrue('Reply-To' in message.extra_headers)
+            username = message.recipients()[0].split('@')[0]
+            self.assertTrue(username in message.body)
+
+
+class EmailAlertDryRunTests(utils.AskbotTestCase):
+    def setUp(self):
+        timestamp = datetime.datetime.now() - datetime.timedelta(14)
+        schedule = copy.deepcopy(models.EmailFeedSetting.NO_EMAIL_SCHEDULE)
+        schedule['q_ask'] = 'w'
+        self.create_user(
+            'target',
+            notification_schedule = schedule,
+            date_joined = timestamp
+        )
+        self.create_user('other', date_joined = timestamp, status = 'm')
+        question = self.target.post_question(
+                            title = 'test question title',
+                            body_text = 'test question body',
+                            tags = 'test',
+                            timestamp = timestamp
+                        )
+        self.other.post_answer(
+                            question = question,
+                            body_text = 'test answer body',
+                            timestamp = timestamp
+                        )
+
+    def get_reported_at(self):
+        return models.EmailFeedSetting.objects.get(
+                                    subscriber = self.target,
+                                    feed_type = 'q_ask'
+                                ).reported_at
+
+    def test_dry_run_does_not_send_or_save(self):
+        reported_at = self.get_reported_at()
+        management.call_command('send_email_alerts', dry_run = True)
+        self.assertEqual(len(django.core.mail.outbox), 0)
+        self.assertEqual(self.get_reported_at(), reported_at)
+        email_activities = models.Activity.objects.filter(
+                    activity_type = const.TYPE_ACTIVITY_EMAIL_UPDATE_SENT
+                )
+        self.assertEqual(email_activities.count(), 0)
+
+        management.call_command('send_email_alerts')
+        outbox = django.core.mail.outbox
+        self.assertEqual(len(outbox), 1)
+        self.assertEqual(outbox[0].recipients(), [self.target.email])
+        self.assertNotEqual(self.get_reported_at(), reported_at)
+        self.assertEqual(email_activities.count(), 1)
+
+        #nothing new to report
+        management.call_command('send_email_alerts')
+        self.assertEqual(len(django.core.mail.outbox), 1)
+
+
+class MailRenderCacheTests(utils.AskbotTestCase):
+    def setUp(self):
+        self.u1 = self.create_user('user1')
+        self.question = self.post_question(user = self.u1)
+        render_cache.STATS.reset()
+
+    def tearDown(self):
+        #rendered posts are stale once the ids are reused
+        cache.cache.clear()
+
+    def test_post_is_rendered_once_until_edited(self):
+        html = self.question.format_for_email()
+        self.assertEqual(self.question.format_for_email(), html)
+        self.assertEqual(
+            (render_cache.STATS.hits, render_cache.STATS.misses),
+            (1, 1)
+        )
+        #other formatting is cached separately
+        self.question.format_for_email(quote_level = 1)
+        self.assertEqual(render_cache.STATS.misses, 2)
+
+        self.u1.edit_question(
+            question = self.question,
+            title = self.question.thread.title,
+            body_text = 'edited question body text',
+            tags = self.question.thread.tagnames
+        )
+        question = models.Post.objects.get(id = self.question.id)
+        edited_html = question.format_for_email()
+        self.assertEqual(render_cache.STATS.misses, 3)
+        self.assertTrue('edited question body text' in edited_html)
+
+    def test_thread_is_rendered_again_after_comment(self):
+        thread = self.question.thread
+        thread.format_for_email()
+        thread.format_for_email()
+        self.assertEqual(render_cache.STATS.hits, 1)
+
+        self.post_comment(
+            parent_post = self.question,
+            user = self.u1,
+            body_text = 'a comment to the question'
+        )
+        thread = models.Thread.objects.get(id = thread.id)
+        self.assertTrue('a comment to the question' in thread.format_for_email())
+        self.assertEqual(render_cache.STATS.hits, 1)
+
+    def test_stats_of_one_sending(self):
+        self.question.format_for_email()
+        stats = render_cache.STATS.copy()
+        self.question.format_for_email()
+        self.question.format_for_email()
+        sending_stats = render_cache.STATS.since(stats)
+        self.assertEqual((sending_stats.hits, sending_stats.misses), (2, 0))
+        self.assertEqual(str(sending_stats), '2 hits, 0 misses, 100% hit rate')
+        self.assertEqual(
+            (render_cache.STATS.hits, render_cache.STATS.misses),
+            (2, 1)
+        )
+
+
+class EmailQueueTests(utils.AskbotTestCase):
+    def setUp(self):
+        self.old_backend = django_settings.EMAIL_BACKEND
+        django_settings.EMAIL_BACKEND = \
+            'askbot.tests.email_alert_tests.CountingEmailBackend'
+        CountingEmailBackend.fail_recipients = ()
+        self.old_always_eager = getattr(
+            django_settings, 'ASKBOT_EMAIL_QUEUE_ALWAYS_EAGER', False
+        )
+        django_settings.ASKBOT_EMAIL_QUEUE_ALWAYS_EAGER = False
+
+    def tearDown(self):
+        django_settings.EMAIL_BACKEND = self.old_backend
+        django_settings.ASKBOT_EMAIL_QUEUE_ALWAYS_EAGER = self.old_always_eager
+
+    def send_mail(self, recipient):
+        mail.send_mail(
+            subject_line = 'subject',
+            body_text = 'text',
+            recipient_list = [recipient]
+        )
+
+    def test_send_mail_adds_message_to_queue(self):
+        self.send_mail('user@example.com')
+        self.assertEqual(len(django.core.mail.outbox), 0)
+        self.assertEqual(models.QueuedEmail.objects.count(), 1)
+
+        management.call_command('send_queued_email')
+        outbox = django.core.mail.outbox
+        self.assertEqual(len(outbox), 1)
+        self.assertEqual(outbox[0].recipients(), ['user@example.com'])
+        self.assertTrue('subject' in outbox[0].subject)
+        self.assertEqual(models.QueuedEmail.objects.count(), 0)
+
+    def test_failed_message_is_retried_then_dead(self):
+        CountingEmailBackend.fail_recipients = ('user@example.com',)
+        self.send_mail('user@example.com')
+        self.send_mail('other@example.com')
+
+        management.call_command('send_queued_email', max_attempts = 2)
+        self.assertEqual(len(django.core.mail.outbox), 1)
+        item = models.QueuedEmail.objects.get()
+        self.assertEqual(item.attempt_count, 1)
+        self.assertEqual(item.status, models.QueuedEmail.STATUS_QUEUED)
+        self.assertTrue(item.next_attempt_at > datetime.datetime.now())
+        self.assertTrue('recipient refused' in item.last_error)
+
+        #retry is not due yet
+        management.call_command('send_queued_email', max_attempts = 2)
+        self.assertEqual(models.QueuedEmail.objects.get().attempt_count, 1)
+
+        models.QueuedEmail.objects.update(
+                        next_attempt_at = datetime.datetime.now()
+                    )
+        management.call_command('send_queued_email', max_attempts = 2)
+        item = models.QueuedEmail.objects.get()
+        self.assertEqual(item.attempt_count, 2)
+        self.assertEqual(item.status, models.QueuedEmail.STATUS_DEAD)
+
+        CountingEmailBackend.fail_recipients = ()
+        management.call_command('send_queued_email', retry_dead = True)
+        self.assertEqual(len(django.core.mail.outbox), 2)
+        self.assertEqual(models.QueuedEmail.objects.count(), 0)
+
+    def test_domain_rate_limit_postpones_messages(self):
+        for number in range(3):
+            self.send_mail('user%d@example.com' % number)
+        self.send_mail('user@example.org')
+        management.call_command('send_queued_email', domain_rate = 2)
+        recipients = [msg.recipients()[0] for msg in django.core.mail.outbox]
+        self.assertEqual(len(recipients), 3)
+        self.assertTrue('user@example.org' in recipients)
+        item = models.QueuedEmail.objects.get()
+        self.assertEqual(item.recipient_domain, 'example.com')
+        self.assertEqual(item.attempt_count, 0)
+        self.assertTrue(item.next_attempt_at > datetime.datetime.now())
+
+    def test_mail_moderators_failure(self):
+        self.create_user(
+                    'moderator',
+                    email = 'moderator@example.com',
+                    status = 'm'
+                )
+        CountingEmailBackend.fail_recipients = ('moderator@example.com',)
+        self.assertRaises(
+            exceptions.EmailNotSent,
+            mail.mail_moderators,
+            'subject', 'text', raise_on_failure = True
+        )
+        self.assertEqual(len(django.core.mail.outbox), 0)
+
+    def test_retry_delay_grows_exponentially(self):
+        from askbot.mail.queue import get_retry_delay
+        delays = [get_retry_delay(count, 60, 1000) for count in range(1, 7)]
+        self.assertEqual(delays, [60, 120, 240, 480, 960, 1000])
@@ -49,3 +49,25 @@ class ManagementCommandTests(AskbotTestCase):
         user_two = models.User.objects.get(pk=2)
         self.assertEqual(user_two.gold, number_of_gold) 
         self.assertEqual(user_two.reputation, reputation)
+
+    def test_fix_thread_question_posts(self):
+        user = self.create_user()
+        question = self.post_question(user=user)
+        user.delete_question(question)
+        #simulate threads created before the denormalization
+        models.Thread.objects.update(question_post=None, question_deleted=False)
+        management.call_command('fix_thread_question_posts')
+        thread = models.Thread.objects.get(id=question.thread_id)
+        self.assertEqual(thread.question_post_id, question.id)
+        self.assertTrue(thread.question_deleted)
+
+    def test_fix_thread_question_posts_hides_thread_without_question(self):
+        user = self.create_user()
+        question = self.post_question(user=user)
+        thread_id = question.thread_id
+        question.delete()
+        models.Thread.objects.update(question_deleted=False)
+        management.call_command('fix_thread_question_posts')
+        thread = models.Thread.objects.get(id=thread_id)
+        self.assertEqual(thread.question_post_id, None)
+        self.assertTrue(thread.question_deleted)
@@ -13,6 +13,7 @@ from django.test import TestCase
 from askbot import models
 from askbot import const
 from askbot.tests.utils import create_user
+from askbot.tests.utils import AskbotTestCase
 
 
 def get_re_notif_after(timestamp):
@@ -622,3 +623,76 @@ class OnScreenUpdateNotificationTests(TestCase):
         )
 
 
+
+
+class BulkResponseBookkeepingTests(AskbotTestCase):
+    """recipients of the activity are recorded and their
+    response counts are updated with a fixed number of queries
+    """
+
+    def setUp(self):
+        self.author = self.create_user('author')
+        self.followers = [
+            self.create_user('follower%d' % number) for number in range(10)
+        ]
+        self.question = self.post_question(user = self.author)
+
+    def create_activity(self, activity_type):
+        activity = models.Activity(
+                        user = self.author,
+                        content_object = self.question,
+                        activity_type = activity_type,
+                        question = self.question
+                    )
+        activity.save()
+        return activity
+
+    def test_add_recipients_uses_one_query(self):
+        activity = self.create_activity(const.TYPE_ACTIVITY_ANSWER)
+        self.assertNumQueries(1, activity.add_recipients, self.followers)
+        self.assertEqual(
+            set(activity.recipients.all()),
+            set(self.followers)
+        )
+
+    def test_update_new_response_counts(self):
+        answer_activity = self.create_activity(const.TYPE_ACTIVITY_ANSWER)
+        answer_activity.add_recipients(self.followers)
+        mention = self.create_activity(const.TYPE_ACTIVITY_MENTION)
+        models.ActivityAuditStatus.objects.create_many(
+            [(mention, self.followers[0])]
+        )
+        #seen responses and other activity types are not counted
+        models.ActivityAuditStatus.objects.filter(
+            user = self.followers[1]
+        ).update(status = models.ActivityAuditStatus.STATUS_SEEN)
+        favorite = self.create_activity(const.TYPE_ACTIVITY_FAVORITE)
+        favorite.add_recipients(self.followers)
+
+        user_ids = [user.id for user in self.followers]
+        self.assertNumQueries(1, models.update_new_response_counts, user_ids)
+
+        counts = dict(
+            models.User.objects.filter(
+                id__in = user_ids
+            ).values_list('id', 'new_response_count')
+        )
+        expected = dict([(user_id, 1) for user_id in user_ids])
+        expected[self.followers[0].id] = 2
+        expected[self.followers[1].id] = 0
+        self.assertEqual(counts, expected)
+
+        #more ids than the query parameters allowed in sqlite
+        models.User.objects.filter(
+            id__in = user_ids
+        ).update(new_response_count = 0)
+        many_user_ids = range(10**6, 10**6 + 1200) + user_ids
+        self.assertNumQueries(
+            3, models.update_new_response_counts, many_user_ids
+        )
+        counts = dict(
+            models.User.objects.filter(
+                id__in = user_ids
+            ).values_list('id', 'new_response_count')
+        )
+        self.assertEqual(counts, expected)
@@ -146,6 +146,34 @@ class PageLoadTestCase(AskbotTestCase):
         )
         askbot_settings.update('ALLOW_POSTING_BEFORE_LOGGING_IN', prev_setting)
 
+    def test_questions_keyset_pagination(self):
+        askbot_settings.update('QUESTIONS_LIST_KEYSET_PAGINATION', True)
+        url = reverse('questions') + SearchState.get_empty().query_string()
+        thread_count = models.Thread.objects.filter(
+                                posts__post_type='question',
+                                posts__deleted=False
+                            ).count()
+        seen_ids = set()
+        page_number = 1
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            thread_ids = set([thread.id for thread in response.context['threads']])
+            self.assertTrue(0 < len(thread_ids) <= 30)
+            self.assertFalse(thread_ids & seen_ids)
+            seen_ids.update(thread_ids)
+            cursor = response.context['context']['next_cursor']
+            if cursor:
+                page_number += 1
+                url = reverse('questions') + SearchState.get_empty().change_page(
+                                                        page_number, cursor
+                                                    ).query_string()
+            else:
+                url = None
+        self.assertEqual(len(seen_ids), thread_count)
+        self.assertTrue(page_number > 1)
+        askbot_settings.update('QUESTIONS_LIST_KEYSET_PAGINATION', False)
+
     def test_ask_page_allowed_anonymous(self):
         self.proto_test_ask_page(True, 200)
 
@@ -4,15 +4,20 @@ from operator import attrgetter
 import time
 from askbot.search.state_manager import SearchState
 from askbot.skins.loaders import get_template
+from django.conf import settings as django_settings
 from django.contrib.auth.models import User
-from django.core import cache, urlresolvers
+from django.core import cache, management, urlresolvers
 from django.core.cache.backends.dummy import DummyCache
 from django.core.cache.backends.locmem import LocMemCache
 
 from django.core.exceptions import ValidationError
 from askbot.tests.utils import AskbotTestCase
-from askbot.models import Post, PostRevision, Thread, Tag
+from askbot.conf import settings as askbot_settings
+from askbot import const
+from askbot import tasks
+from askbot.models import Post, PostRevision, Thread, Tag, SearchPosting
 from askbot.search.state_manager import DummySearchState
+from askbot.search import result_cache
 from django.utils import simplejson
 
 
@@ -276,6 +281,40 @@ class ThreadTagModelsTests(AskbotTestCase):
         self.assertEqual(1, len(qs))
         self.assertEqual(self.q4.thread_id, qs[0].id)
 
+    def test_run_adv_search_skips_deleted_questions(self):
+        self.user.delete_question(self.q2)
+        ss = SearchState.get_empty()
+        qs, meta_data = Thread.objects.run_advanced_search(request_user=self.user, search_state=ss)
+        self.assertEqual(
+            set([self.q1.thread_id, self.q3.thread_id, self.q4.thread_id]),
+            set([thread.id for thread in qs])
+        )
+
+    def test_thread_question_post_denormalization(self):
+        thread = Thread.objects.get(id=self.q1.thread_id)
+        self.assertEqual(thread.question_post_id, self.q1.id)
+        self.assertFalse(thread.question_deleted)
+        self.assertEqual(thread.get_absolute_url(), self.q1.get_absolute_url())
+
+        self.user.delete_question(self.q1)
+        thread = Thread.objects.get(id=self.q1.thread_id)
+        self.assertTrue(thread.question_deleted)
+
+        self.user.restore_post(self.q1)
+        thread = Thread.objects.get(id=self.q1.thread_id)
+        self.assertFalse(thread.question_deleted)
+
+    def test_removed_question_post_keeps_thread_and_answers(self):
+        answerer = User.objects.get(username='user2')
+        answer = self.post_answer(user=answerer, question=self.q1)
+        thread_id = self.q1.thread_id
+        self.q1.delete()
+
+        thread = Thread.objects.get(id=thread_id)
+        self.assertEqual(thread.question_post_id, None)
+        self.assertTrue(thread.question_deleted)
+        self.assertEqual(Post.objects.filter(id=answer.id).count(), 1)
+
     def test_thread_caching_1(self):
         ss = SearchState.get_empty()
         qs, meta_data = Thread.objects.run_advanced_search(request_user=self.user, search_state=ss)
@@ -427,6 +466,162 @@ class ThreadRenderLowLevelCachingTests(AskbotTestCase):
             thread.get_summary_html(search_state=SearchState.get_empty())
         )
 
+    def test_precache_summary_html(self):
+        cache.cache = LocMemCache('', {})  # Enable local caching
+
+        q2 = self.post_question(tags='tag4')
+        q2.thread.update_summary_html()
+        cached_key = Thread.SUMMARY_CACHE_KEY_TPL % q2.thread_id
+        cache.cache.set(cached_key, 'Cached <<<tag4>>>', timeout=100)
+        missing_key = Thread.SUMMARY_CACHE_KEY_TPL % self.q.thread_id
+        cache.cache.delete(missing_key)
+
+        round_trips = {'get_many': 0, 'set_many': 0}
+        def count_calls(name):
+            method = getattr(cache.cache, name)
+            def counted_method(*args, **kwargs):
+                round_trips[name] += 1
+                return method(*args, **kwargs)
+            setattr(cache.cache, name, counted_method)
+        count_calls('get_many')
+        count_calls('set_many')
+
+        threads = list(Thread.objects.filter(id__in=[self.q.thread_id, q2.thread_id]))
+        Thread.objects.precache_summary_html(threads)
+        self.assertEqual(round_trips, {'get_many': 1, 'set_many': 1})
+
+        #missing summary is rendered and stored
+        self.assertTrue(cache.cache.has_key(missing_key))
+
+        cache.cache.get = None  # summaries must not be fetched one by one
+        ss = SearchState.get_empty()
+        html_map = dict(
+            (thread.id, thread.get_summary_html(search_state=ss))
+            for thread in threads
+        )
+        self.assertEqual(
+            'Cached %s' % ss.add_tag('tag4').full_url(),
+            html_map[q2.thread_id]
+        )
+        self.assertTrue(ss.add_tag('tag1').full_url() in html_map[self.q.thread_id])
+
+    def test_summary_html_updates_are_coalesced(self):
+        cache.cache = LocMemCache('', {})  # Enable local caching
+        thread = self.q.thread
+        key = Thread.SUMMARY_CACHE_KEY_TPL % thread.id
+        cache.cache.set(key, 'Stale <<<tag1>>>', timeout=100)
+
+        scheduled = list()
+        task = tasks.update_thread_summary_html_celery_task
+        old_apply_async = task.apply_async
+        task.apply_async = lambda args, countdown: scheduled.append((args, countdown))
+        old_delay = askbot_settings.SUMMARY_HTML_UPDATE_DELAY
+        askbot_settings.update('SUMMARY_HTML_UPDATE_DELAY', 60)
+        try:
+            thread.increase_view_count()
+            thread.invalidate_cached_data()
+            thread.schedule_summary_html_update()
+            #one update is scheduled and nothing is rendered right away
+            self.assertEqual(scheduled, [((thread.id,), 60)])
+            self.assertEqual('Stale <<<tag1>>>', thread.get_cached_summary_html())
+
+            task(thread.id)
+            self.assertFalse('Stale' in thread.get_cached_summary_html())
+
+            #changes after the update has run schedule a new one
+            thread.schedule_summary_html_update()
+            self.assertEqual(len(scheduled), 2)
+        finally:
+            task.apply_async = old_apply_async
+            #local memory caches share storage
+            cache.cache.delete(Thread.SUMMARY_UPDATE_SCHEDULED_KEY_TPL % thread.id)
+            askbot_settings.update('SUMMARY_HTML_UPDATE_DELAY', old_delay)
+
+    def test_pending_views_of_threads_are_saved_together(self):
+        cache.cache = LocMemCache('', {})  # Enable local caching
+        thread1 = self.q.thread
+        thread2 = self.post_question(tags='tag4').thread
+
+        scheduled = list()
+        task = tasks.save_pending_view_counts_celery_task
+        old_apply_async = task.apply_async
+        task.apply_async = lambda *args, **kwargs: scheduled.append(kwargs)
+        old_delay = askbot_settings.VIEW_COUNT_UPDATE_DELAY
+        askbot_settings.update('VIEW_COUNT_UPDATE_DELAY', 60)
+        try:
+            thread1.increase_view_count()
+            thread2.increase_view_count()
+            thread2.increase_view_count()
+            #one save of all viewed threads is scheduled
+            self.assertEqual(scheduled, [{'countdown': 60}])
+            self.assertEqual(Thread.objects.get(id=thread2.id).view_count, 0)
+
+            task()
+            self.assertEqual(Thread.objects.get(id=thread1.id).view_count, 1)
+            self.assertEqual(Thread.objects.get(id=thread2.id).view_count, 2)
+            self.assertEqual(Thread.objects.get(id=thread2.id).get_view_count(), 2)
+
+            #views after the save schedule the next one
+            thread2.increase_view_count()
+            self.assertEqual(len(scheduled), 2)
+            task()
+            self.assertEqual(Thread.objects.get(id=thread1.id).view_count, 1)
+            self.assertEqual(Thread.objects.get(id=thread2.id).view_count, 3)
+        finally:
+            task.apply_async = old_apply_async
+            askbot_settings.update('VIEW_COUNT_UPDATE_DELAY', old_delay)
+
+    def test_lost_mark_of_pending_views_is_recovered(self):
+        cache.cache = LocMemCache('', {})  # Enable local caching
+        thread = self.q.thread
+        task = tasks.save_pending_view_counts_celery_task
+        old_apply_async = task.apply_async
+        task.apply_async = lambda *args, **kwargs: None
+        old_delay = askbot_settings.VIEW_COUNT_UPDATE_DELAY
+        askbot_settings.update('VIEW_COUNT_UPDATE_DELAY', 60)
+        try:
+            thread.increase_view_count()
+            #the save task has read the sequence before the thread id
+            #was written, so the thread is not saved this time
+            pending_views = Thread.PENDING_VIEWS
+            seq = cache.cache.get(pending_views.seq_key)
+            cache.cache.delete(pending_views.item_key_tpl % seq)
+            task()
+            self.assertEqual(Thread.objects.get(id=thread.id).view_count, 0)
+
+            #once the marked flag expires, the next view marks the thread
+            cache.cache.delete(pending_views.marked_key_tpl % thread.id)
+            thread.increase_view_count()
+            task()
+            self.assertEqual(Thread.objects.get(id=thread.id).view_count, 2)
+
+            #saved threads are marked by the next view
+            thread.increase_view_count()
+            task()
+            self.assertEqual(Thread.objects.get(id=thread.id).view_count, 3)
+        finally:
+            task.apply_async = old_apply_async
+            askbot_settings.update('VIEW_COUNT_UPDATE_DELAY', old_delay)
+
+    def test_views_are_saved_right_away_without_shared_cache(self):
+        thread = self.q.thread
+        old_delay = askbot_settings.VIEW_COUNT_UPDATE_DELAY
+        askbot_settings.update('VIEW_COUNT_UPDATE_DELAY', 60)
+        old_eager = getattr(django_settings, 'CELERY_ALWAYS_EAGER', False)
+        try:
+            cache.cache = DummyCache('', {})
+            thread.increase_view_count()
+            self.assertEqual(Thread.objects.get(id=thread.id).view_count, 1)
+
+            #the celery worker would not see the counter in memory of this process
+            cache.cache = LocMemCache('', {})
+            django_settings.CELERY_ALWAYS_EAGER = False
+            thread.increase_view_count()
+            self.assertEqual(Thread.objects.get(id=thread.id).view_count, 2)
+        finally:
+            django_settings.CELERY_ALWAYS_EAGER = old_eager
+            askbot_settings.update('VIEW_COUNT_UPDATE_DELAY', old_delay)
+
 
 
 class ThreadRenderCacheUpdateTests(AskbotTestCase):
@@ -670,6 +865,288 @@ class ThreadRenderCacheUpdateTests(AskbotTestCase):
         self.assertEqual(html, thread.get_cached_summary_html())
 
 
+class ThreadPostDataCacheTests(AskbotTestCase):
+    def setUp(self):
+        self.create_user()
+        self.create_user(username = 'user2')
+        self.create_user(username = 'user3')
+        self.question = self.post_question()
+        self.answer1 = self.post_answer(question = self.question)
+        self.answer2 = self.post_answer(question = self.question, user = self.user2)
+        self.old_cache = cache.cache
+        cache.cache = LocMemCache('', {})
+        cache.cache.clear()
+
+    def tearDown(self):
+        cache.cache.clear()
+        cache.cache = self.old_cache
+
+    def get_thread(self):
+        return Thread.objects.get(id = self.question.thread_id)
+
+    def precache_post_data(self):
+        thread = self.get_thread()
+        for sort_method in const.ANSWER_SORT_METHODS:
+            thread.get_cached_post_data(sort_method)
+
+    def assert_cached_post_data_is_current(self, rebuilt = False):
+        """compares cached post data with the freshly
+        calculated, ``rebuilt`` - whether the cached data
+        is expected to be missing"""
+        thread = self.get_thread()
+        for sort_method in const.ANSWER_SORT_METHODS:
+            key = thread.get_post_data_cache_key(sort_method)
+            cached_data = cache.cache.get(key)
+            if rebuilt:
+                self.assertEqual(cached_data, None)
+                continue
+            question, answers, post_to_author = cached_data
+            expected = thread.get_post_data(sort_method)
+            self.assertEqual(post_to_author, expected[2])
+            self.assertEqual(
+                [(answer.id, answer.score) for answer in answers],
+                [(answer.id, answer.score) for answer in expected[1]]
+            )
+            for cached, fresh in zip([question] + answers, [expected[0]] + expected[1]):
+                self.assertEqual(cached.text, fresh.text)
+                self.assertEqual(
+                    [comment.id for comment in cached.get_cached_comments()],
+                    [comment.id for comment in fresh.get_cached_comments()]
+                )
+
+    def test_vote_reorders_cached_answers(self):
+        self.precache_post_data()
+        self.user3.upvote(self.answer1)
+        self.assert_cached_post_data_is_current()
+        thread = self.get_thread()
+        question, answers, junk = thread.get_cached_post_data('votes')
+        self.assertEqual(answers[0].id, self.answer1.id)
+        self.assertEqual(answers[0].score, 1)
+
+    def test_new_posts_and_edits_are_added_to_cached_data(self):
+        self.precache_post_data()
+        self.post_comment(parent_post = self.answer2)
+        self.post_comment(parent_post = self.question)
+        self.post_answer(question = self.question, user = self.user3)
+        self.user.edit_answer(answer = self.answer1, body_text = 'edited answer text')
+        self.assert_cached_post_data_is_current()
+
+    def test_deleted_answer_rebuilds_cached_data(self):
+        self.precache_post_data()
+        self.user.delete_answer(self.answer1)
+        self.assert_cached_post_data_is_current(rebuilt = True)
+        self.precache_post_data()
+        self.assert_cached_post_data_is_current()
+
+    def test_concurrent_change_discards_cached_data(self):
+        self.precache_post_data()
+        thread = self.get_thread()
+        version = thread.get_post_data_version()
+        original_get_version = Thread.get_post_data_version
+        #another process changes the data right after
+        #the version stamp is read
+        def get_version(thread):
+            version = original_get_version(thread)
+            thread.increment_post_data_version()
+            return version
+        Thread.get_post_data_version = get_version
+        try:
+            self.post_comment(parent_post = self.answer1)
+        finally:
+            Thread.get_post_data_version = original_get_version
+        self.assertEqual(thread.get_post_data_version(), version + 2)
+        self.assert_cached_post_data_is_current(rebuilt = True)
+
+
+class SearchIndexTests(AskbotTestCase):
+    """tests of the built-in search index, used in the tests,
+    because they run on sqlite"""
+
+    def setUp(self):
+        self.user = self.create_user('user')
+        self.user2 = self.create_user('user2')
+        self.q1 = self.post_question(
+                        title = 'apple banana',
+                        body_text = 'cherry pie',
+                        tags = 'fruit'
+                    )
+        self.q2 = self.post_question(
+                        title = 'apple',
+                        body_text = 'plum jam',
+                        tags = 'fruit'
+                    )
+        self.answer = self.post_answer(
+                        user = self.user2,
+                        question = self.q2,
+                        body_text = 'Banana, banana!'
+                    )
+
+    def search(self, query):
+        threads = Thread.objects.get_for_query(query)
+        return [thread.id for thread in threads.extra(order_by = ['-relevance'])]
+
+    def test_search_matches_all_words(self):
+        self.assertEqual(
+            self.search('Apple banana'),
+            [self.q1.thread_id, self.q2.thread_id]
+        )
+        self.assertEqual(self.search('apple cherry'), [self.q1.thread_id])
+        self.assertEqual(self.search('apple kiwi'), [])
+        self.assertEqual(self.search('?!'), [])
+
+    def test_search_index_is_updated(self):
+        self.user.retag_question(question = self.q2, tags = 'cherry')
+        self.assertEqual(
+            set(self.search('apple cherry')),
+            set([self.q1.thread_id, self.q2.thread_id])
+        )
+        self.user2.delete_answer(self.answer)
+        self.assertEqual(self.search('banana'), [self.q1.thread_id])
+        self.user.edit_question(
+                        question = self.q1,
+                        title = 'orange',
+                        body_text = 'cherry pie'
+                    )
+        self.assertEqual(self.search('apple'), [self.q2.thread_id])
+
+    def test_search_index_is_updated_on_restore(self):
+        self.user2.delete_answer(self.answer)
+        self.assertEqual(self.search('banana'), [self.q1.thread_id])
+        self.user2.restore_post(self.answer)
+        self.assertEqual(
+            set(self.search('banana')),
+            set([self.q1.thread_id, self.q2.thread_id])
+        )
+
+    def test_search_index_is_updated_on_comment_delete(self):
+        comment = self.post_comment(
+                        user = self.user2,
+                        parent_post = self.answer,
+                        body_text = 'kiwi is better'
+                    )
+        self.assertEqual(self.search('kiwi'), [self.q2.thread_id])
+        self.user2.delete_comment(comment)
+        self.assertEqual(self.search('kiwi'), [])
+
+    def test_rebuild_search_index(self):
+        postings = set(SearchPosting.objects.values_list('term', 'thread', 'weight'))
+        SearchPosting.objects.all().delete()
+        management.call_command('rebuild_search_index')
+        self.assertEqual(
+            set(SearchPosting.objects.values_list('term', 'thread', 'weight')),
+            postings
+        )
+        self.assertEqual(
+            Post.objects.get_questions().get_by_text_query('plum').get().id,
+            self.q2.id
+        )
+
+
+class SearchResultCacheTests(AskbotTestCase):
+    def setUp(self):
+        self.create_user()
+        self.create_user(username = 'user2')
+        self.old_cache = cache.cache
+        cache.cache = LocMemCache('', {})
+        self.q1 = self.post_question(tags = 'tag1 tag2')
+        self.q2 = self.post_question(tags = 'tag1 tag3')
+        self.q3 = self.post_question(tags = 'tag3', user = self.user2)
+        self.q4 = self.post_question(tags = 'tag1 tag3 tag4', user = self.user2)
+        self.old_cache_pages = askbot_settings.SEARCH_RESULT_CACHE_PAGES
+        result_cache.reset_stats()
+
+    def tearDown(self):
+        askbot_settings.update('SEARCH_RESULT_CACHE_PAGES', self.old_cache_pages)
+        cache.cache.clear()
+        cache.cache = self.old_cache
+
+    def search(self, search_state, user = None, page_size = 10):
+        threads, meta_data = Thread.objects.run_cached_search(
+                                    request_user = user,
+                                    search_state = search_state,
+                                    page_size = page_size
+                                )
+        return [thread.id for thread in threads[:len(threads)]]
+
+    def advanced_search(self, search_state, user = None):
+        threads, meta_data = Thread.objects.run_advanced_search(
+                                    request_user = user,
+                                    search_state = search_state
+                                )
+        return [thread.id for thread in threads]
+
+    def test_equivalent_search_states_share_results(self):
+        ss = SearchState.get_empty()
+        thread_ids = self.search(ss.add_tag('tag1').add_tag('tag3'))
+        self.assertEqual(thread_ids, self.advanced_search(ss.add_tag('tag1').add_tag('tag3')))
+        self.assertEqual(len(thread_ids), 2)
+        self.assertEqual(self.search(ss.add_tag('tag3').add_tag('tag1')), thread_ids)
+        stats = result_cache.get_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['hit_ratio'], 0.5)
+
+        self.assertEqual(
+            ss.add_tag('tag1').add_tag('tag3').canonical_form(),
+            ss.add_tag('tag3').add_tag('tag1').canonical_form()
+        )
+        self.assertNotEqual(
+            ss.add_tag('tag1').canonical_form(),
+            ss.add_tag('tag3').canonical_form()
+        )
+
+    def test_new_post_makes_results_stale(self):
+        ss = SearchState.get_empty().add_tag('tag1')
+        self.assertEqual(len(self.search(ss)), 3)
+        q5 = self.post_question(tags = 'tag1')
+        self.assertEqual(self.search(ss), self.advanced_search(ss))
+        self.assertTrue(q5.thread_id in self.search(ss))
+        self.assertEqual(result_cache.get_stats()['misses'], 2)
+
+        self.user.retag_question(question = q5, tags = 'tag2')
+        self.assertFalse(q5.thread_id in self.search(ss))
+
+    def test_user_tag_filters_are_applied_to_cached_results(self):
+        ss = SearchState.get_empty()
+        self.search(ss)
+        self.user.display_tag_filter_strategy = const.EXCLUDE_IGNORED
+        self.user.save()
+        self.user.mark_tags(['tag3'], reason = 'bad', action = 'add')
+        self.assertEqual(self.search(ss, self.user), [self.q1.thread_id])
+        self.assertEqual(self.search(ss, self.user), self.advanced_search(ss, self.user))
+
+        self.user.display_tag_filter_strategy = const.INCLUDE_INTERESTING
+        self.user.save()
+        self.user.mark_tags(['tag4'], reason = 'good', action = 'add')
+        self.assertEqual(self.search(ss, self.user), [self.q4.thread_id])
+        self.assertEqual(self.search(ss, self.user), self.advanced_search(ss, self.user))
+        self.assertEqual(result_cache.get_stats()['hits'], 4)
+
+    def test_threads_beyond_cached_pages(self):
+        askbot_settings.update('SEARCH_RESULT_CACHE_PAGES', 1)
+        ss = SearchState.get_empty()
+        threads, meta_data = Thread.objects.run_cached_search(
+                                    request_user = None,
+                                    search_state = ss,
+                                    page_size = 2
+                                )
+        self.assertEqual(threads.count(), 4)
+        self.assertEqual(len(threads.thread_ids), 2)
+        self.assertEqual(
+            [thread.id for thread in threads[0:4]],
+            self.advanced_search(ss)
+        )
+        #the count of the threads passing the user filters is not known
+        self.user.mark_tags(['tag3'], reason = 'bad', action = 'add')
+        self.user.display_tag_filter_strategy = const.EXCLUDE_IGNORED
+        self.user.save()
+        threads, meta_data = Thread.objects.run_cached_search(
+                                    request_user = self.user,
+                                    search_state = ss,
+                                    page_size = 2
+                                )
+        self.assertEqual([thread.id for thread in threads], [self.q1.thread_id])
+
+
 # TODO: (in spare time - those cases should pass without changing anything in code but we should have them eventually for completness)
 # - Publishing anonymous questions / answers
 # - Re-posting question as answer and vice versa
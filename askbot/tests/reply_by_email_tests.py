@@ -1,7 +1,20 @@
+import datetime
+import mailbox
+import os
+import shutil
+import tempfile
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from StringIO import StringIO
+from django.conf import settings as django_settings
+from django.core import management
 from django.utils.translation import ugettext as _
 from askbot.models import ReplyAddress
-from askbot.mail.lamson_handlers import PROCESS, VALIDATE_EMAIL, get_parts
+from askbot.mail.lamson_handlers import ASK, PROCESS, VALIDATE_EMAIL, get_parts
+from askbot.mail import inbound
 from askbot import const
+from askbot.conf import settings as askbot_settings
 
 
 from askbot.tests.utils import AskbotTestCase
@@ -135,6 +148,41 @@ class ReplyAddressModelTests(AskbotTestCase):
         self.assertEquals(post.post_type, "answer")
         self.assertEquals(post.text, TEST_LONG_CONTENT)
 
+    def test_create_many_addresses(self):
+        addresses = ReplyAddress.objects.create_many([
+            {'post': self.question, 'user': self.u1, 'reply_action': 'post_answer'},
+            {'post': self.question, 'user': self.u1, 'reply_action': 'post_comment'}
+        ])
+        self.assertEqual(ReplyAddress.objects.count(), 2)
+        for address in addresses:
+            saved_address = ReplyAddress.objects.get_unused(
+                                    address.address, self.u1.email
+                                )
+            self.assertEqual(saved_address.reply_action, address.reply_action)
+
+    def test_expired_address_is_rejected(self):
+        reply_address = ReplyAddress.objects.create_new(
+                                        post = self.answer,
+                                        user = self.u1
+                                    )
+        lifetime = askbot_settings.REPLY_BY_EMAIL_ADDRESS_LIFETIME
+        ReplyAddress.objects.update(
+            added_at = datetime.datetime.now() - datetime.timedelta(lifetime + 1)
+        )
+        msg = MockMessage(TEST_CONTENT, 'user1@domain.com')
+        PROCESS(msg, address = reply_address.address)
+        self.assertEquals(self.answer.comments.count(), 1)
+
+        fresh_address = ReplyAddress.objects.create_new(
+                                        post = self.answer,
+                                        user = self.u1
+                                    )
+        management.call_command('delete_expired_reply_addresses')
+        self.assertEqual(
+            list(ReplyAddress.objects.values_list('address', flat = True)),
+            [fresh_address.address]
+        )
+
 class EmailSignatureDetectionTests(AskbotTestCase):
     
     def setUp(self):
@@ -186,3 +234,161 @@ class EmailSignatureDetectionTests(AskbotTestCase):
 
         signature = self.reload_object(self.u2).email_signature 
         self.assertEqual(signature, 'Yours Truly')
+
+
+def make_mime_message(body_text, attachment_data = None, to_address = None):
+    """returns text of a message with plain and html
+    alternatives of the body and an optional attachment"""
+    alternatives = MIMEMultipart('alternative')
+    alternatives.attach(MIMEText(body_text, 'plain', 'utf-8'))
+    alternatives.attach(MIMEText('<p>html version</p>', 'html'))
+    message = MIMEMultipart()
+    message.attach(alternatives)
+    if attachment_data is not None:
+        attachment = MIMEApplication(attachment_data)
+        attachment.add_header(
+            'Content-Disposition', 'attachment', filename = 'data.bin'
+        )
+        message.attach(attachment)
+    message['Subject'] = '=?utf-8?q?test_subject?='
+    message['From'] = 'User One <user1@domain.com>'
+    message['To'] = to_address or 'ask@example.com'
+    return message.as_string()
+
+
+class InboundMessageTests(AskbotTestCase):
+
+    def test_read_message_parts(self):
+        data = ''.join([chr(number % 256) for number in range(5000)])
+        text = make_mime_message('reply text\nsecond line', data)
+        message = inbound.read_message(StringIO(text))
+        self.assertEqual(message.From, 'user1@domain.com')
+        self.assertEqual(message['Subject'], 'test subject')
+        parts = get_parts(message)
+        self.assertEqual(
+            [part_type for part_type, content in parts],
+            ['body', 'attachment']
+        )
+        self.assertEqual(parts[0][1], u'reply text\nsecond line')
+        attachment = parts[1][1]
+        self.assertEqual(attachment.name, 'data.bin')
+        self.assertEqual(attachment.size, 5000)
+        self.assertEqual(''.join(attachment.chunks()), data)
+        message.close()
+
+    def test_large_attachment_is_left_out(self):
+        text = make_mime_message('reply text', 'x' * 5000)
+        message = inbound.read_message(
+                                StringIO(text),
+                                max_attachment_size = 1000
+                            )
+        self.assertEqual(message.parts, [('body', u'reply text')])
+
+    def test_large_message_is_rejected(self):
+        text = make_mime_message('reply text', 'x' * 5000)
+        self.assertRaises(
+            inbound.MessageTooLarge,
+            inbound.read_message,
+            StringIO(text),
+            max_size = 2000
+        )
+
+
+class ProcessInboundEmailTests(AskbotTestCase):
+
+    def setUp(self):
+        self.u1 = self.create_user('user1', status = 'a')
+        self.u1.email = 'user1@domain.com'
+        self.u1.save()
+        #comment to own question does not need reputation
+        self.question = self.post_question(user = self.u1)
+        self.maildir_path = tempfile.mkdtemp()
+        self.maildir = mailbox.Maildir(
+                            os.path.join(self.maildir_path, 'inbox'),
+                            factory = None
+                        )
+        self.old_hostname = askbot_settings.REPLY_BY_EMAIL_HOSTNAME
+        askbot_settings.update('REPLY_BY_EMAIL_HOSTNAME', 'example.com')
+
+    def tearDown(self):
+        askbot_settings.update('REPLY_BY_EMAIL_HOSTNAME', self.old_hostname)
+        shutil.rmtree(self.maildir_path)
+
+    def test_maildir_reply_is_posted(self):
+        reply_address = ReplyAddress.objects.create_new(
+                                        post = self.question,
+                                        user = self.u1,
+                                        reply_action = 'post_comment'
+                                    )
+        reply_separator = const.REPLY_SEPARATOR_TEMPLATE % {
+                                    'user_action': 'john did something',
+                                    'instruction': 'reply above this line'
+                                }
+        text = make_mime_message(
+            'This is a maildir reply\n\n\nOn such and such someone wrote\n'
+            + reply_separator + '\n' + reply_address.address + '\nYours Truly',
+            to_address = reply_address.as_email_address()
+        )
+        self.maildir.add(text)
+        management.call_command(
+            'process_inbound_email',
+            maildir = self.maildir._path
+        )
+        comments = self.question.comments.all()
+        self.assertEqual(len(comments), 1)
+        self.assertEqual(comments[0].text.strip(), 'This is a maildir reply')
+        self.assertEqual(len(self.maildir), 0)
+
+    def test_lamson_message_is_spooled(self):
+        django_settings.ASKBOT_INBOUND_EMAIL_MAILDIR = self.maildir._path
+        try:
+            msg = MockMessage('some text', self.u1.email)
+            msg.To = 'reply-abc@example.com'
+            msg.original = make_mime_message('some text')
+            ASK(msg, host = 'example.com', addr = 'reply-abc')
+            PROCESS(msg, host = 'example.com', address = 'abc')
+        finally:
+            del django_settings.ASKBOT_INBOUND_EMAIL_MAILDIR
+        self.assertEqual(len(self.maildir), 1)
+        self.assertEqual(
+            self.maildir.values()[0]['X-Original-To'],
+            'reply-abc@example.com'
+        )
+
+    def test_spooled_message_is_delivered_to_envelope_recipient(self):
+        reply_address = ReplyAddress.objects.create_new(
+                                        post = self.question,
+                                        user = self.u1,
+                                        reply_action = 'post_comment'
+                                    )
+        reply_separator = const.REPLY_SEPARATOR_TEMPLATE % {
+                                    'user_action': 'john did something',
+                                    'instruction': 'reply above this line'
+                                }
+        #sent to a mailing list, with a copy to the forum,
+        #the reply address is only in the envelope
+        text = make_mime_message(
+            'This is a list reply\n\n\nOn such and such someone wrote\n'
+            + reply_separator + '\n' + reply_address.address + '\nYours Truly',
+            to_address = 'list@lists.example.org'
+        )
+        text = text.replace('\nTo: ', '\nCc: ask@example.com\nTo: ', 1)
+        django_settings.ASKBOT_INBOUND_EMAIL_MAILDIR = self.maildir._path
+        try:
+            msg = MockMessage('some text', self.u1.email)
+            msg.To = reply_address.as_email_address()
+            msg.original = text
+            ASK(msg, host = 'example.com', addr = 'reply-' + reply_address.address)
+        finally:
+            del django_settings.ASKBOT_INBOUND_EMAIL_MAILDIR
+
+        question_count = Post.objects.get_questions().count()
+        management.call_command(
+            'process_inbound_email',
+            maildir = self.maildir._path
+        )
+        comments = self.question.comments.all()
+        self.assertEqual(len(comments), 1)
+        self.assertEqual(comments[0].text.strip(), 'This is a list reply')
+        self.assertEqual(Post.objects.get_questions().count(), question_count)
+        self.assertEqual(len(self.maildir), 0)
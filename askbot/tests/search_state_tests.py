@@ -1,7 +1,12 @@
 from askbot.tests.utils import AskbotTestCase
 from askbot.search.state_manager import SearchState
+from askbot.search import state_manager
+from askbot.search.postgresql import parse_query, get_matches_cache_key
+from askbot.search import result_cache
 import askbot.conf
 from django.core import urlresolvers
+from django.core import cache
+from django.core.cache.backends.locmem import LocMemCache
 
 
 class SearchStateTests(AskbotTestCase):
@@ -291,3 +296,121 @@ class SearchStateTests(AskbotTestCase):
         )
 
 
+    def test_cursor_in_query_string(self):
+        ss = self._ss().change_page(3, 'Zi0tbGFzdA')
+        self.assertEqual(
+            'scope:all/sort:activity-desc/page:3/cursor:Zi0tbGFzdA/',
+            ss.query_string()
+        )
+        #any change of the search state restarts the listing
+        self.assertEqual(
+            'scope:all/sort:age-desc/page:1/',
+            ss.change_sort('age-desc').query_string()
+        )
+        self.assertEqual(
+            'scope:all/sort:activity-desc/tags:one/page:1/',
+            ss.add_tag('one').query_string()
+        )
+
+    def test_add_tag_url(self):
+        states = [
+            self._ss(),
+            self._ss(query='alfa #beta', tags='tag1, tag2'),
+            self._ss(tags='tag1').change_page(3, 'Zi0tbGFzdA'),
+        ]
+        for ss in states:
+            for tag in ('tag1', 'new-tag', u'\u0442\u044d\u0433'):
+                self.assertEqual(
+                    ss.add_tag(tag).full_url(),
+                    ss.add_tag_url(tag)
+                )
+                #second call is served from the memo
+                self.assertEqual(
+                    ss.add_tag(tag).full_url(),
+                    ss.add_tag_url(tag)
+                )
+
+    def test_add_tag_url_not_shared_with_copies(self):
+        ss = self._ss()
+        ss.add_tag_url('one')
+        ss2 = ss.add_tag('two')
+        self.assertEqual(
+            urlresolvers.reverse('questions') + \
+                'scope:all/sort:activity-desc/tags:two,one/page:1/',
+            ss2.add_tag_url('one')
+        )
+
+
+    def test_parse_query_prefers_bracketed_title(self):
+        query_bits = state_manager.parse_query(
+            'title:"second" text [title: first] [title: third] #tag'
+        )
+        self.assertEqual(query_bits['query_title'], 'first')
+        self.assertEqual(query_bits['stripped_query'], 'title:"second" text')
+        self.assertEqual(query_bits['query_tags'], ['tag'])
+
+    def test_parse_query_drops_repeated_values(self):
+        query_bits = state_manager.parse_query(
+            '#one [one] [tag: two] @anna [user:anna] user:"karl  marx" @"karl marx"'
+        )
+        self.assertEqual(query_bits['query_tags'], ['one', 'two'])
+        self.assertEqual(query_bits['query_users'], ['anna', 'karl marx'])
+        self.assertEqual(query_bits['stripped_query'], '')
+
+    def test_changes_return_new_search_states(self):
+        ss = self._ss(query='alfa', tags='tag1').change_page(2)
+        url = ss.full_url()
+        changed_states = (
+            ss.add_tag('tag2'),
+            ss.remove_tags(),
+            ss.change_scope('unanswered'),
+            ss.change_sort('age-desc'),
+            ss.change_page(3),
+        )
+        self.assertEqual(ss.full_url(), url)
+        self.assertListEqual(ss.tags, ['tag1'])
+        self.assertEqual(ss.page, 2)
+        for changed_ss in changed_states:
+            self.assertNotEqual(changed_ss.full_url(), url)
+        self.assertEqual(
+            changed_states[0].query_string(),
+            'scope:all/sort:activity-desc/query:alfa/tags:tag1,tag2/page:1/'
+        )
+        self.assertEqual(
+            changed_states[-1].query_string(),
+            'scope:all/sort:activity-desc/query:alfa/tags:tag1/page:3/'
+        )
+
+class PostgresqlQueryParserTests(AskbotTestCase):
+
+    def test_words_are_required(self):
+        self.assertEqual(parse_query('World hello'), 'hello & world')
+        self.assertEqual(parse_query('hello world'), 'hello & world')
+
+    def test_prefix_phrase_and_excluded_parts(self):
+        self.assertEqual(
+            parse_query('foo* -bar "New York" baz'),
+            '(new <-> york) & baz & foo:* & !bar'
+        )
+        self.assertEqual(parse_query('foo-bar*'), '(foo <-> bar:*)')
+        self.assertEqual(parse_query('"a b" -"c d"', '&'), '(a & b) & !(c & d)')
+        self.assertEqual(
+            parse_query(u'\u0442\u044d\u0433 "unclosed phrase'),
+            u'(unclosed <-> phrase) & \u0442\u044d\u0433'
+        )
+
+    def test_nothing_to_search(self):
+        self.assertEqual(parse_query('-only'), None)
+        self.assertEqual(parse_query('!!! *** "" &|'), None)
+
+    def test_matches_are_cached_until_content_changes(self):
+        old_cache = cache.cache
+        cache.cache = LocMemCache('', {})
+        try:
+            key = get_matches_cache_key('hello & world')
+            self.assertEqual(key, get_matches_cache_key('hello & world'))
+            self.assertNotEqual(key, get_matches_cache_key('hello'))
+            result_cache.increment_content_version()
+            self.assertNotEqual(key, get_matches_cache_key('hello & world'))
+        finally:
+            cache.cache = old_cache
@@ -65,6 +65,7 @@ urlpatterns = patterns('',
             r'(%s)?' % r'/tags:(?P<tags>[\w+.#,-]+)' + # Should match: const.TAG_CHARS + ','; TODO: Is `#` char decoded by the time URLs are processed ??
             r'(%s)?' % r'/author:(?P<author>\d+)' +
             r'(%s)?' % r'/page:(?P<page>\d+)' +
+            r'(%s)?' % r'/cursor:(?P<cursor>[\w\-]+)' + # position token of the keyset paginator
         r'/$'),
 
         views.readers.questions, 
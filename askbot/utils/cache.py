@@ -1,9 +1,14 @@
 """Utilities for working with Django Models."""
 import itertools
 
+from django.conf import settings as django_settings
 from django.contrib.contenttypes.models import ContentType
+from django.core import cache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
 
-from askbot.utils.lists import flatten
+from askbot import const
+from askbot.utils.lists import batch_size, flatten
 
 def fetch_model_dict(model, ids, fields=None):
     """
@@ -90,3 +95,87 @@ def populate_content_object_caches(generic_related_objects, model_fields=None):
     for obj in generic_related_objects:
         obj._object_cache = objects[obj.content_type_id][obj.object_id]
         obj._content_type_cache = content_types[obj.content_type_id]
+
+def is_shared_with_celery_workers():
+    """True if the values put into the cache can be read by the
+    celery tasks - the cache keeps the values and is not local to the
+    process, or the tasks run in the same process (CELERY_ALWAYS_EAGER)
+    """
+    if isinstance(cache.cache, DummyCache):
+        return False
+    if isinstance(cache.cache, LocMemCache):
+        return getattr(django_settings, 'CELERY_ALWAYS_EAGER', False)
+    return True
+
+
+class PendingIds(object):
+    """ids of the objects with changes kept in the cache, which
+    are saved to the database together by one celery task
+
+    the cache has no sets, so the ids are put into a sequence of
+    keys, the task takes the ids from the last saved position
+    to the end of the sequence; a marked flag keeps an id
+    from being added again, until the task takes it. The flag
+    expires by itself, should the id be lost - e.g. if the task
+    reads the sequence between the two cache calls of :meth:`add`
+    """
+    def __init__(self, prefix):
+        self.seq_key = prefix + '-seq'
+        self.saved_seq_key = prefix + '-saved-seq'
+        self.item_key_tpl = prefix + '-%d'
+        self.marked_key_tpl = prefix + '-marked-%d'
+        self.scheduled_key = prefix + '-scheduled'
+
+    def add(self, item_id, timeout):
+        """adds the id, unless it is added already,
+        ``timeout`` is the life time of the marked flag"""
+        if not cache.cache.add(self.marked_key_tpl % item_id, True, timeout):
+            return
+        try:
+            seq = cache.cache.incr(self.seq_key)
+        except ValueError:
+            if cache.cache.add(self.seq_key, 1, const.LONG_TIME):
+                seq = 1
+            else:
+                seq = cache.cache.incr(self.seq_key)
+        cache.cache.set(self.item_key_tpl % seq, item_id, const.LONG_TIME)
+
+    def schedule(self, task, delay):
+        """runs the celery ``task`` in ``delay`` seconds,
+        unless it is scheduled already"""
+        #the flag expires by itself, should the task get lost
+        if cache.cache.add(self.scheduled_key, True, 2 * delay):
+            task.apply_async(countdown = delay)
+
+    def unschedule(self):
+        """called by the task, changes from now on
+        must schedule it again"""
+        cache.cache.delete(self.scheduled_key)
+
+    def pop_all(self):
+        """returns the ids added since the last call
+        and forgets them"""
+        last_seq = cache.cache.get(self.seq_key) or 0
+        saved_seq = cache.cache.get(self.saved_seq_key) or 0
+        if saved_seq > last_seq:
+            #the sequence was evicted and restarted
+            saved_seq = 0
+        cache.cache.set(self.saved_seq_key, last_seq, const.LONG_TIME)
+        item_keys = [
+            self.item_key_tpl % seq
+            for seq in xrange(saved_seq + 1, last_seq + 1)
+        ]
+        item_ids = set()
+        for key_batch in batch_size(item_keys, 1000):
+            item_ids.update(cache.cache.get_many(key_batch).values())
+            cache.cache.delete_many(key_batch)
+        item_ids = list(item_ids)
+        self.clear_marks(item_ids)
+        return item_ids
+
+    def clear_marks(self, item_ids):
+        """changes from now on add the ids again"""
+        for id_batch in batch_size(item_ids, 1000):
+            cache.cache.delete_many([
+                self.marked_key_tpl % item_id for item_id in id_batch
+            ])
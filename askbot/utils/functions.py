@@ -125,6 +125,22 @@ def setup_paginator(context):
     Inspired from http://blog.localkinegrinds.com/2007/09/06/digg-style-pagination-in-django/
     """
     if (context["is_paginated"]):
+        if context.get("is_keyset"):
+            #keyset paginator knows only the neighbouring pages
+            return {
+                "base_url": context["base_url"],
+                "is_paginated": context["is_paginated"],
+                "is_keyset": True,
+                "previous": context["previous"],
+                "previous_cursor": context["previous_cursor"],
+                "has_previous": context["has_previous"],
+                "next": context["next"],
+                "next_cursor": context["next_cursor"],
+                "has_next": context["has_next"],
+                "page": context["page"],
+                "pages": context["pages"],
+            }
+
         " Initialize variables "
         in_leading_range = in_trailing_range = False
         pages_outside_leading_range = pages_outside_trailing_range = range(0)
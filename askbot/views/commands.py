@@ -263,7 +263,7 @@ def vote(request, id):
                     request.user.accept_best_answer(answer)
 
                 ####################################################################
-                answer.thread.update_summary_html() # regenerate question/thread summary html
+                answer.thread.schedule_summary_html_update() # regenerate question/thread summary html
                 ####################################################################
 
             else:
@@ -298,7 +298,7 @@ def vote(request, id):
 
             ####################################################################
             if vote_type in ('1', '2'): # up/down-vote question
-                post.thread.update_summary_html() # regenerate question/thread summary html
+                post.thread.schedule_summary_html_update() # regenerate question/thread summary html
             ####################################################################
 
         elif vote_type in ['7', '8']:
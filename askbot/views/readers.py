@@ -10,8 +10,10 @@ from askbot import const, exceptions, models, schedules
 from askbot.conf import settings as askbot_settings
 from askbot.forms import AnswerForm, ShowQuestionForm
 from askbot.models import Post, Vote
+from askbot.models.question import QUESTION_ORDER_BY_MAP, KEYSET_SORT_METHODS
 from askbot.models.signals import search_askbot_signal
 from askbot.models.tag import Tag
+from askbot.search.keyset_paginator import KeysetPaginator
 from askbot.search.state_manager import SearchState, DummySearchState
 from askbot.skins.loaders import render_into_skin, \
     get_template #jinja2 template loading enviroment
@@ -81,21 +83,40 @@ def questions(request, **kwargs):
     search_state = SearchState(user_logged_in=request.user.is_authenticated(), **kwargs)
     page_size = int(askbot_settings.DEFAULT_QUESTIONS_PAGE_SIZE)
 
-    qs, meta_data = models.Thread.objects.run_advanced_search(request_user=request.user, search_state=search_state)
+    use_keyset_pagination = askbot_settings.QUESTIONS_LIST_KEYSET_PAGINATION \
+                        and search_state.sort in KEYSET_SORT_METHODS
+
+    if use_keyset_pagination:
+        qs, meta_data = models.Thread.objects.run_advanced_search(request_user=request.user, search_state=search_state)
+    else:
+        #order of the threads on the first pages is cached
+        qs, meta_data = models.Thread.objects.run_cached_search(request_user=request.user, search_state=search_state, page_size=page_size)
 
     if meta_data['non_existing_tags']:
         search_state = search_state.remove_tags(meta_data['non_existing_tags'])
 
-    paginator = Paginator(qs, page_size)
-    if paginator.num_pages < search_state.page:
-        search_state.page = 1
-    page = paginator.page(search_state.page)
+    if use_keyset_pagination:
+        #page cost does not depend on the page depth, count is approximate
+        paginator = KeysetPaginator(
+                        qs,
+                        order_by=QUESTION_ORDER_BY_MAP[search_state.sort],
+                        per_page=page_size
+                    )
+        page = paginator.page(search_state.page, search_state.cursor)
+        if page.number != search_state.page:
+            search_state = search_state.change_page(page.number, search_state.cursor)
+    else:
+        paginator = Paginator(qs, page_size)
+        if paginator.num_pages < search_state.page:
+            search_state = search_state.change_page(1)
+        page = paginator.page(search_state.page)
 
-    page.object_list = list(page.object_list) # evaluate queryset
+        page.object_list = list(page.object_list) # evaluate queryset
 
-    # INFO: Because for the time being we need question posts and thread authors
-    #       down the pipeline, we have to precache them in thread objects
-    models.Thread.objects.precache_view_data_hack(threads=page.object_list)
+    # INFO: Summaries of all threads on the page are fetched from the cache at once,
+    #       question posts and thread authors are precached only for those
+    #       summaries that have to be rendered
+    models.Thread.objects.precache_summary_html(threads=page.object_list)
 
     related_tags = Tag.objects.get_related_to_search(threads=page.object_list, ignored_tag_names=meta_data.get('ignored_tag_names', []))
     tag_list_type = askbot_settings.TAG_LIST_FORMAT
@@ -116,6 +137,9 @@ def questions(request, **kwargs):
 
         'base_url' : search_state.query_string(),
         'page_size' : page_size,
+        'is_keyset': use_keyset_pagination,
+        'previous_cursor': getattr(page, 'previous_cursor', None),
+        'next_cursor': getattr(page, 'next_cursor', None),
     }
 
     # We need to pass the rss feed url based